@@ -0,0 +1,207 @@
+
+"""
+Cache des réponses des endpoints de prédiction
+
+Les réponses sont indexées par endpoint et par requête normalisée, expirent
+après un TTL propre à chaque endpoint et sont bornées en nombre et en taille
+approximative (éviction LRU). Un nouveau modèle ou une nouvelle synchronisation des données invalide
+les endpoints concernés.
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+# TTL par endpoint (secondes)
+DEFAULT_TTLS = {
+    'predict': float(os.getenv('CACHE_TTL_PREDICT', '300')),
+    'trends': float(os.getenv('CACHE_TTL_TRENDS', '900')),
+    'carbon': float(os.getenv('CACHE_TTL_CARBON', '3600')),
+}
+DEFAULT_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '256'))
+DEFAULT_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Endpoints dépendant de chaque modèle ou source de données
+MODEL_ENDPOINTS = {
+    'velib_lstm': ('predict',),
+    'trends_prophet': ('trends',),
+    'carbon_rf': ('carbon',),
+    'station_prophet': ('trends',),
+}
+DATA_SYNC_ENDPOINTS = ('predict', 'trends')
+
+def estimate_size(value: Any) -> int:
+    """
+    Taille approximative (octets) d'une réponse en cache
+
+    Exacte pour les corps déjà encodés ; pour les modèles, taille JSON estimée
+    sans sérialisation, les listes étant extrapolées depuis leur premier
+    élément (éléments homogènes : stations, heures, trajets).
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, BaseModel):
+        value = value.__dict__
+    if isinstance(value, dict):
+        return sum(len(str(field)) + estimate_size(item) for field, item in value.items()) + 2
+    if isinstance(value, (list, tuple)):
+        return len(value) * (estimate_size(value[0]) + 1) + 2 if value else 2
+    return 8
+
+class LRUCacheBackend:
+    """Stockage en mémoire borné en nombre d'entrées et en octets, avec expiration"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # clé -> (expiration, valeur, taille estimée)
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[float, Any, int]]' = OrderedDict()
+
+    def _pop(self, key: Tuple[str, str]):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def get(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Tuple[str, str], value: Any, ttl: float):
+        if key in self._entries:
+            self._pop(key)
+        size = estimate_size(value)
+        # Une réponse plus grosse que tout le budget n'est pas conservée
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def clear(self, endpoint: Optional[str] = None):
+        if endpoint is None:
+            self._entries.clear()
+            self.bytes = 0
+            return
+        for key in [key for key in self._entries if key[0] == endpoint]:
+            self._pop(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def normalize_request(request: BaseModel) -> str:
+    """Clé canonique d'une requête : champs triés, listes d'IDs triées et dédupliquées"""
+    payload = request.model_dump(mode='json')
+    for field, value in payload.items():
+        if field.endswith('_ids') and isinstance(value, list):
+            payload[field] = sorted(set(value))
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'))
+
+class ResponseCache:
+    def __init__(self, backend: Optional[LRUCacheBackend] = None, ttls: Optional[Dict[str, float]] = None):
+        self.backend = backend or LRUCacheBackend()
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.stats = {endpoint: {'hits': 0, 'misses': 0, 'invalidations': 0} for endpoint in self.ttls}
+        self._generations = {endpoint: 0 for endpoint in self.ttls}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def get_or_compute(self, endpoint: str, request: BaseModel,
+                             compute: Callable[[], Awaitable[Any]], variant: str = '') -> Any:
+        """
+        Retourner la réponse en cache ou la calculer une seule fois pour les requêtes simultanées
+
+        `variant` distingue les représentations d'une même requête (format de réponse).
+        """
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return await compute()
+
+        key = (endpoint, variant + normalize_request(request))
+        cached = self.backend.get(key)
+        if cached is not None:
+            self.stats[endpoint]['hits'] += 1
+            return cached
+
+        # Une requête identique est déjà en cours de calcul : on attend son résultat
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats[endpoint]['hits'] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Calcul abandonné par le premier appelant (client déconnecté, timeout) :
+                # le relancer, sauf si c'est cet appel-ci qui est annulé
+                if not inflight.cancelled():
+                    raise
+                return await self.get_or_compute(endpoint, request, compute, variant)
+
+        self.stats[endpoint]['misses'] += 1
+        generation = self._generations[endpoint]
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            # Exception déjà propagée à l'appelant : éviter l'avertissement "never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            # Ne pas publier un résultat calculé avant une invalidation
+            if generation == self._generations[endpoint]:
+                self.backend.set(key, result, ttl)
+            return result
+        finally:
+            # Premier appelant annulé (CancelledError n'est pas une Exception) : débloquer les appels en attente
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    def invalidate(self, *endpoints: str):
+        """Vider le cache des endpoints donnés (tous si aucun)"""
+        for endpoint in endpoints or tuple(self.ttls):
+            self._generations[endpoint] += 1
+            self.stats[endpoint]['invalidations'] += 1
+            self.backend.clear(endpoint)
+
+    def on_model_loaded(self, name: str, version: str):
+        """Listener du registre de modèles"""
+        self.invalidate(*MODEL_ENDPOINTS.get(name, ()))
+
+    def on_data_synced(self, rows_added: int):
+        """Listener du store historique"""
+        if rows_added:
+            self.invalidate(*DATA_SYNC_ENDPOINTS)
+
+    def status(self) -> Dict[str, Any]:
+        """Compteurs de hits/misses pour /health/cache"""
+        endpoints = {}
+        for endpoint, counters in self.stats.items():
+            lookups = counters['hits'] + counters['misses']
+            endpoints[endpoint] = {
+                **counters,
+                'ttl_seconds': self.ttls[endpoint],
+                'hit_rate': round(counters['hits'] / lookups, 3) if lookups else None
+            }
+        return {
+            'entries': len(self.backend),
+            'max_entries': self.backend.max_entries,
+            'bytes': self.backend.bytes,
+            'max_bytes': self.backend.max_bytes,
+            'endpoints': endpoints
+        }
+
+# Instance globale
+response_cache = ResponseCache()
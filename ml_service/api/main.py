@@ -1,14 +1,81 @@
 
+import time
+from src.utils.startup_report import import_profiler
+
+# Mesure du coût des imports (avant tout import lourd)
+import_profiler.install()
+STARTED_AT = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import predictions, health
+from api.cache import response_cache
+from api.metrics import PrometheusMiddleware, metrics_response
+from src.utils.data_loader import data_loader, history_store
+from src.model_registry import model_registry
+from src.emission_factors import emission_factors
+from src.station_index import station_index
+from src.station_matrix import station_matrix
+from src.predict_availability import forecast_scheduler
+from src.executors import executors
 import uvicorn
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ressources partagées pendant toute la durée de vie de l'application"""
+    # Client HTTP Supabase mutualisé (pool keep-alive, HTTP/2)
+    await data_loader.open()
+    
+    # Invalidation du cache des réponses à chaque nouveau modèle ou sync de données
+    model_registry.add_listener(response_cache.on_model_loaded)
+    history_store.add_listener(response_cache.on_data_synced)
+    forecast_scheduler.add_listener(lambda snapshot: response_cache.invalidate('predict', 'carbon'))
+    model_registry.add_listener(forecast_scheduler.request_refresh)
+    emission_factors.add_listener(lambda table: response_cache.invalidate('carbon'))
+    station_index.add_listener(lambda index: response_cache.invalidate('carbon'))
+    
+    # Modèles chargés à leur première utilisation (sauf MODEL_PRELOAD), puis rechargés à chaud si models/ change
+    await model_registry.preload()
+    model_registry.start_watching()
+    
+    # Facteurs d'émission préchargés, relus toutes les EMISSION_FACTORS_TTL secondes
+    await emission_factors.refresh()
+    emission_factors.start_watching()
+    
+    # Index spatial des stations et matrice des distances, reconstruits si velib_stations change
+    await station_index.refresh()
+    await station_matrix.refresh(station_index.index)
+    station_index.add_listener(station_matrix.on_index_built)
+    station_index.start_watching()
+    
+    # Workers du pool de processus démarrés avant la première requête
+    await executors.warm_up(['src.analyze_trends'])
+    
+    # Prévisions toutes stations recalculées en arrière-plan
+    forecast_scheduler.start()
+    
+    # Coût des imports par module et mémoire résidente au démarrage
+    import_profiler.print_report(elapsed=time.perf_counter() - STARTED_AT)
+    # Fin de la mesure : les chargements paresseux sont mesurés par le registre de modèles
+    import_profiler.uninstall()
+    try:
+        yield
+    finally:
+        await forecast_scheduler.stop()
+        await model_registry.stop_watching()
+        model_registry.close()
+        await emission_factors.stop_watching()
+        await station_index.stop_watching()
+        await data_loader.close()
+        executors.shutdown()
+
 # Création de l'application FastAPI
 app = FastAPI(
     title="EcoTrajet ML API",
     description="API de prédictions ML pour EcoTrajet",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuration CORS
@@ -20,6 +87,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latence des requêtes par route (Prometheus)
+app.add_middleware(PrometheusMiddleware)
+
 # Routes
 app.include_router(health.router, prefix="/health", tags=["Health"])
 app.include_router(predictions.router, prefix="/api/v1", tags=["Predictions"])
@@ -31,9 +101,15 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "predictions": "/api/v1/predictions"
+            "predictions": "/api/v1/predictions",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métriques Prometheus (latences, étapes, Supabase, modèles, cache)"""
+    return metrics_response()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
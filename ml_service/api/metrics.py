@@ -0,0 +1,126 @@
+
+"""
+Instrumentation Prometheus de l'API
+
+- `PrometheusMiddleware` : latence de chaque requête par route (gabarit du
+  chemin, pas l'URL brute, pour borner la cardinalité) et code de statut.
+- `InstrumentedRoute` : sépare le temps du handler de celui de la
+  validation/sérialisation Pydantic de la réponse.
+- `CacheCollector` : expose les compteurs du cache des réponses au moment du
+  scrape, sans coût sur le chemin des requêtes.
+"""
+
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from api.cache import ResponseCache, response_cache
+from src.utils.metrics import HTTP_REQUEST_SECONDS, STAGE_SECONDS
+
+# Instant de fin du handler de la requête en cours
+_handler_end: ContextVar[Optional[Dict[str, float]]] = ContextVar('handler_end', default=None)
+
+class PrometheusMiddleware:
+    """Middleware ASGI mesurant la latence des requêtes HTTP"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # La route est renseignée dans le scope par le routeur
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            HTTP_REQUEST_SECONDS.labels(scope['method'], route, str(status)).observe(time.perf_counter() - start)
+
+def _mark_handler_end(endpoint: Callable) -> Callable:
+    """Envelopper un endpoint async pour noter l'instant où il rend la main"""
+    @wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            marks = _handler_end.get()
+            if marks is not None:
+                marks['end'] = time.perf_counter()
+    return wrapper
+
+class InstrumentedRoute(APIRoute):
+    """Route mesurant les étapes `handler` et `serialize` (validation et rendu JSON de la réponse)"""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        super().__init__(path, _mark_handler_end(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        handler_stage = STAGE_SECONDS.labels(self.name, 'handler')
+        serialize_stage = STAGE_SECONDS.labels(self.name, 'serialize')
+
+        async def instrumented_handler(request: Request) -> Response:
+            marks: Dict[str, float] = {}
+            token = _handler_end.set(marks)
+            start = time.perf_counter()
+            try:
+                response = await handler(request)
+            finally:
+                _handler_end.reset(token)
+            if 'end' in marks:
+                handler_stage.observe(marks['end'] - start)
+                serialize_stage.observe(time.perf_counter() - marks['end'])
+            return response
+
+        return instrumented_handler
+
+class CacheCollector:
+    """Compteurs du cache des réponses lus à chaque scrape"""
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+
+    def collect(self):
+        lookups = CounterMetricFamily('ecotrajet_cache_lookups', "Consultations du cache des réponses",
+                                      labels=['endpoint', 'result'])
+        invalidations = CounterMetricFamily('ecotrajet_cache_invalidations', "Invalidations du cache des réponses",
+                                            labels=['endpoint'])
+        hit_ratio = GaugeMetricFamily('ecotrajet_cache_hit_ratio', "Taux de hits du cache depuis le démarrage",
+                                      labels=['endpoint'])
+        for endpoint, counters in self.cache.stats.items():
+            lookups.add_metric([endpoint, 'hit'], counters['hits'])
+            lookups.add_metric([endpoint, 'miss'], counters['misses'])
+            invalidations.add_metric([endpoint], counters['invalidations'])
+            total = counters['hits'] + counters['misses']
+            if total:
+                hit_ratio.add_metric([endpoint], counters['hits'] / total)
+        yield lookups
+        yield invalidations
+        yield hit_ratio
+        yield GaugeMetricFamily('ecotrajet_cache_entries', "Entrées présentes dans le cache des réponses",
+                                value=len(self.cache.backend))
+        yield GaugeMetricFamily('ecotrajet_cache_bytes', "Taille approximative (octets) des réponses en cache",
+                                value=self.cache.backend.bytes)
+
+REGISTRY.register(CacheCollector(response_cache))
+
+def metrics_response() -> Response:
+    """Exposition au format texte Prometheus"""
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1,6 +1,6 @@
 
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 
 # === VELIB AVAILABILITY PREDICTION ===
@@ -30,6 +30,34 @@ class VelibAvailabilityResponse(BaseModel):
     prediction_accuracy: float
     generated_at: datetime
 
+# === NEARBY STATIONS ===
+
+class NearbyStationsRequest(BaseModel):
+    lat: float = Field(..., description="Latitude du point de recherche")
+    lng: float = Field(..., description="Longitude du point de recherche")
+    k: int = Field(5, description="Nombre maximal de stations", ge=1, le=50)
+    radius_km: Optional[float] = Field(None, description="Rayon de recherche (km)", gt=0, le=20)
+    hours_ahead: int = Field(0, description="Heure de la disponibilité prévue (0 : heure courante)", ge=0, le=168)
+    min_bikes: int = Field(0, description="Vélos prévus minimum", ge=0)
+    min_docks: int = Field(0, description="Bornes libres prévues minimum", ge=0)
+
+class NearbyStation(BaseModel):
+    station_id: int
+    station_name: str
+    lat: float
+    lng: float
+    capacity: int
+    distance_km: float
+    predicted_bikes: Optional[int] = None
+    predicted_docks: Optional[int] = None
+    risk_level: Optional[str] = None
+
+class NearbyStationsResponse(BaseModel):
+    stations: List[NearbyStation]
+    index_version: int
+    forecast_base_time: Optional[datetime] = None
+    generated_at: datetime
+
 # === TRENDS ANALYSIS ===
 
 class TrendsAnalysisRequest(BaseModel):
@@ -50,6 +78,17 @@ class TrendsAnalysisResponse(BaseModel):
     forecasting: Optional[Dict[str, Any]] = None
     generated_at: datetime
 
+class StationTrendDay(BaseModel):
+    date: str
+    low_availability_share: float = Field(..., description="Part prévue des snapshots en faible disponibilité")
+    critical: bool
+
+class StationTrendForecastResponse(BaseModel):
+    station_id: int
+    forecast: List[StationTrendDay]
+    model_trained_at: str
+    generated_at: datetime
+
 # === CARBON FOOTPRINT CALCULATION ===
 
 class CarbonCalculationRequest(BaseModel):
@@ -77,3 +116,39 @@ class CarbonCalculationResponse(BaseModel):
     carbon_savings: Dict[str, float]
     recommendations: List[str]
     generated_at: datetime
+
+# === CARBON FOOTPRINT BATCH CALCULATION ===
+
+class CarbonBatchRequest(BaseModel):
+    """Trajets au format colonnaire : la i-ème valeur de chaque liste décrit le trajet i"""
+    origin_lat: List[float] = Field(..., min_length=1, max_length=100000, description="Latitudes de départ")
+    origin_lng: List[float] = Field(..., min_length=1, max_length=100000, description="Longitudes de départ")
+    destination_lat: List[float] = Field(..., min_length=1, max_length=100000, description="Latitudes de destination")
+    destination_lng: List[float] = Field(..., min_length=1, max_length=100000, description="Longitudes de destination")
+
+    @model_validator(mode='after')
+    def check_same_length(self):
+        lengths = {len(self.origin_lat), len(self.origin_lng), len(self.destination_lat), len(self.destination_lng)}
+        if len(lengths) != 1:
+            raise ValueError("Toutes les listes de coordonnées doivent avoir la même longueur")
+        return self
+
+class CarbonStationBatchRequest(BaseModel):
+    """Trajets entre stations Vélib' : la i-ème origine va vers la i-ème destination"""
+    origin_station_ids: List[int] = Field(..., min_length=1, max_length=100000, description="Stations de départ")
+    destination_station_ids: List[int] = Field(..., min_length=1, max_length=100000, description="Stations d'arrivée")
+
+    @model_validator(mode='after')
+    def check_same_length(self):
+        if len(self.origin_station_ids) != len(self.destination_station_ids):
+            raise ValueError("Les listes de stations de départ et d'arrivée doivent avoir la même longueur")
+        return self
+
+class CarbonBatchResponse(BaseModel):
+    count: int
+    modes: List[str]
+    distance_km: List[float]
+    options: Dict[str, Dict[str, List[Union[int, float]]]]  # mode -> métrique -> valeurs par trajet
+    best_eco_mode: List[str]
+    co2_savings_vs_car_kg: List[float]
+    generated_at: datetime
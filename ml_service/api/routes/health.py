@@ -1,6 +1,15 @@
 
 from fastapi import APIRouter
 from datetime import datetime
+from api.cache import response_cache
+from src.utils.data_loader import data_loader
+from src.model_registry import model_registry
+from src.emission_factors import emission_factors
+from src.station_index import station_index
+from src.station_matrix import station_matrix
+from src.predict_availability import forecast_scheduler
+from src.executors import executors
+from src.utils.startup_report import import_profiler
 
 router = APIRouter()
 
@@ -16,9 +25,50 @@ async def health_check():
 @router.get("/models")
 async def models_status():
     """Vérification de l'état des modèles ML"""
-    # TODO: Implémenter la vérification des modèles
+    status = model_registry.status()
     return {
-        "velib_availability": "loaded",
-        "trends_analysis": "loaded", 
-        "carbon_calculation": "loaded"
+        "velib_availability": status["velib_lstm"],
+        "trends_analysis": status["trends_prophet"],
+        "carbon_calculation": status["carbon_rf"],
+        "station_trends": status["station_prophet"]
     }
+
+@router.get("/http-pool")
+async def http_pool_status():
+    """Utilisation du pool de connexions HTTP vers Supabase"""
+    return data_loader.pool_stats()
+
+@router.get("/cache")
+async def cache_status():
+    """Compteurs du cache des réponses de prédiction"""
+    return response_cache.status()
+
+@router.get("/emission-factors")
+async def emission_factors_status():
+    """Version des facteurs d'émission servie par les calculs carbone"""
+    return emission_factors.status()
+
+@router.get("/station-index")
+async def station_index_status():
+    """État de l'index spatial des stations"""
+    return station_index.status()
+
+@router.get("/station-matrix")
+async def station_matrix_status():
+    """Matrice des distances station à station (memory-mapping)"""
+    return station_matrix.status()
+
+@router.get("/forecasts")
+async def forecasts_status():
+    """État de l'instantané de prévisions matérialisé"""
+    return forecast_scheduler.status()
+
+@router.get("/executors")
+async def executors_status():
+    """Occupation des pools de threads et de processus (file, attente)"""
+    return executors.status()
+
+@router.get("/startup")
+async def startup_report():
+    """Coût des imports par module au démarrage et mémoire résidente"""
+    return import_profiler.report()
@@ -1,45 +1,168 @@
 
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from api.models.schemas import (
     VelibAvailabilityRequest, VelibAvailabilityResponse,
-    TrendsAnalysisRequest, TrendsAnalysisResponse,
-    CarbonCalculationRequest, CarbonCalculationResponse
+    NearbyStationsRequest, NearbyStationsResponse,
+    TrendsAnalysisRequest, TrendsAnalysisResponse, StationTrendForecastResponse,
+    CarbonCalculationRequest, CarbonCalculationResponse,
+    CarbonBatchRequest, CarbonBatchResponse, CarbonStationBatchRequest
 )
-from src.predict_availability import predict_velib_availability
-from src.analyze_trends import analyze_velib_trends
-from src.calculate_carbon import calculate_carbon_footprint
+from api.cache import response_cache
+from api.metrics import InstrumentedRoute
+from src.predict_availability import predict_velib_availability, predict_velib_availability_encoded, stream_velib_availability, nearby_stations
+from src.utils.serialization import LAYOUTS, LAYOUT_DEFAULT, LAYOUT_ROWS, LAYOUT_COLUMNAR
+from src.analyze_trends import analyze_velib_trends, forecast_station_trend
+from src.calculate_carbon import calculate_carbon_footprint, calculate_carbon_footprint_batch, calculate_carbon_footprint_station_batch
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
+
+# Types de média des dispositions de réponse rapides (négociées via Accept)
+LAYOUT_MEDIA_TYPES = {
+    LAYOUT_ROWS: "application/vnd.ecotrajet.rows+json",
+    LAYOUT_COLUMNAR: "application/vnd.ecotrajet.columnar+json",
+}
+
+def negotiate_layout(response_format: Optional[str], accept: Optional[str]) -> str:
+    """Disposition de réponse : paramètre `format` prioritaire, puis en-tête Accept"""
+    if response_format is not None:
+        if response_format not in LAYOUTS:
+            raise HTTPException(status_code=400, detail=f"Format inconnu: {response_format} (attendu: {', '.join(LAYOUTS)})")
+        return response_format
+    for layout, media_type in LAYOUT_MEDIA_TYPES.items():
+        if accept and media_type in accept:
+            return layout
+    return LAYOUT_DEFAULT
 
 @router.post("/predict/velib-availability", response_model=VelibAvailabilityResponse)
-async def predict_availability(request: VelibAvailabilityRequest):
+async def predict_availability(request: VelibAvailabilityRequest,
+                               response_format: Optional[str] = Query(None, alias="format", description="default, rows ou columnar"),
+                               accept: Optional[str] = Header(None)):
     """
     Prédiction de la disponibilité des vélos Vélib' par heure
+
+    `format=rows` (ou `Accept: application/vnd.ecotrajet.rows+json`) renvoie la
+    même structure sans validation Pydantic par ligne ; `format=columnar` (ou
+    `Accept: application/vnd.ecotrajet.columnar+json`) renvoie des tableaux
+    parallèles par station.
     """
+    layout = negotiate_layout(response_format, accept)
     try:
-        result = await predict_velib_availability(request)
-        return result
+        if layout == LAYOUT_DEFAULT:
+            return await response_cache.get_or_compute(
+                "predict", request, lambda: predict_velib_availability(request)
+            )
+        body = await response_cache.get_or_compute(
+            "predict", request, lambda: predict_velib_availability_encoded(request, layout), variant=layout
+        )
+        return Response(content=body, media_type=LAYOUT_MEDIA_TYPES[layout])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur de prédiction: {str(e)}")
 
+@router.post("/predict/velib-availability/stream")
+async def predict_availability_stream(request: VelibAvailabilityRequest,
+                                      response_format: Optional[str] = Query(None, alias="format", description="rows ou columnar")):
+    """
+    Prédiction de disponibilité en streaming NDJSON (`application/x-ndjson`)
+
+    Une ligne par station (`VelibStationPrediction`, ou tableaux parallèles
+    avec `format=columnar`, risque codé 0=low, 1=medium, 2=high), envoyée dès
+    que son lot est prédit.
+    """
+    layout = negotiate_layout(response_format, None)
+    if layout == LAYOUT_DEFAULT:
+        layout = LAYOUT_ROWS
+    
+    # Premier lot calculé avant l'envoi des en-têtes : une erreur initiale reste une 500
+    stream = stream_velib_availability(request, layout)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de prédiction: {str(e)}")
+    
+    async def body():
+        yield first
+        async for chunk in stream:
+            yield chunk
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@router.post("/stations/nearby", response_model=NearbyStationsResponse)
+async def stations_nearby(request: NearbyStationsRequest):
+    """
+    Stations Vélib' les plus proches d'un point, avec la disponibilité prévue
+    """
+    result = nearby_stations(request)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Index des stations non disponible")
+    return result
+
 @router.post("/analyze/trends", response_model=TrendsAnalysisResponse)
 async def analyze_trends(request: TrendsAnalysisRequest):
     """
     Analyse des tendances d'utilisation Vélib' sur 7 jours
     """
     try:
-        result = await analyze_velib_trends(request)
+        result = await response_cache.get_or_compute(
+            "trends", request, lambda: analyze_velib_trends(request)
+        )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur d'analyse: {str(e)}")
 
+@router.get("/stations/{station_id}/trend-forecast", response_model=StationTrendForecastResponse)
+async def station_trend_forecast(station_id: int, days: int = Query(7, ge=1, le=30)):
+    """
+    Part prévue de faible disponibilité d'une station (modèle Prophet de la station)
+    """
+    try:
+        result = await forecast_station_trend(station_id, days)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de prévision: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=503, detail="Modèles par station non disponibles")
+    return result
+
 @router.post("/calculate/carbon-footprint", response_model=CarbonCalculationResponse)
 async def calculate_carbon(request: CarbonCalculationRequest):
     """
     Calcul de l'empreinte carbone et suggestions de trajets
     """
     try:
-        result = await calculate_carbon_footprint(request)
+        result = await response_cache.get_or_compute(
+            "carbon", request, lambda: calculate_carbon_footprint(request)
+        )
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de calcul: {str(e)}")
+
+@router.post("/calculate/carbon-footprint/batch", response_model=CarbonBatchResponse)
+async def calculate_carbon_batch(request: CarbonBatchRequest):
+    """
+    Calcul de l'empreinte carbone de plusieurs trajets en une requête (réponse colonnaire)
+    """
+    try:
+        result = await calculate_carbon_footprint_batch(request)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de calcul: {str(e)}")
+
+@router.post("/calculate/carbon-footprint/stations", response_model=CarbonBatchResponse)
+async def calculate_carbon_stations(request: CarbonStationBatchRequest):
+    """
+    Calcul de l'empreinte carbone de trajets entre stations Vélib' (matrice des distances précalculée)
+    """
+    try:
+        result = await calculate_carbon_footprint_station_batch(request)
         return result
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur de calcul: {str(e)}")
@@ -0,0 +1,193 @@
+
+"""
+Serveur PostgREST local minimal pour les benchmarks
+
+Sert des DataFrames en mémoire sous `/rest/v1/<table>` avec le sous-ensemble
+de la syntaxe PostgREST utilisé par `DataLoader` : filtres `col=op.valeur`,
+arbres logiques `and=(...)` / `or=(...)`, `order`, `limit` et `select`, ainsi
+que la fonction `rpc/velib_availability_rollup` (supabase/migrations).
+"""
+
+import re
+import socket
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI, Request, Response
+
+_OPERATORS = {'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'in'}
+_RESERVED_PARAMS = {'order', 'limit', 'offset', 'select', 'and', 'or'}
+
+def _split_top_level(expression: str) -> List[str]:
+    """Découper `a,b(c,d),"e,f"` sur les virgules de premier niveau"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in expression:
+        if char == '"' and not current.endswith('\\'):
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    parts.append(current)
+    return parts
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return value
+
+def _coerce(series: pd.Series, value: str):
+    """Convertir la valeur du filtre dans le type de la colonne"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        timestamp = pd.Timestamp(value)
+        return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp
+    if pd.api.types.is_bool_dtype(series):
+        return value.lower() == 'true'
+    if pd.api.types.is_numeric_dtype(series):
+        return float(value)
+    return value
+
+def _compare(values: pd.Series, operator: str, raw: str) -> np.ndarray:
+    if operator == 'in':
+        items = [_coerce(values, _unquote(item)) for item in _split_top_level(raw.strip('()'))]
+        return values.isin(items).to_numpy()
+    value = _coerce(values, _unquote(raw))
+    return {
+        'eq': values == value, 'neq': values != value,
+        'gt': values > value, 'gte': values >= value,
+        'lt': values < value, 'lte': values <= value,
+    }[operator].to_numpy()
+
+def _filter(table: pd.DataFrame, index: np.ndarray, column: str, operator: str, raw: str) -> np.ndarray:
+    if operator not in _OPERATORS:
+        raise ValueError(f"Opérateur non supporté: {operator}")
+    return index[_compare(table[column].iloc[index], operator, raw)]
+
+def _evaluate(table: pd.DataFrame, index: np.ndarray, term: str) -> np.ndarray:
+    """Évaluer un terme (`col.op.val`, `and(...)`, `or(...)`) sur les lignes `index`"""
+    match = re.fullmatch(r'(and|or)\((.*)\)', term, flags=re.S)
+    if match:
+        return _evaluate_logical(table, index, match.group(1), match.group(2))
+    column, operator, raw = term.split('.', 2)
+    return _filter(table, index, column, operator, raw)
+
+def _evaluate_logical(table: pd.DataFrame, index: np.ndarray, kind: str, body: str) -> np.ndarray:
+    terms = _split_top_level(body)
+    if kind == 'and':
+        # Filtrage successif : les termes suivants ne voient que les lignes restantes
+        for term in terms:
+            index = _evaluate(table, index, term)
+        return index
+    return np.unique(np.concatenate([_evaluate(table, index, term) for term in terms]))
+
+def _order(table: pd.DataFrame, index: np.ndarray, order: str, presorted: Tuple[str, ...]) -> np.ndarray:
+    columns, ascending = [], []
+    for item in order.split(','):
+        column, _, direction = item.partition('.')
+        columns.append(column)
+        ascending.append(direction != 'desc')
+
+    # Les tables sont stockées triées : éviter un tri lorsque l'ordre correspond
+    if tuple(columns) == presorted[:len(columns)] and all(ascending):
+        return index
+    if tuple(columns) == presorted[:len(columns)] and not any(ascending):
+        return index[::-1]
+    subset = table.iloc[index].sort_values(columns, ascending=ascending, kind='stable')
+    return index[table.index.get_indexer(subset.index)]
+
+def create_app(tables: Dict[str, pd.DataFrame], sort_keys: Dict[str, Tuple[str, ...]]) -> FastAPI:
+    """Application ASGI servant `tables`, chacune triée selon `sort_keys[table]`"""
+    app = FastAPI()
+    app.state.requests = 0
+    tables = {name: table.reset_index(drop=True) for name, table in tables.items()}
+
+    @app.get("/rest/v1/{table_name}")
+    async def read_table(table_name: str, request: Request):
+        app.state.requests += 1
+        table = tables[table_name]
+        params = request.query_params
+        index = np.arange(len(table))
+
+        for column, expression in params.multi_items():
+            if column in ('and', 'or'):
+                index = _evaluate_logical(table, index, column, expression.strip()[1:-1])
+            elif column not in _RESERVED_PARAMS:
+                operator, _, raw = expression.partition('.')
+                index = _filter(table, index, column, operator, raw)
+
+        if 'order' in params:
+            index = _order(table, index, params['order'], sort_keys.get(table_name, ()))
+        offset = int(params.get('offset', 0))
+        limit = int(params['limit']) if 'limit' in params else None
+        index = index[offset:None if limit is None else offset + limit]
+
+        page = table.iloc[index]
+        if 'select' in params and params['select'] != '*':
+            page = page[params['select'].split(',')]
+        body = page.to_json(orient='records', date_format='iso', date_unit='us')
+        return Response(content=body, media_type='application/json')
+
+    @app.post("/rest/v1/rpc/velib_availability_rollup")
+    async def velib_availability_rollup(request: Request):
+        from src.utils.rollups import hourly_rollups, daily_rollups
+
+        app.state.requests += 1
+        args = await request.json()
+        history = tables['velib_availability_history']
+        timestamps = history['timestamp']
+        mask = (timestamps >= pd.Timestamp(args['p_start'])) & (timestamps < pd.Timestamp(args['p_end']))
+        if args.get('p_stationcodes') is not None:
+            mask &= history['stationcode'].isin(args['p_stationcodes'])
+
+        rollups = hourly_rollups(history[mask])
+        if args.get('p_bucket', 'day') == 'hour':
+            rollups = rollups.rename(columns={'hour': 'bucket'})
+        else:
+            rollups = daily_rollups(rollups)
+            midnight = pd.to_datetime(rollups.pop('date')).dt.tz_localize(args.get('p_timezone', 'Europe/Paris'))
+            rollups.insert(1, 'bucket', midnight)
+        rollups = rollups.sort_values(['bucket', 'stationcode'], ignore_index=True)
+
+        offset = int(request.query_params.get('offset', 0))
+        limit = int(request.query_params['limit']) if 'limit' in request.query_params else None
+        page = rollups.iloc[offset:None if limit is None else offset + limit]
+        body = page.to_json(orient='records', date_format='iso', date_unit='us')
+        return Response(content=body, media_type='application/json')
+
+    return app
+
+class LocalPostgREST:
+    """Lancer le serveur dans un thread (uvicorn) le temps d'un benchmark"""
+
+    def __init__(self, tables: Dict[str, pd.DataFrame], sort_keys: Dict[str, Tuple[str, ...]]):
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.app = create_app(tables, sort_keys)
+        config = uvicorn.Config(self.app, host='127.0.0.1', port=self.port, log_level='warning')
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> 'LocalPostgREST':
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
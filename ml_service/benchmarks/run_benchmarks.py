@@ -0,0 +1,290 @@
+
+"""
+Benchmarks des chemins critiques du service ML
+
+Génère des données synthétiques (par défaut 1 500 stations x 90 jours), sert
+ces données via un PostgREST local, puis mesure le préprocessing, les
+endpoints FastAPI et le DataLoader. Les résultats sont écrits en JSON dans
+`benchmarks/results/` et comparés à l'exécution précédente.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --quick
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+# Ajouter le répertoire racine au path
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_velib_stations, generate_availability_history, generate_user_trips
+from benchmarks.fake_postgrest import LocalPostgREST
+
+RESULTS_DIR = root_dir / "benchmarks" / "results"
+
+def measure(fn: Callable[[], Any], repeat: int, rows: Optional[int] = None) -> Dict[str, Any]:
+    """Chronométrer `fn` `repeat` fois (après un appel de chauffe)"""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    result = {
+        'min_s': round(min(timings), 6),
+        'median_s': round(statistics.median(timings), 6),
+        'mean_s': round(statistics.mean(timings), 6),
+        'repeat': repeat
+    }
+    if rows:
+        result['rows'] = rows
+        result['rows_per_s'] = round(rows / min(timings))
+    return result
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir, text=True).strip()
+    except Exception:
+        return None
+
+def bench_preprocessing(history: pd.DataFrame, repeat: int) -> Dict[str, Any]:
+    from src.utils.preprocessing import (
+        preprocess_velib_data, preprocess_velib_station_data, create_lstm_sequences,
+        lstm_window_starts, iter_lstm_batches, preprocess_trends_data
+    )
+
+    results = {}
+    rows = len(history)
+    results['preprocess_velib_data'] = measure(lambda: preprocess_velib_data(history), repeat, rows)
+
+    X, y, station_codes = preprocess_velib_station_data(history)
+    X = X.astype(np.float32)
+    results['create_lstm_sequences_view'] = measure(lambda: create_lstm_sequences(X, y, 24), repeat, rows)
+    results['lstm_window_starts'] = measure(lambda: lstm_window_starts(station_codes, 24), repeat, rows)
+
+    # Variante matérialisée sur un échantillon (24 copies de chaque ligne)
+    sample = slice(0, min(rows, 200_000))
+    results['create_lstm_sequences_materialized_200k'] = measure(
+        lambda: create_lstm_sequences(X[sample], y[sample], 24, station_codes[sample]), repeat, sample.stop
+    )
+
+    starts = lstm_window_starts(station_codes, 24)
+    def one_epoch():
+        for _ in iter_lstm_batches(X, y, starts, 24, batch_size=4096):
+            pass
+    results['iter_lstm_batches_epoch'] = measure(one_epoch, max(1, repeat // 2), len(starts))
+
+    results['preprocess_trends_data'] = measure(lambda: preprocess_trends_data(history), repeat, rows)
+    return results
+
+def bench_endpoints(client, repeat: int) -> Dict[str, Any]:
+    results = {}
+
+    def post(path: str, payload: Dict[str, Any]):
+        response = client.post(path, json=payload)
+        response.raise_for_status()
+        return response
+
+    cases = {
+        'endpoint_predict_all_168h': ('/api/v1/predict/velib-availability', {'hours_ahead': 168}),
+        'endpoint_predict_all_24h': ('/api/v1/predict/velib-availability', {'hours_ahead': 24}),
+        'endpoint_trends_30d': ('/api/v1/analyze/trends', {'days_back': 30}),
+        'endpoint_trends_90d': ('/api/v1/analyze/trends', {'days_back': 90}),
+        'endpoint_carbon_single': ('/api/v1/calculate/carbon-footprint', {
+            'origin_lat': 48.8566, 'origin_lng': 2.3522,
+            'destination_lat': 48.8738, 'destination_lng': 2.2950
+        }),
+        'endpoint_stations_nearby': ('/api/v1/stations/nearby', {'lat': 48.8566, 'lng': 2.3522, 'k': 5}),
+    }
+    for name, (path, payload) in cases.items():
+        results[name] = measure(lambda: post(path, payload), repeat)
+        results[name]['response_bytes'] = len(post(path, payload).content)
+
+    # Requêtes de l'index spatial (1000 points, débit en requêtes/s)
+    from src.station_index import station_index
+    points = np.random.default_rng(0).uniform([48.82, 2.26], [48.90, 2.41], size=(1000, 2)).tolist()
+    results['station_index_nearest_k5'] = measure(
+        lambda: [station_index.index.nearest(lat, lng, 5) for lat, lng in points], repeat, len(points)
+    )
+
+    # Distances de 100 000 paires de stations lues dans la matrice memory-mappée
+    from src.station_matrix import station_matrix
+    rng = np.random.default_rng(0)
+    origins, destinations = (rng.choice(station_index.index.station_ids, 100_000) for _ in range(2))
+    results['station_matrix_distances_100k'] = measure(
+        lambda: station_matrix.distances(origins, destinations), repeat, len(origins)
+    )
+    return results
+
+def bench_data_loader(loader_days: int, rows: int, repeat: int) -> Dict[str, Any]:
+    from src.utils.data_loader import data_loader, history_store
+    from src.utils.compact import memory_report
+
+    async def load():
+        return await data_loader.load_velib_availability_history(days_back=loader_days)
+
+    async def sync_cold():
+        for path in sorted(history_store.root_dir.glob('**/*'), reverse=True):
+            path.unlink() if path.is_file() else path.rmdir()
+        return await history_store.sync(loader_days, force=True)
+
+    async def run():
+        results = {}
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            df = await load()
+            timings.append(time.perf_counter() - start)
+        results['data_loader_history'] = {
+            'min_s': round(min(timings), 6), 'median_s': round(statistics.median(timings), 6),
+            'mean_s': round(statistics.mean(timings), 6), 'repeat': repeat,
+            'rows': len(df), 'rows_per_s': round(len(df) / min(timings)),
+            'mb_per_million_rows': memory_report(df)['mb_per_million_rows']
+        }
+
+        # Mêmes jours agrégés côté serveur (fonction Postgres)
+        start = time.perf_counter()
+        daily = await data_loader.load_velib_availability_rollups(days_back=loader_days, bucket='day')
+        results['data_loader_rollups_daily'] = {'min_s': round(time.perf_counter() - start, 6), 'repeat': 1, 'rows': len(daily)}
+
+        start = time.perf_counter()
+        added = await sync_cold()
+        results['history_store_sync_cold'] = {'min_s': round(time.perf_counter() - start, 6), 'repeat': 1, 'rows': added}
+
+        start = time.perf_counter()
+        added = await history_store.sync(loader_days, force=True)
+        results['history_store_sync_incremental'] = {'min_s': round(time.perf_counter() - start, 6), 'repeat': 1, 'rows': added}
+
+        results['history_store_load'] = measure(lambda: history_store.load(loader_days), repeat, rows)
+        memory = memory_report(history_store.load(loader_days))
+        results['history_store_load']['mb_per_million_rows'] = memory['mb_per_million_rows']
+        print(f"Mémoire de l'historique chargé: {memory['mb_per_million_rows']} Mo / million de lignes "
+              f"({', '.join(f'{name}={mb}' for name, mb in memory['columns'].items())})")
+        await data_loader.close()
+        return results
+
+    return asyncio.run(run())
+
+def compare_with_previous(results: Dict[str, Any], output_path: Path):
+    """Afficher l'évolution par rapport au dernier fichier de résultats"""
+    previous = sorted(p for p in RESULTS_DIR.glob('bench_*.json') if p != output_path)
+    if not previous:
+        return
+    with open(previous[-1]) as f:
+        baseline = json.load(f)['results']
+
+    print(f"\nComparaison avec {previous[-1].name}:")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or not before.get('min_s'):
+            continue
+        ratio = current['min_s'] / before['min_s']
+        flag = '  <-- régression' if ratio > 1.2 else ''
+        print(f"  {name:45s} {before['min_s']:10.4f}s -> {current['min_s']:10.4f}s  (x{ratio:.2f}){flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks du service ML EcoTrajet")
+    parser.add_argument('--stations', type=int, default=1500)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--interval-minutes', type=int, default=60, help="Intervalle entre snapshots")
+    parser.add_argument('--loader-days', type=int, default=7, help="Fenêtre chargée via le DataLoader")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="100 stations x 14 jours")
+    parser.add_argument('--output', type=Path, default=None)
+    args = parser.parse_args()
+
+    if args.quick:
+        args.stations, args.days, args.loader_days = 100, 14, 7
+
+    print(f"Génération des données: {args.stations} stations x {args.days} jours...")
+    stations = generate_velib_stations(args.stations)
+    history = generate_availability_history(stations, args.days, args.interval_minutes)
+    trips = generate_user_trips()
+    transport_modes = pd.DataFrame({'id': ['1'], 'name': ['car'], 'co2_factor_per_km': [0.192],
+                                    'calories_per_km': [0], 'is_active': [True]})
+    print(f"Historique: {len(history):,} lignes, {history.memory_usage(deep=True).sum() / 1e6:.0f} Mo")
+
+    tables = {
+        'velib_stations': stations,
+        'velib_availability_history': history,
+        'user_trips': trips,
+        'transport_modes': transport_modes,
+    }
+    sort_keys = {'velib_availability_history': ('timestamp', 'id'), 'user_trips': ('created_at', 'id')}
+
+    results: Dict[str, Any] = {}
+    with LocalPostgREST(tables, sort_keys) as server, tempfile.TemporaryDirectory() as store_dir:
+        # Configuration avant l'import des modules du service
+        os.environ.update({
+            'SUPABASE_URL': server.url,
+            'SUPABASE_KEY': 'benchmark',
+            'HISTORY_STORE_DIR': store_dir,
+            'STATION_MATRIX_DIR': str(Path(store_dir) / 'station_matrix'),
+            'MODELS_DIR': str(Path(store_dir) / 'models'),
+            'MODEL_RELOAD_INTERVAL': '0',
+            'FORECAST_REFRESH_MINUTES': '0',
+            'CACHE_TTL_PREDICT': '0', 'CACHE_TTL_TRENDS': '0', 'CACHE_TTL_CARBON': '0',
+        })
+
+        print("Préprocessing...")
+        results.update(bench_preprocessing(history, args.repeat))
+
+        print("DataLoader...")
+        loader_rows = int(len(history) * min(1.0, args.loader_days / args.days))
+        results.update(bench_data_loader(args.loader_days, loader_rows, args.repeat))
+
+        print("Endpoints...")
+        from fastapi.testclient import TestClient
+        from api.main import app
+        with TestClient(app) as client:
+            results.update(bench_endpoints(client, args.repeat))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+            'params': {key: getattr(args, key) for key in ('stations', 'days', 'interval_minutes', 'loader_days', 'repeat')},
+            'history_rows': len(history)
+        },
+        'results': results
+    }
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    output_path = args.output or RESULTS_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['meta']['git_revision'] or 'local'}.json"
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("\nRésultats:")
+    for name, result in results.items():
+        rate = f"  {result['rows_per_s']:>12,} lignes/s" if 'rows_per_s' in result else ''
+        print(f"  {name:45s} {result['min_s']:10.4f}s{rate}")
+    print(f"\nRésultats sauvegardés: {output_path}")
+    compare_with_previous(results, output_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+
+"""
+Génération de données synthétiques à l'échelle de la production
+
+Produit des tables `velib_stations` et `velib_availability_history` au même
+schéma que Supabase, avec des profils journaliers réalistes (pointes du
+matin et du soir, week-end plus calme, stations résidentielles ou de bureaux).
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Emprise approximative de Paris
+PARIS_LAT = (48.815, 48.902)
+PARIS_LNG = (2.224, 2.469)
+
+def generate_velib_stations(n_stations: int = 1500, seed: int = 42) -> pd.DataFrame:
+    """Stations Vélib' synthétiques (codes numériques, capacités 12 à 60)"""
+    rng = np.random.default_rng(seed)
+    codes = np.sort(rng.choice(np.arange(1001, 99999), size=n_stations, replace=False))
+    return pd.DataFrame({
+        'id': [str(uuid.UUID(int=int(i), version=4)) for i in rng.integers(0, 2**63, size=n_stations)],
+        'stationcode': codes.astype(str),
+        'name': [f"Station {code}" for code in codes],
+        'coordonnees_geo_lat': rng.uniform(*PARIS_LAT, size=n_stations).round(8),
+        'coordonnees_geo_lon': rng.uniform(*PARIS_LNG, size=n_stations).round(8),
+        'capacity': rng.integers(12, 61, size=n_stations),
+        'nom_arrondissement_communes': 'Paris',
+        'code_insee_commune': '75056',
+        'station_opening_hours': None,
+    })
+
+def generate_availability_history(stations: pd.DataFrame, days: int = 90, interval_minutes: int = 60,
+                                  end: Optional[datetime] = None, seed: int = 42) -> pd.DataFrame:
+    """
+    Historique de disponibilité synthétique : un snapshot par station et par intervalle
+
+    Les lignes sont triées par (timestamp, id) comme le renvoie PostgREST.
+    """
+    rng = np.random.default_rng(seed)
+    end = (end or datetime.utcnow()).replace(second=0, microsecond=0)
+    timestamps = pd.date_range(end=end, periods=days * 24 * 60 // interval_minutes,
+                               freq=f"{interval_minutes}min", tz='UTC')
+    n_stations, n_times = len(stations), len(timestamps)
+
+    capacity = stations['capacity'].to_numpy()[:, None]
+    hours = np.asarray(timestamps.hour + timestamps.minute / 60)[None, :]
+    weekend = np.asarray(timestamps.dayofweek >= 5)[None, :]
+
+    # Stations résidentielles (se vident le matin) vs bureaux (se remplissent le matin)
+    profile = np.where(rng.random((n_stations, 1)) < 0.5, 1.0, -1.0)
+    morning = np.exp(-((hours - 8.5) ** 2) / 2)
+    evening = np.exp(-((hours - 18.5) ** 2) / 2)
+    amplitude = np.where(weekend, 0.15, 0.35)
+    fill = 0.5 + profile * amplitude * (evening - morning) + rng.normal(0, 0.08, size=(n_stations, n_times))
+    fill = np.clip(fill, 0, 1)
+
+    bikes = np.rint(fill * capacity).astype(np.int32)
+    docks = (capacity - bikes).astype(np.int32)
+    ebike = rng.binomial(bikes, 0.35).astype(np.int32)
+
+    n_rows = n_stations * n_times
+    history = pd.DataFrame({
+        'id': [str(uuid.UUID(int=int(i), version=4)) for i in rng.integers(0, 2**63, size=n_rows)],
+        'stationcode': np.tile(stations['stationcode'].to_numpy(), n_times),
+        'timestamp': np.repeat(timestamps, n_stations),
+        'numbikesavailable': bikes.T.ravel(),
+        'numdocksavailable': docks.T.ravel(),
+        'mechanical': (bikes - ebike).T.ravel(),
+        'ebike': ebike.T.ravel(),
+        'is_renting': True,
+        'is_returning': True,
+        'is_installed': True,
+    })
+    return history.sort_values(['timestamp', 'id'], kind='stable', ignore_index=True)
+
+def generate_user_trips(n_trips: int = 10000, seed: int = 42) -> pd.DataFrame:
+    """Trajets utilisateurs synthétiques pour le modèle carbone"""
+    rng = np.random.default_rng(seed)
+    distance = rng.gamma(2.0, 2.0, size=n_trips).round(2)
+    created = pd.Timestamp.now(tz='UTC') - pd.to_timedelta(rng.integers(0, 90 * 86400, size=n_trips), unit='s')
+    return pd.DataFrame({
+        'id': [str(uuid.uuid4()) for _ in range(n_trips)],
+        'created_at': created,
+        'trip_date': created.normalize(),
+        'distance_km': distance,
+        'co2_saved_kg': (distance * 0.19).round(3),
+        'calories_burned': (distance * 40).astype(int),
+    }).sort_values(['created_at', 'id'], ascending=False, ignore_index=True)
@@ -30,7 +30,7 @@ root_dir = Path(__file__).parent.parent
 sys.path.append(str(root_dir))
 
 from src.utils.data_loader import data_loader, load_historical_velib_data
-from src.utils.preprocessing import preprocess_velib_data, create_lstm_sequences
+from src.utils.preprocessing import preprocess_velib_station_data, lstm_window_starts, lstm_dataset
 
 MODELS_DIR = root_dir / "models"
 
@@ -83,24 +83,26 @@ class ModelEvaluator:
             print("Pas de données de test")
             return
         
-        # Préprocessing
-        X, y = preprocess_velib_data(historical_data)
+        # Préprocessing (lignes triées par station)
+        X, y, station_codes = preprocess_velib_station_data(historical_data)
         
         if len(X) == 0:
             return
         
         # Normalisation avec les scalers d'entraînement
-        X_scaled = self.scalers['velib_scaler_x'].transform(X)
-        y_scaled = self.scalers['velib_scaler_y'].transform(y.reshape(-1, 1)).flatten()
+        X_scaled = self.scalers['velib_scaler_x'].transform(X).astype(np.float32)
+        y_scaled = self.scalers['velib_scaler_y'].transform(y.reshape(-1, 1)).flatten().astype(np.float32)
         
-        # Séquences
-        X_seq, y_seq = create_lstm_sequences(X_scaled, y_scaled, sequence_length=24)
+        # Séquences par station, construites à la volée
+        starts = lstm_window_starts(station_codes, sequence_length=24)
         
-        if len(X_seq) == 0:
+        if len(starts) == 0:
             return
         
+        y_seq = y_scaled[starts + 24]
+        
         # Prédictions
-        y_pred_scaled = self.models['velib_lstm'].predict(X_seq)
+        y_pred_scaled = self.models['velib_lstm'].predict(lstm_dataset(X_scaled, y_scaled, starts, 24, batch_size=256))
         y_pred = self.scalers['velib_scaler_y'].inverse_transform(y_pred_scaled.reshape(-1, 1)).flatten()
         y_true = self.scalers['velib_scaler_y'].inverse_transform(y_seq.reshape(-1, 1)).flatten()
         
@@ -0,0 +1,35 @@
+
+"""
+Synchronisation incrémentale du store local de l'historique Vélib'
+"""
+
+import asyncio
+import argparse
+
+# Imports locaux
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire racine au path
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from src.utils.data_loader import data_loader, history_store
+
+async def main(days_back: int):
+    """Ajouter au store local les lignes plus récentes que le watermark"""
+    try:
+        added = await history_store.sync(days_back, force=True)
+    finally:
+        await data_loader.close()
+    
+    manifest = history_store.read_manifest()
+    print(f"Lignes ajoutées: {added}")
+    print(f"Partitions: {len(manifest['partitions'])}")
+    print(f"Watermark: {manifest['watermark']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchroniser l'historique Vélib' depuis Supabase")
+    parser.add_argument("--days-back", type=int, default=90, help="Fenêtre d'historique à couvrir")
+    args = parser.parse_args()
+    asyncio.run(main(args.days_back))
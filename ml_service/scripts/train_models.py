@@ -4,12 +4,20 @@ Scripts d'entraînement des modèles ML
 """
 
 import asyncio
+import argparse
+import importlib.util
+import multiprocessing
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import joblib
+import json
 import os
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 # Imports pour les modèles ML
 try:
@@ -17,10 +25,12 @@ try:
     from sklearn.preprocessing import StandardScaler
     from sklearn.ensemble import RandomForestRegressor
     from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-    import tensorflow as tf
-    from tensorflow.keras.models import Sequential
-    from tensorflow.keras.layers import LSTM, Dense, Dropout
-    from prophet import Prophet
+    from threadpoolctl import threadpool_limits
+    # TensorFlow et Prophet sont importés par les entraîneurs qui les utilisent :
+    # les workers (Random Forest, ajustements par station) ne les chargent pas
+    for module in ('tensorflow', 'prophet'):
+        if importlib.util.find_spec(module) is None:
+            raise ImportError(f"No module named '{module}'")
 except ImportError as e:
     print(f"Erreur d'import: {e}")
     print("Installer les dépendances avec: pip install -r requirements.txt")
@@ -34,65 +44,134 @@ from pathlib import Path
 root_dir = Path(__file__).parent.parent
 sys.path.append(str(root_dir))
 
-from src.utils.data_loader import data_loader, load_historical_velib_data
+from src.utils.data_loader import data_loader, history_store, load_historical_velib_data, sync_historical_velib_data
 from src.utils.preprocessing import (
-    preprocess_velib_data, 
-    create_lstm_sequences, 
+    preprocess_velib_station_data,
+    lstm_window_starts,
+    lstm_dataset,
     preprocess_trends_data
 )
+from src.station_forecasts import (
+    STATION_MODELS_FILE,
+    FORECAST_DAYS,
+    station_series,
+    fit_station_models,
+    write_bundle
+)
 
 # Configuration
 MODELS_DIR = root_dir / "models"
 MODELS_DIR.mkdir(exist_ok=True)
 
+MODEL_NAMES = ('velib_lstm', 'trends_prophet', 'carbon_rf', 'station_prophet')
+
+# Fenêtres d'historique (jours) : une seule synchronisation couvre la plus large
+HISTORY_WINDOWS = {'velib_lstm': 60, 'trends_prophet': 90, 'station_prophet': 90}
+
+# Part des cœurs de chaque modèle entraîné en parallèle (Prophet/Stan est mono-thread ;
+# le budget des modèles par station est leur nombre de processus d'ajustement)
+THREAD_SHARES = {'velib_lstm': 4, 'trends_prophet': 1, 'carbon_rf': 3, 'station_prophet': 4}
+
+def thread_budgets(models: List[str], spec: Optional[str] = None) -> Dict[str, int]:
+    """
+    Threads alloués à chaque modèle
+
+    `spec` (ou TRAINING_THREADS) fixe des budgets explicites : "velib_lstm=4,carbon_rf=2".
+    Les autres modèles se partagent les cœurs selon `THREAD_SHARES`.
+    """
+    spec = os.getenv('TRAINING_THREADS', '') if spec is None else spec
+    explicit = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, threads = item.partition('=')
+        explicit[name.strip()] = max(1, int(threads))
+
+    cpus = os.cpu_count() or 1
+    total_shares = sum(THREAD_SHARES[name] for name in models) or 1
+    return {
+        name: explicit.get(name, max(1, cpus * THREAD_SHARES[name] // total_shares))
+        for name in models
+    }
+
+def apply_thread_budget(threads: int):
+    """Limiter les pools BLAS/OpenMP du processus (TensorFlow : voir `train_velib_lstm`)"""
+    return threadpool_limits(limits=threads)
+
 class ModelTrainer:
-    def __init__(self):
+    def __init__(self, threads: Optional[int] = None):
+        self.threads = threads
         self.models = {}
         self.scalers = {}
         self.metrics = {}
+        # Durées (secondes, horloge murale) par modèle et par étape
+        self.timings: Dict[str, Dict[str, float]] = {}
     
-    async def train_velib_lstm(self, days_back=60):
+    @contextmanager
+    def stage(self, model: str, name: str):
+        """Chronométrer une étape de l'entraînement d'un modèle"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.setdefault(model, {})[name] = round(time.perf_counter() - started, 3)
+    
+    async def train_velib_lstm(self, days_back=HISTORY_WINDOWS['velib_lstm'], sync=True):
         """Entraîner le modèle LSTM pour prédiction Vélib'"""
+        import tensorflow as tf
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.layers import LSTM, Dense, Dropout
+        
         print("=== ENTRAÎNEMENT MODÈLE LSTM VÉLIB' ===")
+        if self.threads:
+            # Budget de threads, à fixer avant la première opération TensorFlow
+            tf.config.threading.set_intra_op_parallelism_threads(self.threads)
+            tf.config.threading.set_inter_op_parallelism_threads(min(2, self.threads))
         
-        # Charger les données historiques
+        # Charger les données historiques (store local déjà synchronisé si `sync` est faux)
         print("Chargement des données...")
-        historical_data = await load_historical_velib_data(days_back=days_back)
+        with self.stage('velib_lstm', 'load'):
+            historical_data = await load_historical_velib_data(days_back=days_back, sync=sync)
         
         if historical_data.empty:
             print("Pas de données historiques disponibles")
             return False
         
-        # Préprocessing
+        # Préprocessing (lignes triées par station pour ne pas mélanger les séquences)
         print("Préprocessing des données...")
-        X, y = preprocess_velib_data(historical_data)
-        
-        if len(X) == 0:
-            print("Pas de données après préprocessing")
-            return False
-        
-        # Normalisation
-        scaler_X = StandardScaler()
-        scaler_y = StandardScaler()
-        
-        X_scaled = scaler_X.fit_transform(X)
-        y_scaled = scaler_y.fit_transform(y.reshape(-1, 1)).flatten()
-        
-        # Création des séquences LSTM
-        sequence_length = 24  # 24 heures
-        X_seq, y_seq = create_lstm_sequences(X_scaled, y_scaled, sequence_length)
-        
-        if len(X_seq) == 0:
-            print("Pas assez de données pour créer des séquences")
-            return False
-        
-        # Division train/test
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_seq, y_seq, test_size=0.2, random_state=42
-        )
-        
-        print(f"Données d'entraînement: {X_train.shape}")
-        print(f"Données de test: {X_test.shape}")
+        with self.stage('velib_lstm', 'preprocess'):
+            X, y, station_codes = preprocess_velib_station_data(historical_data)
+            del historical_data
+            
+            if len(X) == 0:
+                print("Pas de données après préprocessing")
+                return False
+            
+            # Normalisation
+            scaler_X = StandardScaler()
+            scaler_y = StandardScaler()
+            
+            X_scaled = scaler_X.fit_transform(X).astype(np.float32)
+            y_scaled = scaler_y.fit_transform(y.reshape(-1, 1)).flatten().astype(np.float32)
+            
+            # Séquences LSTM par station, construites à la volée à partir de vues
+            sequence_length = 24  # 24 heures
+            starts = lstm_window_starts(station_codes, sequence_length)
+            
+            if len(starts) == 0:
+                print("Pas assez de données pour créer des séquences")
+                return False
+            
+            # Division train/test sur les indices de début de séquence
+            train_starts, test_starts = train_test_split(
+                starts, test_size=0.2, random_state=42
+            )
+            train_dataset = lstm_dataset(X_scaled, y_scaled, train_starts, sequence_length,
+                                         batch_size=32, shuffle=True)
+            test_dataset = lstm_dataset(X_scaled, y_scaled, test_starts, sequence_length,
+                                        batch_size=256)
+            y_test = y_scaled[test_starts + sequence_length]
+        
+        print(f"Données d'entraînement: {(len(train_starts), sequence_length, X.shape[1])}")
+        print(f"Données de test: {(len(test_starts), sequence_length, X.shape[1])}")
         
         # Construction du modèle LSTM
         model = Sequential([
@@ -108,22 +187,23 @@ class ModelTrainer:
         
         # Entraînement
         print("Entraînement en cours...")
-        history = model.fit(
-            X_train, y_train,
-            batch_size=32,
-            epochs=50,
-            validation_data=(X_test, y_test),
-            verbose=1
-        )
+        with self.stage('velib_lstm', 'fit'):
+            history = model.fit(
+                train_dataset,
+                epochs=50,
+                validation_data=test_dataset,
+                verbose=1
+            )
         
         # Évaluation
-        y_pred = model.predict(X_test)
-        y_pred_original = scaler_y.inverse_transform(y_pred.reshape(-1, 1)).flatten()
-        y_test_original = scaler_y.inverse_transform(y_test.reshape(-1, 1)).flatten()
-        
-        mae = mean_absolute_error(y_test_original, y_pred_original)
-        rmse = np.sqrt(mean_squared_error(y_test_original, y_pred_original))
-        r2 = r2_score(y_test_original, y_pred_original)
+        with self.stage('velib_lstm', 'evaluate'):
+            y_pred = model.predict(test_dataset)
+            y_pred_original = scaler_y.inverse_transform(y_pred.reshape(-1, 1)).flatten()
+            y_test_original = scaler_y.inverse_transform(y_test.reshape(-1, 1)).flatten()
+            
+            mae = mean_absolute_error(y_test_original, y_pred_original)
+            rmse = np.sqrt(mean_squared_error(y_test_original, y_pred_original))
+            r2 = r2_score(y_test_original, y_pred_original)
         
         print(f"MAE: {mae:.2f}")
         print(f"RMSE: {rmse:.2f}")
@@ -134,9 +214,10 @@ class ModelTrainer:
         scaler_x_path = MODELS_DIR / "velib_scaler_x.pkl"
         scaler_y_path = MODELS_DIR / "velib_scaler_y.pkl"
         
-        model.save(model_path)
-        joblib.dump(scaler_X, scaler_x_path)
-        joblib.dump(scaler_y, scaler_y_path)
+        with self.stage('velib_lstm', 'save'):
+            model.save(model_path)
+            joblib.dump(scaler_X, scaler_x_path)
+            joblib.dump(scaler_y, scaler_y_path)
         
         self.models['velib_lstm'] = model
         self.scalers['velib_scaler_x'] = scaler_X
@@ -146,19 +227,24 @@ class ModelTrainer:
         print(f"Modèle sauvegardé: {model_path}")
         return True
     
-    async def train_trends_prophet(self, days_back=90):
+    async def train_trends_prophet(self, days_back=HISTORY_WINDOWS['trends_prophet'], daily_rollups=None):
         """Entraîner le modèle Prophet pour analyse des tendances"""
+        from prophet import Prophet
+        
         print("=== ENTRAÎNEMENT MODÈLE PROPHET TENDANCES ===")
         
-        # Charger les données
-        historical_data = await load_historical_velib_data(days_back=days_back)
+        # Agrégats journaliers fournis par l'orchestrateur, sinon chargés ici
+        if daily_rollups is None:
+            with self.stage('trends_prophet', 'load'):
+                daily_rollups = await load_daily_rollups(days_back, sync=True)
         
-        if historical_data.empty:
+        if daily_rollups.empty:
             print("Pas de données disponibles")
             return False
         
         # Préprocessing pour Prophet
-        prophet_data = preprocess_trends_data(historical_data)
+        with self.stage('trends_prophet', 'preprocess'):
+            prophet_data = preprocess_trends_data(daily_rollups)
         
         if prophet_data.empty:
             print("Pas de données après préprocessing")
@@ -175,19 +261,21 @@ class ModelTrainer:
         )
         
         print("Entraînement Prophet...")
-        model.fit(prophet_data)
-        
-        # Prédictions de test
-        future = model.make_future_dataframe(periods=7)  # 7 jours dans le futur
-        forecast = model.predict(future)
-        
-        # Évaluation sur les données existantes
-        y_true = prophet_data['y'].values
-        y_pred = forecast['yhat'][:len(y_true)].values
-        
-        mae = mean_absolute_error(y_true, y_pred)
-        rmse = np.sqrt(mean_squared_error(y_true, y_pred))
-        r2 = r2_score(y_true, y_pred)
+        with self.stage('trends_prophet', 'fit'):
+            model.fit(prophet_data)
+        
+        with self.stage('trends_prophet', 'evaluate'):
+            # Prédictions de test
+            future = model.make_future_dataframe(periods=7)  # 7 jours dans le futur
+            forecast = model.predict(future)
+            
+            # Évaluation sur les données existantes
+            y_true = prophet_data['y'].values
+            y_pred = forecast['yhat'][:len(y_true)].values
+            
+            mae = mean_absolute_error(y_true, y_pred)
+            rmse = np.sqrt(mean_squared_error(y_true, y_pred))
+            r2 = r2_score(y_true, y_pred)
         
         print(f"MAE: {mae:.3f}")
         print(f"RMSE: {rmse:.3f}")
@@ -195,7 +283,8 @@ class ModelTrainer:
         
         # Sauvegarde
         model_path = MODELS_DIR / "trends_prophet_model.pkl"
-        joblib.dump(model, model_path)
+        with self.stage('trends_prophet', 'save'):
+            joblib.dump(model, model_path)
         
         self.models['trends_prophet'] = model
         self.metrics['trends_prophet'] = {'mae': mae, 'rmse': rmse, 'r2': r2}
@@ -203,55 +292,109 @@ class ModelTrainer:
         print(f"Modèle sauvegardé: {model_path}")
         return True
     
-    async def train_carbon_rf(self):
+    async def train_station_prophet(self, days_back=HISTORY_WINDOWS['station_prophet'], daily_rollups=None):
+        """Entraîner un modèle Prophet par station (part de snapshots en faible disponibilité)"""
+        print("=== ENTRAÎNEMENT MODÈLES PROPHET PAR STATION ===")
+        
+        if daily_rollups is None:
+            with self.stage('station_prophet', 'load'):
+                daily_rollups = await load_daily_rollups(days_back, sync=True)
+        
+        with self.stage('station_prophet', 'preprocess'):
+            series = station_series(daily_rollups)
+        
+        if not series:
+            print("Pas assez de données par station")
+            return False
+        
+        # Jours prévus communs à toutes les stations : ceux qui suivent le dernier jour observé
+        last_day = max(days[-1] for _, days, _ in series)
+        forecast_dates = last_day + np.arange(1, FORECAST_DAYS + 1)
+        
+        workers = self.threads or os.cpu_count()
+        print(f"Ajustement de {len(series)} modèles sur {workers} processus...")
+        with self.stage('station_prophet', 'fit'):
+            results = fit_station_models(series, forecast_dates, workers=workers)
+        
+        if not results:
+            print("Aucun modèle de station n'a pu être ajusté")
+            return False
+        
+        mae = np.array([station_mae for _, _, station_mae, _ in results])
+        print(f"Stations: {len(results)}/{len(series)}")
+        print(f"MAE médiane: {np.median(mae):.3f}")
+        
+        model_path = MODELS_DIR / STATION_MODELS_FILE
+        with self.stage('station_prophet', 'save'):
+            write_bundle(model_path, results, forecast_dates)
+        
+        self.models['station_prophet'] = model_path
+        self.metrics['station_prophet'] = {
+            'stations': len(results),
+            'skipped_stations': len(series) - len(results),
+            'mae_median': float(np.median(mae)),
+            'mae_p90': float(np.percentile(mae, 90))
+        }
+        
+        print(f"Modèles sauvegardés: {model_path}")
+        return True
+    
+    async def train_carbon_rf(self, trips_data=None):
         """Entraîner le modèle Random Forest pour calculs carbone"""
         print("=== ENTRAÎNEMENT MODÈLE RANDOM FOREST CARBONE ===")
         
-        # Charger les données de trajets
-        trips_data = await data_loader.load_user_trips(limit=10000)
+        # Charger les données de trajets (sauf si fournies par l'orchestrateur)
+        if trips_data is None:
+            with self.stage('carbon_rf', 'load'):
+                trips_data = await data_loader.load_user_trips(limit=10000)
         
         if trips_data.empty:
             print("Pas de données de trajets disponibles")
             return False
         
-        # Création des features
-        features = ['distance_km']
-        if 'calories_burned' in trips_data.columns:
-            features.append('calories_burned')
-        
-        # Ajouter des features dérivées
-        trips_data['distance_squared'] = trips_data['distance_km'] ** 2
-        trips_data['distance_log'] = np.log1p(trips_data['distance_km'])
-        features.extend(['distance_squared', 'distance_log'])
-        
-        X = trips_data[features].fillna(0)
-        y = trips_data['co2_saved_kg'].fillna(0)
-        
-        # Division train/test
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42
-        )
+        with self.stage('carbon_rf', 'preprocess'):
+            # Création des features
+            features = ['distance_km']
+            if 'calories_burned' in trips_data.columns:
+                features.append('calories_burned')
+            
+            # Ajouter des features dérivées
+            trips_data = trips_data.assign(
+                distance_squared=trips_data['distance_km'] ** 2,
+                distance_log=np.log1p(trips_data['distance_km'])
+            )
+            features.extend(['distance_squared', 'distance_log'])
+            
+            X = trips_data[features].fillna(0)
+            y = trips_data['co2_saved_kg'].fillna(0)
+            
+            # Division train/test
+            X_train, X_test, y_train, y_test = train_test_split(
+                X, y, test_size=0.2, random_state=42
+            )
         
         print(f"Features: {features}")
         print(f"Données d'entraînement: {X_train.shape}")
         
-        # Entraînement Random Forest
+        # Entraînement Random Forest (tous les cœurs hors budget imposé)
         model = RandomForestRegressor(
             n_estimators=100,
             max_depth=10,
             random_state=42,
-            n_jobs=-1
+            n_jobs=self.threads or -1
         )
         
         print("Entraînement Random Forest...")
-        model.fit(X_train, y_train)
+        with self.stage('carbon_rf', 'fit'):
+            model.fit(X_train, y_train)
         
         # Évaluation
-        y_pred = model.predict(X_test)
-        
-        mae = mean_absolute_error(y_test, y_pred)
-        rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-        r2 = r2_score(y_test, y_pred)
+        with self.stage('carbon_rf', 'evaluate'):
+            y_pred = model.predict(X_test)
+            
+            mae = mean_absolute_error(y_test, y_pred)
+            rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+            r2 = r2_score(y_test, y_pred)
         
         print(f"MAE: {mae:.4f}")
         print(f"RMSE: {rmse:.4f}")
@@ -265,7 +408,8 @@ class ModelTrainer:
         
         # Sauvegarde
         model_path = MODELS_DIR / "carbon_rf_model.pkl"
-        joblib.dump(model, model_path)
+        with self.stage('carbon_rf', 'save'):
+            joblib.dump(model, model_path)
         
         self.models['carbon_rf'] = model
         self.metrics['carbon_rf'] = {'mae': mae, 'rmse': rmse, 'r2': r2}
@@ -273,59 +417,155 @@ class ModelTrainer:
         print(f"Modèle sauvegardé: {model_path}")
         return True
     
-    def save_training_report(self):
-        """Sauvegarder un rapport d'entraînement"""
+    def save_training_report(self, extra: Optional[Dict[str, Any]] = None):
+        """Sauvegarder un rapport d'entraînement (durées par étape incluses)"""
         report = {
             'timestamp': datetime.now().isoformat(),
-            'models_trained': list(self.models.keys()),
-            'metrics': self.metrics
+            'models_trained': list(self.metrics.keys()),
+            'metrics': self.metrics,
+            'stage_seconds': self.timings,
+            **(extra or {})
         }
         
         report_path = MODELS_DIR / f"training_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        import json
         with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2)
+            json.dump(report, f, indent=2, default=float)
         
         print(f"Rapport sauvegardé: {report_path}")
 
-async def main():
-    """Fonction principale d'entraînement"""
+async def load_daily_rollups(days_back: int, sync: bool = False) -> pd.DataFrame:
+    """Agrégats journaliers calculés par Supabase, sinon rollups du store local (synchronisé d'abord si `sync`)"""
+    daily_rollups = await data_loader.load_velib_availability_rollups(days_back=days_back, bucket='day')
+    if daily_rollups.empty:
+        if sync:
+            await sync_historical_velib_data(days_back=days_back)
+        daily_rollups = history_store.rollups.load_daily(days_back)
+    return daily_rollups
+
+async def load_training_data(models: List[str], trainer: ModelTrainer) -> Dict[str, Dict[str, Any]]:
+    """
+    Chargement partagé : arguments de chaque entraîneur
+
+    L'historique est synchronisé une fois sur la fenêtre la plus large ; le
+    LSTM relit sa propre fenêtre dans le store local (lecture Arrow
+    memory-mappée, rien à transférer entre processus). Les rollups
+    journaliers et les trajets, compacts, sont passés aux workers.
+    """
+    payloads: Dict[str, Dict[str, Any]] = {}
+    try:
+        windows = [HISTORY_WINDOWS[name] for name in models if name in HISTORY_WINDOWS]
+        if windows:
+            with trainer.stage('shared', 'sync_history'):
+                await sync_historical_velib_data(days_back=max(windows))
+        
+        if 'velib_lstm' in models:
+            payloads['velib_lstm'] = {'days_back': HISTORY_WINDOWS['velib_lstm'], 'sync': False}
+        rollup_models = [name for name in ('trends_prophet', 'station_prophet') if name in models]
+        if rollup_models:
+            # Mêmes rollups journaliers pour le modèle global et les modèles par station
+            with trainer.stage('shared', 'daily_rollups'):
+                daily_rollups = await load_daily_rollups(max(HISTORY_WINDOWS[name] for name in rollup_models))
+            for name in rollup_models:
+                payloads[name] = {'daily_rollups': daily_rollups}
+        if 'carbon_rf' in models:
+            with trainer.stage('shared', 'user_trips'):
+                trips_data = await data_loader.load_user_trips(limit=10000)
+            payloads['carbon_rf'] = {'trips_data': trips_data}
+    finally:
+        await data_loader.close()
+    return payloads
+
+def run_trainer(name: str, threads: Optional[int], payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Entraîner un modèle (dans un worker : budget de threads appliqué au processus)"""
+    trainer = ModelTrainer(threads=threads)
+    started = time.perf_counter()
+    limits = apply_thread_budget(threads) if threads else None
+    try:
+        success = asyncio.run(getattr(trainer, f"train_{name}")(**payload))
+    finally:
+        if limits is not None:
+            limits.restore_original_limits()
+    stages = trainer.timings.get(name, {})
+    stages['total'] = round(time.perf_counter() - started, 3)
+    return {'success': success, 'metrics': trainer.metrics.get(name), 'stages': stages}
+
+def train_all(models: List[str], parallel: bool = True) -> int:
+    """Chargement partagé puis entraînement des modèles, en parallèle dans des processus séparés"""
     trainer = ModelTrainer()
+    started = time.perf_counter()
+    budgets = thread_budgets(models) if parallel else {name: None for name in models}
     
     print("DÉMARRAGE DE L'ENTRAÎNEMENT DES MODÈLES ML")
     print("=" * 50)
+    if parallel:
+        print(f"Budgets de threads: {budgets}")
     
-    # Entraîner tous les modèles
-    success_count = 0
+    payloads = asyncio.run(load_training_data(models, trainer))
     
-    # 1. LSTM Vélib'
-    if await trainer.train_velib_lstm():
-        success_count += 1
-    
-    print("\n" + "=" * 50 + "\n")
-    
-    # 2. Prophet Tendances
-    if await trainer.train_trends_prophet():
-        success_count += 1
-    
-    print("\n" + "=" * 50 + "\n")
+    results: Dict[str, Dict[str, Any]] = {}
+    if parallel and len(models) > 1:
+        # "spawn" : TensorFlow ne supporte pas le fork d'un processus déjà initialisé
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(models), mp_context=context) as pool:
+            submitted = time.perf_counter()
+            done_at: Dict[str, float] = {}
+            futures = {name: pool.submit(run_trainer, name, budgets[name], payloads[name]) for name in models}
+            for name, future in futures.items():
+                future.add_done_callback(lambda _, name=name: done_at.setdefault(name, time.perf_counter()))
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                    # Vu du parent : démarrage du worker et transfert des données compris
+                    results[name]['stages']['elapsed'] = round(done_at.get(name, time.perf_counter()) - submitted, 3)
+                except Exception as e:
+                    print(f"Erreur entraînement {name}: {e}")
+    else:
+        for name in models:
+            try:
+                results[name] = run_trainer(name, budgets[name], payloads[name])
+            except Exception as e:
+                print(f"Erreur entraînement {name}: {e}")
+            print("\n" + "=" * 50 + "\n")
     
-    # 3. Random Forest Carbone
-    if await trainer.train_carbon_rf():
-        success_count += 1
+    for name, result in results.items():
+        trainer.timings[name] = result['stages']
+        if result['success']:
+            trainer.metrics[name] = result['metrics']
+    total_seconds = round(time.perf_counter() - started, 3)
     
     # Rapport final
+    success_count = len(trainer.metrics)
     print("\n" + "=" * 50)
     print("RÉSUMÉ DE L'ENTRAÎNEMENT")
     print("=" * 50)
-    print(f"Modèles entraînés avec succès: {success_count}/3")
+    print(f"Modèles entraînés avec succès: {success_count}/{len(models)}")
+    for name in models:
+        stages = trainer.timings.get(name, {})
+        print(f"  {name}: {stages.get('total', '-')} s {stages}")
+    print(f"Durée totale: {total_seconds} s")
     
     if success_count > 0:
-        trainer.save_training_report()
+        trainer.save_training_report({'total_seconds': total_seconds, 'parallel': parallel, 'thread_budgets': budgets})
         print("\nTous les modèles sont prêts pour la production!")
     else:
         print("\nAucun modèle n'a pu être entraîné. Vérifier les données.")
+    return success_count
+
+def main():
+    """Fonction principale d'entraînement"""
+    parser = argparse.ArgumentParser(description="Entraîner les modèles ML")
+    parser.add_argument("--models", default=','.join(MODEL_NAMES),
+                        help=f"Modèles à entraîner, séparés par des virgules ({', '.join(MODEL_NAMES)})")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Entraîner les modèles l'un après l'autre dans ce processus")
+    args = parser.parse_args()
+    
+    models = [name.strip() for name in args.models.split(',') if name.strip()]
+    unknown = sorted(set(models) - set(MODEL_NAMES))
+    if unknown:
+        parser.error(f"Modèles inconnus: {', '.join(unknown)}")
+    train_all(models, parallel=not args.sequential)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -6,101 +6,42 @@ Analyse des tendances Vélib' avec Prophet
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
-from api.models.schemas import TrendsAnalysisRequest, TrendsAnalysisResponse
-from src.utils.data_loader import load_historical_velib_data
+from api.models.schemas import TrendsAnalysisRequest, TrendsAnalysisResponse, StationTrendForecastResponse
+from src.utils.data_loader import history_store, sync_historical_velib_data
+from src.utils.history_store import HistoryStore
+from src.executors import executors
+from src.model_registry import model_registry
+from src.utils.metrics import stage_timer
+from src.trends_engine import trend_engine, HOURLY_TREND_COLUMNS, DAILY_TREND_COLUMNS, CRITICAL_LOW_SHARE
 
 class VelibTrendsAnalyzer:
     def __init__(self):
         self.prophet_model = None
+        self.station_models = None
         
     async def load_model(self):
-        """Charger le modèle Prophet"""
-        try:
-            # TODO: Charger le modèle Prophet réel
-            print("Modèle Prophet chargé (simulé)")
-            return True
-        except Exception as e:
-            print(f"Erreur chargement Prophet: {e}")
-            return False
+        """Récupérer le modèle Prophet courant depuis le registre (chargé à la première utilisation)"""
+        artifacts = await model_registry.ensure_loaded('trends_prophet')
+        self.prophet_model = artifacts['model'] if artifacts else None
+        return self.prophet_model is not None
+    
+    async def load_station_models(self):
+        """Archive des modèles par station (manifeste chargé, modèles lus station par station)"""
+        artifacts = await model_registry.ensure_loaded('station_prophet')
+        self.station_models = artifacts['bundle'] if artifacts else None
+        return self.station_models
 
-    async def analyze_daily_trends(self, historical_data: pd.DataFrame, days_back: int) -> List[Dict]:
-        """Analyser les tendances quotidiennes"""
-        daily_trends = []
-        
-        # Grouper par jour
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days_back)
-        
-        for i in range(days_back):
-            current_date = start_date + timedelta(days=i)
-            
-            # Simulation d'analyse (à remplacer par analyse réelle)
-            day_of_week = current_date.weekday()
-            
-            # Patterns simulés
-            if day_of_week < 5:  # Jour de semaine
-                occupation_rate = np.random.uniform(0.65, 0.85)
-                peak_hours = [8, 9, 18, 19]
-                total_trips = np.random.randint(15000, 25000)
-            else:  # Weekend
-                occupation_rate = np.random.uniform(0.45, 0.65)
-                peak_hours = [11, 12, 15, 16]
-                total_trips = np.random.randint(8000, 15000)
-            
-            # Stations critiques (faible disponibilité)
-            critical_stations = np.random.choice(range(1, 100), size=np.random.randint(3, 8), replace=False).tolist()
-            
-            daily_trends.append({
-                "date": current_date.isoformat(),
-                "occupation_rate": round(occupation_rate, 3),
-                "peak_hours": peak_hours,
-                "critical_stations": critical_stations,
-                "total_trips": total_trips
-            })
-        
-        return daily_trends
+    def analyze_daily_trends(self, aggregates: Dict[str, Any]) -> List[Dict]:
+        """Analyser les tendances quotidiennes (une entrée par jour d'historique)"""
+        return trend_engine.daily_records(aggregates)
 
-    async def identify_weekly_patterns(self, daily_trends: List[Dict]) -> Dict[str, Any]:
-        """Identifier les patterns hebdomadaires"""
-        
-        # Analyser les données par jour de la semaine
-        weekday_stats = {}
-        weekend_stats = {}
-        
-        for trend in daily_trends:
-            date = datetime.fromisoformat(trend["date"])
-            day_name = date.strftime("%A")
-            
-            if date.weekday() < 5:  # Jour de semaine
-                if day_name not in weekday_stats:
-                    weekday_stats[day_name] = []
-                weekday_stats[day_name].append(trend["occupation_rate"])
-            else:  # Weekend
-                if day_name not in weekend_stats:
-                    weekend_stats[day_name] = []
-                weekend_stats[day_name].append(trend["occupation_rate"])
-        
-        patterns = {
-            "weekday_average_occupation": {
-                day: round(np.mean(rates), 3) 
-                for day, rates in weekday_stats.items()
-            },
-            "weekend_average_occupation": {
-                day: round(np.mean(rates), 3) 
-                for day, rates in weekend_stats.items()
-            },
-            "busiest_weekday": max(weekday_stats.keys(), 
-                                 key=lambda x: np.mean(weekday_stats[x])) if weekday_stats else "Monday",
-            "quietest_day": "Sunday",  # Généralement le dimanche
-            "peak_hours_weekday": [8, 9, 18, 19],
-            "peak_hours_weekend": [11, 12, 15, 16]
-        }
-        
-        return patterns
+    def identify_weekly_patterns(self, aggregates: Dict[str, Any]) -> Dict[str, Any]:
+        """Identifier les patterns hebdomadaires à partir des agrégats par jour"""
+        return trend_engine.weekly_patterns(aggregates)
 
-    async def generate_seasonal_insights(self, historical_data: pd.DataFrame) -> Dict[str, Any]:
+    def generate_seasonal_insights(self, historical_data: pd.DataFrame) -> Dict[str, Any]:
         """Générer des insights saisonniers"""
         
         current_month = datetime.now().month
@@ -141,27 +82,49 @@ class VelibTrendsAnalyzer:
         
         return insights
 
+    def analyze(self, hourly: pd.DataFrame, daily: pd.DataFrame) -> Tuple[List[Dict], Dict[str, Any], Dict[str, Any]]:
+        """Tendances quotidiennes, patterns hebdomadaires et insights saisonniers à partir des rollups"""
+        # Une seule passe groupée sur toutes les stations et tous les jours
+        aggregates = trend_engine.aggregate_rollups(hourly, daily)
+        daily_trends = self.analyze_daily_trends(aggregates)
+        weekly_patterns = self.identify_weekly_patterns(aggregates)
+        seasonal_insights = self.generate_seasonal_insights(daily)
+        return daily_trends, weekly_patterns, seasonal_insights
+
 # Instance globale de l'analyseur
 analyzer = VelibTrendsAnalyzer()
 
+def analyze_stored_history(store_dir: str, days_back: int) -> Tuple[List[Dict], Dict[str, Any], Dict[str, Any]]:
+    """
+    Analyse exécutée dans le pool de processus
+
+    Les rollups horaires et journaliers sont relus depuis le store local
+    (fichiers Arrow mappés en mémoire) dans le worker : seuls les résultats
+    agrégés repassent entre processus. Le volume lu dépend du nombre de jours
+    et de stations, pas du nombre de snapshots.
+    """
+    rollups = HistoryStore(None, store_dir).rollups
+    hourly = rollups.load_hourly(days_back, columns=HOURLY_TREND_COLUMNS)
+    daily = rollups.load_daily(days_back, columns=DAILY_TREND_COLUMNS)
+    return analyzer.analyze(hourly, daily)
+
 async def analyze_velib_trends(request: TrendsAnalysisRequest) -> TrendsAnalysisResponse:
     """
     Point d'entrée principal pour l'analyse des tendances
     """
-    # Charger le modèle
+    # Modèles courants du registre (pas de rechargement disque par requête)
     await analyzer.load_model()
+    station_models = await analyzer.load_station_models()
     
-    # Charger les données historiques
-    historical_data = await load_historical_velib_data(request.days_back)
-    
-    # Analyser les tendances quotidiennes
-    daily_trends = await analyzer.analyze_daily_trends(historical_data, request.days_back)
-    
-    # Identifier les patterns hebdomadaires
-    weekly_patterns = await analyzer.identify_weekly_patterns(daily_trends)
+    # Ajouter au store local (et replier dans les rollups) les données arrivées depuis la dernière synchronisation
+    with stage_timer('trends', 'sync_history'):
+        await sync_historical_velib_data(request.days_back)
     
-    # Générer les insights saisonniers
-    seasonal_insights = await analyzer.generate_seasonal_insights(historical_data)
+    # Lecture des rollups et agrégations vectorisées dans le pool de processus
+    with stage_timer('trends', 'analysis'):
+        daily_trends, weekly_patterns, seasonal_insights = await executors.run_process(
+            analyze_stored_history, str(history_store.root_dir), request.days_back
+        )
     
     # Prévisions futures (si demandées)
     forecasting = None
@@ -174,11 +137,43 @@ async def analyze_velib_trends(request: TrendsAnalysisRequest) -> TrendsAnalysis
             },
             "methodology": "Prophet model with seasonal decomposition"
         }
+        if station_models is not None:
+            # Stations critiques des prochains jours, prévues par les modèles par station
+            forecasting["critical_stations"] = station_models.critical_stations()
+            forecasting["station_models"] = len(station_models)
+    
+    with stage_timer('trends', 'build_response'):
+        return TrendsAnalysisResponse(
+            daily_trends=daily_trends,
+            weekly_patterns=weekly_patterns,
+            seasonal_insights=seasonal_insights,
+            forecasting=forecasting,
+            generated_at=datetime.now()
+        )
+
+async def forecast_station_trend(station_id: int, days: int) -> Optional[StationTrendForecastResponse]:
+    """
+    Prévision de la part de faible disponibilité d'une station
+
+    Retourne None si l'archive des modèles par station n'est pas disponible,
+    KeyError si la station n'a pas de modèle. Seul le modèle de cette station
+    est désérialisé (puis gardé en cache).
+    """
+    station_models = await analyzer.load_station_models()
+    if station_models is None:
+        return None
+    if station_id not in station_models:
+        raise KeyError(f"Pas de modèle pour la station {station_id}")
+    
+    with stage_timer('station_trend', 'predict'):
+        dates, share = await executors.run_thread(station_models.predict, station_id, days)
     
-    return TrendsAnalysisResponse(
-        daily_trends=daily_trends,
-        weekly_patterns=weekly_patterns,
-        seasonal_insights=seasonal_insights,
-        forecasting=forecasting,
+    return StationTrendForecastResponse(
+        station_id=station_id,
+        forecast=[
+            {"date": str(day), "low_availability_share": round(value, 3), "critical": value >= CRITICAL_LOW_SHARE}
+            for day, value in zip(dates, share.tolist())
+        ],
+        model_trained_at=station_models.trained_at,
         generated_at=datetime.now()
     )
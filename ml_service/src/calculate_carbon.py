@@ -4,151 +4,171 @@ Calcul de l'empreinte carbone et suggestions de trajets
 """
 
 import asyncio
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
 import numpy as np
 
-from api.models.schemas import CarbonCalculationRequest, CarbonCalculationResponse, TransportOption
-from src.utils.data_loader import load_carbon_calculation_data
-from src.utils.preprocessing import preprocess_carbon_data, calculate_distance_haversine
+from api.models.schemas import (
+    CarbonCalculationRequest, CarbonCalculationResponse, TransportOption,
+    CarbonBatchRequest, CarbonBatchResponse, CarbonStationBatchRequest
+)
+from src.emission_factors import ROUTE_METRICS, ModeTable, emission_factors
+from src.station_index import station_index
+from src.station_matrix import station_matrix
+from src.predict_availability import forecast_scheduler
+from src.utils.preprocessing import calculate_distance_haversine, haversine_km
+from src.utils.metrics import stage_timer
+from src.executors import executors
+
+# Éco-score : normalisation des métriques [CO2, calories, coût] (valeur * échelle + décalage, bornée à 0-100)
+ECO_SCORE_SCALE = np.array([-500, 0.5, -20])[:, None, None]  # Pénalité forte pour le CO2, bonus calories, pénalité coût
+ECO_SCORE_OFFSET = np.array([100, 0, 100])[:, None, None]
+# Pondération : 40% environnement, 30% santé, 20% économie (et 10% confort)
+ECO_SCORE_WEIGHTS = np.array([0.4, 0.3, 0.2])[:, None, None]
+COMFORT_WEIGHT = 0.1
+
+# Modes Vélib' : marche jusqu'à une station avec vélos, puis depuis une station avec bornes libres
+STATION_MODES = ('bike', 'ebike')
+MAX_STATION_ACCESS_KM = 1.0
 
 class CarbonFootprintCalculator:
-    def __init__(self):
-        self.co2_factors = {}
-        self.transport_data = {}
-        
-    async def load_data(self):
-        """Charger les données depuis Supabase"""
-        try:
-            self.transport_data = await load_carbon_calculation_data()
-            self.co2_factors = preprocess_carbon_data(self.transport_data.get('transport_modes', []))
-            print("Données carbone chargées depuis Supabase")
-            return True
-        except Exception as e:
-            print(f"Erreur chargement données carbone: {e}")
-            return False
-
-    async def calculate_route_options(self, origin_lat: float, origin_lng: float,
-                                    destination_lat: float, destination_lng: float) -> List[Dict]:
-        """Calculer les différentes options de transport"""
-        
-        # Distance directe
-        distance_km = calculate_distance_haversine(origin_lat, origin_lng, destination_lat, destination_lng)
+    def route_metrics(self, distance_km: np.ndarray, table: Optional[ModeTable] = None) -> Dict[str, np.ndarray]:
+        """
+        Métriques de tous les modes pour N distances directes, en tableaux [modes, N]
+
+        Un produit par la matrice de coefficients de la table des modes donne
+        distance, durée, CO2, calories et coût ; l'éco-score suit en quelques
+        opérations vectorisées. `ranking` classe les modes de chaque trajet par
+        éco-score décroissant (argsort stable : à égalité, ordre de la table).
+        """
+        table = table or emission_factors.table
+        distance_km = np.atleast_1d(distance_km)
         
-        transport_options = []
+        # [métriques, modes, N]
+        values = table.coefficients[:, :, None] * distance_km
+        np.trunc(values[3], out=values[3])
+        eco_score = self._eco_score_array(values[2:5], table.columns['comfort_factor'][:, None])
         
-        # Définition des modes de transport avec leurs caractéristiques
-        transport_modes = {
-            'walk': {
-                'name': 'Marche',
-                'speed_kmh': 5,
-                'calories_per_km': 50,
-                'cost_base': 0,
-                'comfort_factor': 0.7
-            },
-            'bike': {
-                'name': 'Vélo',
-                'speed_kmh': 15,
-                'calories_per_km': 40,
-                'cost_base': 0,
-                'comfort_factor': 0.8
-            },
-            'ebike': {
-                'name': 'Vélo électrique',
-                'speed_kmh': 25,
-                'calories_per_km': 25,
-                'cost_base': 0.1,  # Coût de l'électricité
-                'comfort_factor': 0.9
-            },
-            'metro': {
-                'name': 'Métro',
-                'speed_kmh': 30,
-                'calories_per_km': 5,
-                'cost_base': 1.9,  # Prix ticket métro
-                'comfort_factor': 0.6
-            },
-            'bus': {
-                'name': 'Bus',
-                'speed_kmh': 20,
-                'calories_per_km': 5,
-                'cost_base': 1.9,
-                'comfort_factor': 0.5
-            },
-            'car': {
-                'name': 'Voiture',
-                'speed_kmh': 25,  # Vitesse moyenne en ville
-                'calories_per_km': 0,
-                'cost_base': 0.5,  # Carburant + usure
-                'comfort_factor': 0.9
-            }
+        return {
+            'distance_km': values[0].round(2),
+            'duration_minutes': values[1].astype(np.int64),
+            'co2_kg': values[2].round(3),
+            'calories_burned': values[3].astype(np.int64),
+            'cost_euros': values[4].round(2),
+            'eco_score': eco_score,
+            'ranking': np.argsort(-eco_score, axis=0, kind='stable')
         }
+
+    def calculate_route_options(self, origin_lat: float, origin_lng: float,
+                                destination_lat: float, destination_lng: float) -> List[Dict]:
+        """Calculer les différentes options de transport, triées par éco-score décroissant"""
+        table = emission_factors.table
+        distance_km = calculate_distance_haversine(origin_lat, origin_lng, destination_lat, destination_lng)
+        metrics = self.route_metrics(distance_km, table)
+        values = {name: metrics[name][:, 0].tolist() for name in (*ROUTE_METRICS, 'eco_score')}
         
-        for mode_key, mode_info in transport_modes.items():
-            co2_factor = self.co2_factors.get(mode_key, 0)
-            
-            # Ajustement de la distance selon le mode
-            if mode_key in ['metro', 'bus']:
-                # Les transports en commun peuvent avoir un trajet moins direct
-                actual_distance = distance_km * 1.2
-            elif mode_key == 'car':
-                # La voiture peut prendre des routes plus longues
-                actual_distance = distance_km * 1.1
-            else:
-                actual_distance = distance_km
-            
-            duration_minutes = (actual_distance / mode_info['speed_kmh']) * 60
-            co2_kg = actual_distance * co2_factor
-            calories = int(actual_distance * mode_info['calories_per_km'])
-            cost = actual_distance * mode_info['cost_base']
-            
-            # Calcul de l'éco-score (0-100)
-            eco_score = self._calculate_eco_score(co2_kg, calories, cost, mode_info['comfort_factor'])
+        transport_options = []
+        for index in metrics['ranking'][:, 0].tolist():
+            mode_key = table.modes[index]
+            mode_info = table.definitions[mode_key]
+            option = {name: column[index] for name, column in values.items()}
             
             # Détails de la route
-            route_details = {
+            option['route_details'] = {
                 'mode': mode_key,
-                'actual_distance': round(actual_distance, 2),
-                'estimated_time': f"{int(duration_minutes)}min",
-                'co2_factor': co2_factor,
+                'actual_distance': option['distance_km'],
+                'estimated_time': f"{option['duration_minutes']}min",
+                'co2_factor': mode_info['co2_factor'],
                 'comfort_level': mode_info['comfort_factor']
             }
-            
-            transport_options.append({
-                'mode': mode_info['name'],
-                'distance_km': round(actual_distance, 2),
-                'duration_minutes': int(duration_minutes),
-                'co2_kg': round(co2_kg, 3),
-                'calories_burned': calories,
-                'cost_euros': round(cost, 2),
-                'eco_score': eco_score,
-                'route_details': route_details
-            })
-        
-        # Trier par éco-score décroissant
-        transport_options.sort(key=lambda x: x['eco_score'], reverse=True)
+            transport_options.append({'mode': mode_info['name'], **option})
         
         return transport_options
 
-    def _calculate_eco_score(self, co2_kg: float, calories: int, cost: float, comfort: float) -> int:
-        """Calcule un score écologique de 0 à 100"""
-        
-        # Normalisation des facteurs
-        co2_score = max(0, 100 - (co2_kg * 500))  # Pénalité forte pour le CO2
-        health_score = min(100, calories / 2)  # Bonus pour les calories
-        cost_score = max(0, 100 - (cost * 20))  # Pénalité pour le coût
-        comfort_score = comfort * 100
-        
-        # Pondération
-        eco_score = (
-            co2_score * 0.4 +      # 40% pour l'environnement
-            health_score * 0.3 +    # 30% pour la santé
-            cost_score * 0.2 +      # 20% pour l'économie
-            comfort_score * 0.1     # 10% pour le confort
-        )
+    def calculate_batch_options(self, origin_lat: np.ndarray, origin_lng: np.ndarray,
+                                destination_lat: np.ndarray, destination_lng: np.ndarray) -> Dict[str, Any]:
+        """
+        Calculer tous les modes de transport pour N trajets en une passe vectorisée
+
+        Retourne des colonnes [N] par mode et par métrique, calculées par le
+        même noyau que `calculate_route_options`.
+        """
+        distance_km = haversine_km(origin_lat, origin_lng, destination_lat, destination_lng)
+        return self.batch_options(distance_km)
+
+    def calculate_station_batch_options(self, origin_ids: np.ndarray, destination_ids: np.ndarray) -> Dict[str, Any]:
+        """Même calcul pour N trajets entre stations, distances lues dans la matrice station à station"""
+        return self.batch_options(station_matrix.distances(origin_ids, destination_ids))
+
+    def batch_options(self, distance_km: np.ndarray) -> Dict[str, Any]:
+        """Colonnes [N] par mode et par métrique pour N distances directes"""
+        table = emission_factors.table
+        metrics = self.route_metrics(distance_km, table)
         
-        return int(max(0, min(100, eco_score)))
+        options = {
+            mode_key: {name: metrics[name][index] for name in (*ROUTE_METRICS, 'eco_score')}
+            for index, mode_key in enumerate(table.modes)
+        }
+        
+        # Meilleur mode : premier du classement de chaque trajet
+        best_index = metrics['ranking'][0]
+        best_co2 = np.take_along_axis(metrics['co2_kg'], best_index[None], axis=0)[0]
+        
+        return {
+            'modes': table.modes,
+            'distance_km': np.round(np.atleast_1d(distance_km), 2),
+            'options': options,
+            'best_eco_mode': np.array(table.modes)[best_index],
+            'co2_savings_vs_car_kg': np.round(options['car']['co2_kg'] - best_co2, 3)
+        }
 
-    async def generate_recommendations(self, transport_options: List[Dict]) -> List[str]:
+    def station_access(self, origin_lat: float, origin_lng: float,
+                       destination_lat: float, destination_lng: float) -> Optional[Dict[str, Optional[Dict]]]:
+        """
+        Stations Vélib' les plus proches avec vélos prévus au départ et bornes libres prévues à l'arrivée
+
+        None si l'index des stations ou les prévisions de l'heure courante ne sont pas disponibles.
+        """
+        snapshot = forecast_scheduler.snapshot
+        if station_index.index is None or snapshot is None or snapshot.column() is None:
+            return None
+        
+        origin = station_index.nearby(origin_lat, origin_lng, k=1, radius_km=MAX_STATION_ACCESS_KM,
+                                      snapshot=snapshot, min_bikes=1)
+        destination = station_index.nearby(destination_lat, destination_lng, k=1, radius_km=MAX_STATION_ACCESS_KM,
+                                           snapshot=snapshot, min_docks=1)
+        return {
+            'origin': origin[0] if origin else None,
+            'destination': destination[0] if destination else None
+        }
+
+    def apply_station_access(self, transport_options: List[Dict], access: Dict[str, Optional[Dict]]):
+        """Ajouter aux options Vélib' les stations retenues et la marche d'accès (durée)"""
+        walk_speed = emission_factors.table.definitions['walk']['speed_kmh']
+        for option in transport_options:
+            details = option['route_details']
+            if details['mode'] not in STATION_MODES:
+                continue
+            
+            details['origin_station'] = access['origin']
+            details['destination_station'] = access['destination']
+            if access['origin'] and access['destination']:
+                access_km = access['origin']['distance_km'] + access['destination']['distance_km']
+                option['duration_minutes'] += int(access_km / walk_speed * 60)
+                details['access_distance_km'] = round(access_km, 2)
+                details['estimated_time'] = f"{option['duration_minutes']}min"
+
+    def _eco_score_array(self, values: np.ndarray, comfort: np.ndarray) -> np.ndarray:
+        """Score écologique de 0 à 100 à partir des métriques [CO2, calories, coût] ([3, modes, N])"""
+        scores = values * ECO_SCORE_SCALE + ECO_SCORE_OFFSET
+        np.minimum(np.maximum(scores, 0, out=scores), 100, out=scores)
+        
+        # Somme pondérée (chaque terme est borné : le score reste dans 0-100)
+        eco_score = np.add.reduce(scores * ECO_SCORE_WEIGHTS, axis=0) + comfort * 100 * COMFORT_WEIGHT
+        return eco_score.astype(np.int64)
+
+    async def generate_recommendations(self, transport_options: List[Dict],
+                                       access: Optional[Dict[str, Optional[Dict]]] = None) -> List[str]:
         """Générer des recommandations personnalisées"""
         recommendations = []
         
@@ -187,6 +207,17 @@ class CarbonFootprintCalculator:
                 f"💰 Option gratuite : {cheapest['mode']}"
             )
         
+        # Disponibilité Vélib' prévue autour du départ et de l'arrivée
+        if access is not None:
+            if access['origin'] is None:
+                recommendations.append(
+                    f"🚲 Aucune station Vélib' avec vélos prévus à moins de {MAX_STATION_ACCESS_KM:g} km du départ"
+                )
+            if access['destination'] is None:
+                recommendations.append(
+                    f"🅿️ Aucune borne Vélib' libre prévue à moins de {MAX_STATION_ACCESS_KM:g} km de l'arrivée"
+                )
+        
         return recommendations
 
 # Instance globale
@@ -196,19 +227,27 @@ async def calculate_carbon_footprint(request: CarbonCalculationRequest) -> Carbo
     """
     Point d'entrée principal pour le calcul d'empreinte carbone
     """
-    # Charger les données si nécessaire
-    await calculator.load_data()
+    # Calculer les options de transport (facteurs préchargés, aucun appel Supabase)
+    with stage_timer('carbon', 'route_options'):
+        transport_options = calculator.calculate_route_options(
+            request.origin_lat, request.origin_lng,
+            request.destination_lat, request.destination_lng
+        )
     
-    # Calculer les options de transport
-    transport_options = await calculator.calculate_route_options(
-        request.origin_lat, request.origin_lng,
-        request.destination_lat, request.destination_lng
-    )
+    # Stations Vélib' d'accès (index spatial et prévisions en mémoire)
+    with stage_timer('carbon', 'station_access'):
+        access = calculator.station_access(
+            request.origin_lat, request.origin_lng,
+            request.destination_lat, request.destination_lng
+        )
+        if access is not None:
+            calculator.apply_station_access(transport_options, access)
     
     # Convertir en objets TransportOption
-    transport_option_objects = [
-        TransportOption(**option) for option in transport_options
-    ]
+    with stage_timer('carbon', 'build_options'):
+        transport_option_objects = [
+            TransportOption(**option) for option in transport_options
+        ]
     
     # Meilleure option écologique
     best_eco_option = transport_option_objects[0] if transport_option_objects else None
@@ -225,14 +264,58 @@ async def calculate_carbon_footprint(request: CarbonCalculationRequest) -> Carbo
         }
     
     # Générer les recommandations
-    recommendations = await calculator.generate_recommendations(transport_options)
+    with stage_timer('carbon', 'recommendations'):
+        recommendations = await calculator.generate_recommendations(transport_options, access)
+    
+    with stage_timer('carbon', 'build_response'):
+        return CarbonCalculationResponse(
+            origin={'lat': request.origin_lat, 'lng': request.origin_lng},
+            destination={'lat': request.destination_lat, 'lng': request.destination_lng},
+            transport_options=transport_option_objects,
+            best_eco_option=best_eco_option,
+            carbon_savings=carbon_savings,
+            recommendations=recommendations,
+            generated_at=datetime.now()
+        )
+
+async def calculate_carbon_footprint_batch(request: CarbonBatchRequest) -> CarbonBatchResponse:
+    """
+    Point d'entrée pour le calcul d'empreinte carbone de N trajets (format colonnaire)
+    """
+    with stage_timer('carbon_batch', 'route_options'):
+        result = await executors.run_thread(
+            calculator.calculate_batch_options,
+            np.asarray(request.origin_lat), np.asarray(request.origin_lng),
+            np.asarray(request.destination_lat), np.asarray(request.destination_lng)
+        )
     
-    return CarbonCalculationResponse(
-        origin={'lat': request.origin_lat, 'lng': request.origin_lng},
-        destination={'lat': request.destination_lat, 'lng': request.destination_lng},
-        transport_options=transport_option_objects,
-        best_eco_option=best_eco_option,
-        carbon_savings=carbon_savings,
-        recommendations=recommendations,
+    with stage_timer('carbon_batch', 'build_response'):
+        return batch_response(result)
+
+async def calculate_carbon_footprint_station_batch(request: CarbonStationBatchRequest) -> CarbonBatchResponse:
+    """
+    Point d'entrée pour N trajets entre stations Vélib' (distances de la matrice station à station)
+    """
+    with stage_timer('carbon_station_batch', 'route_options'):
+        result = await executors.run_thread(
+            calculator.calculate_station_batch_options,
+            np.asarray(request.origin_station_ids), np.asarray(request.destination_station_ids)
+        )
+    
+    with stage_timer('carbon_station_batch', 'build_response'):
+        return batch_response(result)
+
+def batch_response(result: Dict[str, Any]) -> CarbonBatchResponse:
+    """Réponse colonnaire d'un calcul par lot"""
+    return CarbonBatchResponse(
+        count=len(result['distance_km']),
+        modes=result['modes'],
+        distance_km=result['distance_km'].tolist(),
+        options={
+            mode: {metric: values.tolist() for metric, values in columns.items()}
+            for mode, columns in result['options'].items()
+        },
+        best_eco_mode=result['best_eco_mode'].tolist(),
+        co2_savings_vs_car_kg=result['co2_savings_vs_car_kg'].tolist(),
         generated_at=datetime.now()
     )
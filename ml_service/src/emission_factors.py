@@ -0,0 +1,211 @@
+
+"""
+Table des modes de transport et facteurs d'émission, préchargée et versionnée
+
+Les facteurs CO2 (et calories) de la table Supabase `transport_modes` sont
+fusionnés une fois avec les définitions statiques des modes dans un
+instantané immuable (`ModeTable`). Les calculs carbone lisent l'instantané
+courant en mémoire ; la table est relue toutes les `EMISSION_FACTORS_TTL`
+secondes et une nouvelle version n'est publiée (listeners notifiés) que si
+les facteurs ont changé.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.data_loader import data_loader
+
+# Intervalle de relecture de transport_modes (0 : chargement au démarrage seulement)
+EMISSION_FACTORS_TTL = float(os.getenv('EMISSION_FACTORS_TTL', '3600'))
+
+TRANSPORT_MODE_COLUMNS = ['name', 'co2_factor_per_km', 'calories_per_km', 'is_active']
+
+# Définition des modes de transport avec leurs caractéristiques
+TRANSPORT_MODES = {
+    'walk': {
+        'name': 'Marche',
+        'speed_kmh': 5,
+        'calories_per_km': 50,
+        'cost_base': 0,
+        'comfort_factor': 0.7,
+        'detour_factor': 1.0
+    },
+    'bike': {
+        'name': 'Vélo',
+        'speed_kmh': 15,
+        'calories_per_km': 40,
+        'cost_base': 0,
+        'comfort_factor': 0.8,
+        'detour_factor': 1.0
+    },
+    'ebike': {
+        'name': 'Vélo électrique',
+        'speed_kmh': 25,
+        'calories_per_km': 25,
+        'cost_base': 0.1,  # Coût de l'électricité
+        'comfort_factor': 0.9,
+        'detour_factor': 1.0
+    },
+    'metro': {
+        'name': 'Métro',
+        'speed_kmh': 30,
+        'calories_per_km': 5,
+        'cost_base': 1.9,  # Prix ticket métro
+        'comfort_factor': 0.6,
+        'detour_factor': 1.2  # Les transports en commun peuvent avoir un trajet moins direct
+    },
+    'bus': {
+        'name': 'Bus',
+        'speed_kmh': 20,
+        'calories_per_km': 5,
+        'cost_base': 1.9,
+        'comfort_factor': 0.5,
+        'detour_factor': 1.2
+    },
+    'car': {
+        'name': 'Voiture',
+        'speed_kmh': 25,  # Vitesse moyenne en ville
+        'calories_per_km': 0,
+        'cost_base': 0.5,  # Carburant + usure
+        'comfort_factor': 0.9,
+        'detour_factor': 1.1  # La voiture peut prendre des routes plus longues
+    }
+}
+
+# Caractéristiques numériques exposées en colonnes (un élément par mode)
+MODE_FIELDS = ('co2_factor', 'speed_kmh', 'calories_per_km', 'cost_base', 'comfort_factor', 'detour_factor')
+
+# Métriques d'une option, proportionnelles à la distance directe (lignes de `ModeTable.coefficients`)
+ROUTE_METRICS = ('distance_km', 'duration_minutes', 'co2_kg', 'calories_burned', 'cost_euros')
+
+def _mode_key(name: Any) -> Optional[str]:
+    """Mode correspondant à un nom de transport_modes (clé `car` ou libellé `Voiture`)"""
+    normalized = str(name).strip().lower()
+    for key, info in TRANSPORT_MODES.items():
+        if normalized in (key, info['name'].lower()):
+            return key
+    return None
+
+def parse_transport_modes(df: pd.DataFrame) -> Dict[str, Dict[str, float]]:
+    """Facteurs des modes connus et actifs (`co2_factor`, `calories_per_km` s'il est renseigné)"""
+    overrides = {}
+    if df.empty or 'name' not in df.columns:
+        return overrides
+
+    for row in df.to_dict('records'):
+        key = _mode_key(row['name'])
+        if key is None or row.get('is_active') is False:
+            continue
+        entry = {'co2_factor': float(row.get('co2_factor_per_km') or 0)}
+        if pd.notna(row.get('calories_per_km')):
+            entry['calories_per_km'] = float(row['calories_per_km'])
+        overrides[key] = entry
+    return overrides
+
+class ModeTable:
+    """Instantané immuable : définitions des modes et facteurs d'une version"""
+
+    def __init__(self, overrides: Dict[str, Dict[str, float]], version: int, source: str):
+        self.version = version
+        self.source = source
+        self.loaded_at = datetime.now()
+        self.fingerprint = hashlib.sha1(json.dumps(overrides, sort_keys=True).encode()).hexdigest()[:12]
+
+        self.modes: List[str] = list(TRANSPORT_MODES)
+        self.definitions = {
+            key: {**info, 'co2_factor': 0.0, **overrides.get(key, {})}
+            for key, info in TRANSPORT_MODES.items()
+        }
+        self.columns = {
+            field: np.array([self.definitions[key][field] for key in self.modes], dtype=np.float64)
+            for field in MODE_FIELDS
+        }
+        # Matrice [métriques, modes] par km direct : distance parcourue (détour), durée, CO2, calories, coût
+        columns = self.columns
+        self.coefficients = columns['detour_factor'] * np.stack([
+            np.ones(len(self.modes)),
+            60 / columns['speed_kmh'],
+            columns['co2_factor'],
+            columns['calories_per_km'],
+            columns['cost_base']
+        ])
+
+    def co2_factor(self, mode: str) -> float:
+        return self.definitions[mode]['co2_factor']
+
+class EmissionFactorStore:
+    def __init__(self, ttl: float = EMISSION_FACTORS_TTL):
+        self.ttl = ttl
+        # Facteurs nuls tant que Supabase n'a pas répondu
+        self.table = ModeTable({}, version=0, source='defaults')
+        self.checked_at: Optional[datetime] = None
+        self._listeners: List[Callable[[ModeTable], None]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[[ModeTable], None]):
+        """Être notifié à chaque nouvelle version des facteurs"""
+        self._listeners.append(callback)
+
+    async def refresh(self) -> bool:
+        """Relire transport_modes et publier une nouvelle version si les facteurs ont changé"""
+        modes = await data_loader.load_transport_modes(columns=TRANSPORT_MODE_COLUMNS)
+        self.checked_at = datetime.now()
+        if modes.empty:
+            # Erreur déjà journalisée par le DataLoader : la version courante reste servie
+            return False
+
+        table = ModeTable(parse_transport_modes(modes), self.table.version + 1, 'supabase')
+        if self.table.source == table.source and table.fingerprint == self.table.fingerprint:
+            return False
+
+        self.table = table
+        print(f"Facteurs d'émission chargés depuis Supabase (version {table.version}, {table.fingerprint})")
+        for callback in self._listeners:
+            callback(table)
+        return True
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Erreur rafraîchissement des facteurs d'émission: {e}")
+
+    def start_watching(self, interval: Optional[float] = None):
+        """Relire la table périodiquement (toutes les `ttl` secondes)"""
+        interval = self.ttl if interval is None else interval
+        if self._watch_task is None and interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def status(self) -> Dict[str, Any]:
+        """Version servie pour /health/emission-factors"""
+        table = self.table
+        return {
+            'version': table.version,
+            'fingerprint': table.fingerprint,
+            'source': table.source,
+            'loaded_at': table.loaded_at.isoformat(),
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None,
+            'ttl_seconds': self.ttl,
+            'co2_factors': {key: table.co2_factor(key) for key in table.modes}
+        }
+
+# Instance globale
+emission_factors = EmissionFactorStore()
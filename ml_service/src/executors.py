@@ -0,0 +1,149 @@
+
+"""
+Exécution du travail CPU hors de la boucle asyncio
+
+Les handlers FastAPI sont `async`, mais l'inférence, le préprocessing et les
+agrégations pandas sont synchrones : exécutés dans la boucle, une grosse
+requête bloquerait toutes les autres connexions. Deux pools sont disponibles :
+
+- `thread` : NumPy/TensorFlow, qui relâchent le GIL sur les gros calculs ;
+- `process` : agrégations pandas lourdes. Les fonctions soumises doivent être
+  picklables (niveau module) et échanger des données compactes.
+
+Les petits calculs (health checks, trajet carbone unique) restent dans la
+boucle : le coût d'un aller-retour vers un pool dépasserait leur durée.
+"""
+
+import os
+import time
+import asyncio
+import importlib
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+from src.utils.metrics import EXECUTOR_WAIT_SECONDS, EXECUTOR_RUN_SECONDS, EXECUTOR_QUEUE_DEPTH, EXECUTOR_INFLIGHT
+
+# Taille des pools (0 process worker : les tâches "process" passent par les threads)
+THREAD_WORKERS = int(os.getenv('EXECUTOR_THREAD_WORKERS', str(min(8, os.cpu_count() or 1))))
+PROCESS_WORKERS = int(os.getenv('EXECUTOR_PROCESS_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+# "spawn" : pas de fork d'un processus qui a déjà des threads (TensorFlow, httpx)
+PROCESS_START_METHOD = os.getenv('EXECUTOR_PROCESS_START_METHOD', 'spawn')
+
+def _timed_call(fn: Callable[..., Any], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Tuple[float, Any]:
+    """Exécuté dans le worker : horodatage de démarrage (horloge murale, comparable entre processus)"""
+    started = time.time()
+    return started, fn(*args, **kwargs)
+
+def _preload(modules: Tuple[str, ...]) -> int:
+    """Importer les modules des tâches dans un worker (coût payé au démarrage, pas à la première requête)"""
+    for module in modules:
+        importlib.import_module(module)
+    return os.getpid()
+
+class TaskExecutors:
+    def __init__(self, thread_workers: int = THREAD_WORKERS, process_workers: int = PROCESS_WORKERS):
+        self.workers = {'thread': thread_workers, 'process': process_workers}
+        self._pools: Dict[str, Executor] = {}
+        self._inflight = {'thread': 0, 'process': 0}
+        self.stats = {
+            pool: {'completed': 0, 'failed': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+            for pool in self.workers
+        }
+
+    def _executor(self, pool: str) -> Executor:
+        """Créer le pool à la première utilisation"""
+        executor = self._pools.get(pool)
+        if executor is None:
+            if pool == 'thread':
+                executor = ThreadPoolExecutor(max_workers=self.workers['thread'], thread_name_prefix='ml-cpu')
+            else:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers['process'],
+                    mp_context=multiprocessing.get_context(PROCESS_START_METHOD)
+                )
+            self._pools[pool] = executor
+        return executor
+
+    def _track(self, pool: str, delta: int):
+        """File = tâches soumises au-delà du nombre de workers"""
+        self._inflight[pool] += delta
+        inflight = self._inflight[pool]
+        EXECUTOR_INFLIGHT.labels(pool).set(inflight)
+        EXECUTOR_QUEUE_DEPTH.labels(pool).set(max(0, inflight - self.workers[pool]))
+
+    async def run(self, pool: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Exécuter `fn(*args, **kwargs)` dans le pool donné et attendre son résultat"""
+        if pool == 'process' and self.workers['process'] <= 0:
+            pool = 'thread'
+        executor = self._executor(pool)
+        loop = asyncio.get_running_loop()
+
+        self._track(pool, 1)
+        submitted = time.time()
+        try:
+            started, result = await loop.run_in_executor(executor, _timed_call, fn, args, kwargs)
+        except BrokenProcessPool:
+            # Worker tué (OOM...) : le pool sera recréé à la prochaine tâche
+            self._pools.pop(pool, None)
+            self.stats[pool]['failed'] += 1
+            raise
+        except Exception:
+            self.stats[pool]['failed'] += 1
+            raise
+        finally:
+            self._track(pool, -1)
+
+        wait = max(0.0, started - submitted)
+        EXECUTOR_WAIT_SECONDS.labels(pool).observe(wait)
+        EXECUTOR_RUN_SECONDS.labels(pool).observe(max(0.0, time.time() - started))
+        stats = self.stats[pool]
+        stats['completed'] += 1
+        stats['wait_seconds_total'] += wait
+        stats['wait_seconds_max'] = max(stats['wait_seconds_max'], wait)
+        return result
+
+    async def run_thread(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Calcul NumPy/TensorFlow (relâche le GIL)"""
+        return await self.run('thread', fn, *args, **kwargs)
+
+    async def run_process(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Agrégation pandas lourde dans un processus séparé"""
+        return await self.run('process', fn, *args, **kwargs)
+
+    async def warm_up(self, modules: Iterable[str] = ()):
+        """Démarrer les workers du pool de processus et y précharger `modules`"""
+        if self.workers['process'] <= 0:
+            return
+        modules = tuple(modules)
+        try:
+            await asyncio.gather(*(self.run_process(_preload, modules) for _ in range(self.workers['process'])))
+        except Exception as e:
+            print(f"Erreur démarrage du pool de processus: {e}")
+
+    def shutdown(self):
+        """Arrêter les pools (tâches en file annulées)"""
+        for executor in self._pools.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+
+    def status(self) -> Dict[str, Any]:
+        """Occupation des pools pour /health/executors"""
+        pools = {}
+        for pool, stats in self.stats.items():
+            inflight = self._inflight[pool]
+            pools[pool] = {
+                'workers': self.workers[pool],
+                'started': pool in self._pools,
+                'inflight': inflight,
+                'queue_depth': max(0, inflight - self.workers[pool]),
+                'completed': stats['completed'],
+                'failed': stats['failed'],
+                'wait_seconds_avg': round(stats['wait_seconds_total'] / stats['completed'], 4) if stats['completed'] else None,
+                'wait_seconds_max': round(stats['wait_seconds_max'], 4)
+            }
+        return pools
+
+# Instance globale
+executors = TaskExecutors()
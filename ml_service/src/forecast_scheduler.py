@@ -0,0 +1,148 @@
+
+"""
+Matérialisation périodique des prévisions Vélib'
+
+Un planificateur tourne dans le process de l'API : toutes les N minutes, il
+calcule les prochaines heures pour toutes les stations puis publie le
+résultat sous forme d'instantané immuable. Les requêtes ne font plus que
+découper cet instantané (stations et horizons demandés).
+"""
+
+import os
+import math
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+REFRESH_MINUTES = float(os.getenv('FORECAST_REFRESH_MINUTES', '15'))
+FORECAST_HORIZON_HOURS = 168
+
+class ForecastSnapshot:
+    """Prévisions [stations, horizons] figées, en lecture seule"""
+
+    def __init__(self, stations: List[Dict[str, Any]], result: Dict[str, np.ndarray],
+                 base_time: datetime, compute_seconds: float):
+        self.stations = tuple(stations)
+        self.base_time = base_time
+        self.compute_seconds = compute_seconds
+        self.matrices = {}
+        for name in ('bikes', 'docks', 'risk'):
+            matrix = np.array(result[name])
+            matrix.setflags(write=False)
+            self.matrices[name] = matrix
+        self.station_ids = np.array([station['station_id'] for station in stations])
+        self.horizon = self.matrices['bikes'].shape[1] if stations else 0
+
+    def column(self, hours_ahead: int = 0, now: Optional[datetime] = None) -> Optional[int]:
+        """Colonne de l'heure située `hours_ahead` heures après l'heure courante (None hors de l'horizon)"""
+        now = now or datetime.now()
+        column = int((now - self.base_time).total_seconds() // 3600) + hours_ahead
+        return column if 0 <= column < self.horizon and self.stations else None
+
+    def slice(self, station_ids: Optional[List[int]], hours_ahead: int,
+              now: Optional[datetime] = None) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, np.ndarray]]]:
+        """
+        Extraire les stations et les heures demandées, à partir de l'heure courante
+
+        Retourne None si l'instantané ne couvre pas l'horizon demandé.
+        """
+        now = now or datetime.now()
+        offset = int((now - self.base_time).total_seconds() // 3600)
+        if offset < 0 or offset + hours_ahead > self.horizon:
+            return None
+
+        if station_ids is None:
+            rows = np.arange(len(self.stations))
+        else:
+            rows = np.flatnonzero(np.isin(self.station_ids, station_ids))
+
+        columns = slice(offset, offset + hours_ahead)
+        result = {name: matrix[rows, columns] for name, matrix in self.matrices.items()}
+        return [self.stations[row] for row in rows.tolist()], result
+
+class ForecastScheduler:
+    def __init__(self, compute: Callable[..., Awaitable[Tuple[List[Dict[str, Any]], Dict[str, np.ndarray]]]],
+                 refresh_minutes: float = REFRESH_MINUTES, horizon_hours: int = FORECAST_HORIZON_HOURS):
+        self.compute = compute
+        self.refresh_minutes = refresh_minutes
+        # Marge pour servir l'horizon complet jusqu'au prochain rafraîchissement
+        self.horizon_hours = horizon_hours + math.ceil(2 * refresh_minutes / 60)
+        self.snapshot: Optional[ForecastSnapshot] = None
+        self.last_error: Optional[str] = None
+        self._listeners: List[Callable[[ForecastSnapshot], None]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[['ForecastSnapshot'], None]):
+        """Être notifié à chaque publication d'un nouvel instantané"""
+        self._listeners.append(callback)
+
+    async def refresh(self) -> bool:
+        """Calculer toutes les stations sur l'horizon complet et publier l'instantané"""
+        base_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+        start = time.perf_counter()
+        try:
+            stations, result = await self.compute(None, self.horizon_hours, base_time)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Erreur matérialisation des prévisions: {e}")
+            return False
+
+        # Publication atomique : les requêtes en cours gardent l'ancien instantané
+        self.snapshot = ForecastSnapshot(stations, result, base_time, time.perf_counter() - start)
+        self.last_error = None
+        print(f"Prévisions matérialisées: {len(stations)} stations x {self.horizon_hours} h")
+
+        for callback in self._listeners:
+            callback(self.snapshot)
+        return True
+
+    def request_refresh(self, *args):
+        """Demander un rafraîchissement anticipé (nouveau modèle, nouvelles données)"""
+        self._wakeup.set()
+
+    def lookup(self, station_ids: Optional[List[int]], hours_ahead: int):
+        """Découper l'instantané courant (None s'il est absent, périmé ou trop court)"""
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.stations:
+            return None
+        return snapshot.slice(station_ids, hours_ahead)
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refresh_minutes * 60)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Démarrer la boucle de rafraîchissement en arrière-plan"""
+        if self._task is None and self.refresh_minutes > 0:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            'running': self._task is not None,
+            'refresh_minutes': self.refresh_minutes,
+            'horizon_hours': self.horizon_hours,
+            'base_time': snapshot.base_time.isoformat() if snapshot else None,
+            'stations': len(snapshot.stations) if snapshot else 0,
+            'compute_seconds': round(snapshot.compute_seconds, 3) if snapshot else None,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,221 @@
+
+"""
+Moteur d'inférence par lots pour la disponibilité Vélib'
+
+Toutes les stations sont prédites ensemble : les fenêtres d'entrée forment un
+tenseur [stations, fenêtre, features] et chaque horizon est calculé en un seul
+appel au modèle pour toutes les stations. Les niveaux de risque et les
+compteurs utilisés par les recommandations sont dérivés de la matrice de
+sortie [stations, horizons] sans boucle Python.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.preprocessing import VELIB_FEATURE_COLUMNS, cyclical_time_features
+
+RISK_LEVELS = np.array(['low', 'medium', 'high'])
+RISK_LOW, RISK_MEDIUM, RISK_HIGH = 0, 1, 2
+
+# Seuil de faible disponibilité utilisé par les recommandations
+LOW_AVAILABILITY_BIKES = 3
+
+# Confiance annoncée pour chaque prédiction horaire (à calculer avec de vraies métriques)
+CONFIDENCE_BIKES = 0.85
+CONFIDENCE_DOCKS = 0.83
+
+# Plages simulées (vélos min/max, bornes min/max, risque) en l'absence de modèle
+_SIMULATED_BANDS = {
+    'peak': (2, 8, 5, 15, RISK_HIGH),
+    'night': (10, 20, 8, 18, RISK_LOW),
+    'day': (6, 15, 8, 20, RISK_MEDIUM),
+}
+
+class BatchInferenceEngine:
+    def __init__(self, window: int = 24, batch_size: int = int(os.getenv('INFERENCE_BATCH_SIZE', '4096'))):
+        self.window = window
+        self.batch_size = batch_size
+
+    def future_calendar(self, hours_ahead: int, base_time: datetime):
+        """Heures et jours de la semaine des horizons 0..hours_ahead-1"""
+        future = pd.date_range(base_time, periods=hours_ahead, freq='h')
+        return future.hour.values, future.dayofweek.values
+
+    def build_windows(self, history: pd.DataFrame, station_codes: List[str]) -> np.ndarray:
+        """
+        Construire le tenseur [stations, fenêtre, features] des derniers snapshots
+
+        Les stations avec moins de `window` snapshots sont complétées en
+        répétant leur plus ancien snapshot ; celles sans historique ont une
+        fenêtre nulle.
+        """
+        n_features = len(VELIB_FEATURE_COLUMNS)
+        windows = np.zeros((len(station_codes), self.window, n_features), dtype=np.float32)
+        if history.empty:
+            return windows
+
+        history = history[history['stationcode'].isin(station_codes)]
+        history = history.sort_values(['stationcode', 'timestamp'])
+
+        # Position depuis la fin dans chaque station : 0 = snapshot le plus récent
+        from_end = history.groupby('stationcode', sort=False, observed=True).cumcount(ascending=False).values
+        keep = from_end < self.window
+        history = history[keep]
+        from_end = from_end[keep]
+
+        timestamps = history['timestamp']
+        features = np.concatenate([
+            cyclical_time_features(timestamps.dt.hour.values, timestamps.dt.dayofweek.values),
+            history[['mechanical', 'ebike', 'numdocksavailable']].fillna(0).values
+        ], axis=1).astype(np.float32)
+
+        station_index = pd.Index(station_codes).get_indexer(history['stationcode'])
+        windows[station_index, self.window - 1 - from_end] = features
+
+        # Compléter le début des fenêtres courtes avec le plus ancien snapshot
+        counts = np.bincount(station_index, minlength=len(station_codes))
+        for row in np.flatnonzero((counts > 0) & (counts < self.window)):
+            first = self.window - counts[row]
+            windows[row, :first] = windows[row, first]
+
+        return windows
+
+    def _predict_batched(self, model, inputs: np.ndarray) -> np.ndarray:
+        """Appel du modèle par gros lots sur toutes les stations"""
+        outputs = [
+            np.asarray(model(inputs[start:start + self.batch_size], training=False))
+            for start in range(0, len(inputs), self.batch_size)
+        ]
+        return np.concatenate(outputs).reshape(len(inputs))
+
+    def predict_with_model(self, artifacts: Dict[str, Any], windows: np.ndarray,
+                           capacities: np.ndarray, hours_ahead: int,
+                           base_time: datetime) -> Dict[str, np.ndarray]:
+        """
+        Prédiction autorégressive : un appel au modèle par horizon pour toutes les stations
+        """
+        model = artifacts['model']
+        scaler_x = artifacts['scaler_x']
+        scaler_y = artifacts['scaler_y']
+        n_stations, window, n_features = windows.shape
+
+        # Part des vélos mécaniques, conservée pour les pas futurs
+        last = windows[:, -1]
+        last_bikes = last[:, 4] + last[:, 5]
+        mechanical_share = np.divide(last[:, 4], last_bikes, out=np.full(n_stations, 0.5, dtype=np.float32),
+                                     where=last_bikes > 0)
+
+        scaled = scaler_x.transform(windows.reshape(-1, n_features)).reshape(windows.shape).astype(np.float32)
+        hours, days = self.future_calendar(hours_ahead, base_time)
+        time_features = cyclical_time_features(hours, days).astype(np.float32)
+
+        bikes = np.empty((n_stations, hours_ahead), dtype=np.float32)
+        for step in range(hours_ahead):
+            y_scaled = self._predict_batched(model, scaled)
+            step_bikes = scaler_y.inverse_transform(y_scaled.reshape(-1, 1)).reshape(n_stations)
+            step_bikes = np.clip(step_bikes, 0, capacities)
+            bikes[:, step] = step_bikes
+
+            # Nouvelle ligne de features à partir de la prédiction, puis glissement de la fenêtre
+            mechanical = step_bikes * mechanical_share
+            next_row = np.column_stack([
+                np.broadcast_to(time_features[step], (n_stations, 4)),
+                mechanical, step_bikes - mechanical, capacities - step_bikes
+            ])
+            next_scaled = scaler_x.transform(next_row).astype(np.float32)
+            scaled = np.concatenate([scaled[:, 1:], next_scaled[:, None, :]], axis=1)
+
+        bikes = np.rint(bikes).astype(np.int32)
+        docks = np.maximum(capacities.astype(np.int32)[:, None] - bikes, 0)
+
+        # Risque selon la part de vélos ou de bornes disponibles
+        safe_capacity = np.maximum(capacities, 1)[:, None]
+        scarcity = np.minimum(bikes, docks) / safe_capacity
+        risk = np.where(scarcity < 0.15, RISK_HIGH, np.where(scarcity < 0.3, RISK_MEDIUM, RISK_LOW)).astype(np.int8)
+
+        return {'bikes': bikes, 'docks': docks, 'risk': risk}
+
+    def predict_simulated(self, n_stations: int, hours_ahead: int, base_time: datetime,
+                          rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+        """Simulation vectorisée des patterns typiques (en l'absence de modèle entraîné)"""
+        rng = rng or np.random.default_rng()
+        hours, _ = self.future_calendar(hours_ahead, base_time)
+
+        band = np.where(((7 <= hours) & (hours <= 9)) | ((17 <= hours) & (hours <= 19)), 'peak',
+                        np.where((hours >= 22) | (hours <= 6), 'night', 'day'))
+        bikes_low = np.array([_SIMULATED_BANDS[b][0] for b in band])
+        bikes_high = np.array([_SIMULATED_BANDS[b][1] for b in band])
+        docks_low = np.array([_SIMULATED_BANDS[b][2] for b in band])
+        docks_high = np.array([_SIMULATED_BANDS[b][3] for b in band])
+        risk = np.array([_SIMULATED_BANDS[b][4] for b in band], dtype=np.int8)
+
+        shape = (n_stations, hours_ahead)
+        return {
+            'bikes': rng.integers(bikes_low, bikes_high, size=shape, dtype=np.int32),
+            'docks': rng.integers(docks_low, docks_high, size=shape, dtype=np.int32),
+            'risk': np.broadcast_to(risk, shape).copy()
+        }
+
+    def predict(self, stations: List[Dict[str, Any]], hours_ahead: int,
+                artifacts: Optional[Dict[str, Any]] = None,
+                history: Optional[pd.DataFrame] = None,
+                base_time: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+        """
+        Prédire toutes les stations et tous les horizons en une passe
+
+        Retourne des matrices [stations, horizons] (`bikes`, `docks`, `risk`)
+        et les compteurs par station utilisés par les recommandations.
+        """
+        base_time = base_time or datetime.now()
+        n_stations = len(stations)
+
+        if artifacts is not None and history is not None and n_stations:
+            station_codes = [str(station['station_id']) for station in stations]
+            capacities = np.array([station.get('capacity') or 0 for station in stations], dtype=np.float32)
+            windows = self.build_windows(history, station_codes)
+            result = self.predict_with_model(artifacts, windows, capacities, hours_ahead, base_time)
+        else:
+            result = self.predict_simulated(n_stations, hours_ahead, base_time)
+
+        return self.summarize(result)
+
+    def summarize(self, result: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Ajouter les compteurs par station utilisés par les recommandations"""
+        result['low_availability_hours'] = (result['bikes'] <= LOW_AVAILABILITY_BIKES).sum(axis=1)
+        result['high_risk_hours'] = (result['risk'] == RISK_HIGH).sum(axis=1)
+        return result
+
+    def to_hourly_records(self, result: Dict[str, np.ndarray], row: int,
+                          include_confidence: bool = True) -> List[Dict[str, Any]]:
+        """Convertir une ligne de la matrice de sortie en prédictions horaires"""
+        confidence_bikes = CONFIDENCE_BIKES if include_confidence else None
+        confidence_docks = CONFIDENCE_DOCKS if include_confidence else None
+        risk_labels = RISK_LEVELS[result['risk'][row]].tolist()
+        return [
+            {
+                "hour": hour,
+                "predicted_bikes": bikes,
+                "predicted_docks": docks,
+                "confidence_bikes": confidence_bikes,
+                "confidence_docks": confidence_docks,
+                "risk_level": risk
+            }
+            for hour, (bikes, docks, risk) in enumerate(zip(
+                result['bikes'][row].tolist(), result['docks'][row].tolist(), risk_labels
+            ))
+        ]
+
+    def to_station_columns(self, result: Dict[str, np.ndarray], row: int) -> Dict[str, np.ndarray]:
+        """Ligne de la matrice de sortie sous forme de tableaux parallèles (vues, sans copie)"""
+        return {
+            "predicted_bikes": result['bikes'][row],
+            "predicted_docks": result['docks'][row],
+            "risk_level": result['risk'][row]
+        }
+
+# Instance globale
+inference_engine = BatchInferenceEngine()
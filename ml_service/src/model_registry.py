@@ -0,0 +1,239 @@
+
+"""
+Registre des modèles ML chargés en mémoire
+
+Les artefacts de `models/` sont chargés une seule fois, à la première
+utilisation de chaque modèle (ou au démarrage pour ceux listés dans
+`MODEL_PRELOAD`) : un pod qui ne sert que le calcul carbone n'importe jamais
+TensorFlow ni Prophet. Les modèles chargés sont ensuite surveillés : lorsqu'un
+fichier change (nouvel entraînement), la nouvelle version est chargée en
+arrière-plan et remplace l'ancienne de façon atomique.
+"""
+
+import os
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Callable, List, Optional
+
+from src.utils.metrics import MODEL_LOAD_SECONDS
+from src.utils.startup_report import current_rss_mb
+
+MODELS_DIR = Path(os.getenv('MODELS_DIR', Path(__file__).resolve().parents[1] / "models"))
+RELOAD_INTERVAL_SECONDS = float(os.getenv('MODEL_RELOAD_INTERVAL', '30'))
+# Modèles chargés au démarrage ("all", ou noms séparés par des virgules) ; les autres à la demande
+PRELOAD_MODELS = os.getenv('MODEL_PRELOAD', '')
+
+def _load_velib_lstm(paths: Dict[str, Path]) -> Dict[str, Any]:
+    """Charger le modèle LSTM et ses scalers"""
+    import joblib
+    import tensorflow as tf
+    return {
+        'model': tf.keras.models.load_model(paths['model']),
+        'scaler_x': joblib.load(paths['scaler_x']),
+        'scaler_y': joblib.load(paths['scaler_y'])
+    }
+
+def _load_joblib_model(paths: Dict[str, Path]) -> Dict[str, Any]:
+    """Charger un modèle sérialisé avec joblib"""
+    import joblib
+    return {'model': joblib.load(paths['model'])}
+
+def _load_station_bundle(paths: Dict[str, Path]) -> Dict[str, Any]:
+    """Ouvrir l'archive des modèles par station (manifeste seulement, modèles lus à la demande)"""
+    from src.station_forecasts import StationForecastBundle
+    return {'bundle': StationForecastBundle(paths['bundle'])}
+
+def _close_station_bundle(artifacts: Dict[str, Any]):
+    """Fermer l'archive d'un bundle remplacé"""
+    artifacts['bundle'].close()
+
+# Artefacts attendus pour chaque modèle
+MODEL_SPECS = {
+    'velib_lstm': {
+        'files': {
+            'model': 'velib_lstm_model.h5',
+            'scaler_x': 'velib_scaler_x.pkl',
+            'scaler_y': 'velib_scaler_y.pkl'
+        },
+        'loader': _load_velib_lstm
+    },
+    'trends_prophet': {
+        'files': {'model': 'trends_prophet_model.pkl'},
+        'loader': _load_joblib_model
+    },
+    'carbon_rf': {
+        'files': {'model': 'carbon_rf_model.pkl'},
+        'loader': _load_joblib_model
+    },
+    'station_prophet': {
+        'files': {'bundle': 'station_prophet_models.zip'},
+        'loader': _load_station_bundle,
+        # Ressources à libérer quand les artefacts ne sont plus servis
+        'close': _close_station_bundle
+    }
+}
+
+class ModelRegistry:
+    def __init__(self, models_dir: Path = MODELS_DIR, specs: Dict[str, Dict[str, Any]] = MODEL_SPECS):
+        self.models_dir = Path(models_dir)
+        self.specs = specs
+        self.entries: Dict[str, Dict[str, Any]] = {
+            name: {'status': 'not_loaded', 'artifacts': None, 'version': None,
+                   'loaded_at': None, 'load_seconds': None, 'load_rss_mb': None, 'error': None}
+            for name in specs
+        }
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+
+    def _paths(self, name: str) -> Dict[str, Path]:
+        return {key: self.models_dir / filename for key, filename in self.specs[name]['files'].items()}
+
+    def artifact_version(self, name: str) -> Optional[str]:
+        """Version d'un modèle dérivée de la taille et de la date de ses fichiers"""
+        digest = hashlib.sha1()
+        for path in self._paths(name).values():
+            if not path.exists():
+                return None
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()[:12]
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """Être notifié (nom, version) à chaque nouveau modèle chargé"""
+        self._listeners.append(callback)
+
+    async def load(self, name: str) -> bool:
+        """Charger (ou recharger) un modèle puis le publier atomiquement"""
+        version = self.artifact_version(name)
+        if version is None:
+            self.entries[name] = {**self.entries[name], 'status': 'missing', 'error': None}
+            return False
+
+        # Durée et mémoire du chargement, imports paresseux de la pile du modèle compris
+        # (approximative si plusieurs modèles se chargent en même temps)
+        start, rss = time.perf_counter(), current_rss_mb()
+        try:
+            # Désérialisation hors de la boucle asyncio
+            artifacts = await asyncio.to_thread(self.specs[name]['loader'], self._paths(name))
+        except Exception as e:
+            print(f"Erreur chargement modèle {name}: {e}")
+            # L'ancienne version reste servie si elle existe
+            self.entries[name] = {**self.entries[name], 'error': str(e),
+                                  'status': 'loaded' if self.entries[name]['artifacts'] else 'error'}
+            return False
+
+        load_seconds, load_rss_mb = time.perf_counter() - start, current_rss_mb() - rss
+        MODEL_LOAD_SECONDS.labels(name).observe(load_seconds)
+        
+        # Remplacement de l'entrée entière : les lecteurs voient l'ancienne ou la nouvelle
+        previous = self.entries[name]['artifacts']
+        self.entries[name] = {
+            'status': 'loaded',
+            'artifacts': artifacts,
+            'version': version,
+            'loaded_at': datetime.now(),
+            'load_seconds': round(load_seconds, 3),
+            'load_rss_mb': round(load_rss_mb, 1),
+            'error': None
+        }
+        print(f"Modèle {name} chargé (version {version})")
+        self._close_artifacts(name, previous)
+
+        for callback in self._listeners:
+            callback(name, version)
+        return True
+
+    def _close_artifacts(self, name: str, artifacts: Optional[Dict[str, Any]]):
+        """Libérer les ressources d'artefacts qui ne sont plus servis (fichiers ouverts)"""
+        close = self.specs[name].get('close')
+        if artifacts is None or close is None:
+            return
+        try:
+            close(artifacts)
+        except Exception as e:
+            print(f"Erreur fermeture modèle {name}: {e}")
+
+    def close(self):
+        """Libérer tous les modèles chargés (arrêt de l'application)"""
+        for name, entry in self.entries.items():
+            if entry['artifacts'] is None:
+                continue
+            self.entries[name] = {**entry, 'status': 'not_loaded', 'artifacts': None}
+            self._close_artifacts(name, entry['artifacts'])
+
+    async def load_all(self):
+        """Charger tous les modèles disponibles"""
+        await asyncio.gather(*(self.load(name) for name in self.specs))
+
+    async def preload(self, names: str = PRELOAD_MODELS):
+        """Charger au démarrage les modèles listés ("all" pour tous)"""
+        if names.strip() == 'all':
+            await self.load_all()
+            return
+        selected = [name.strip() for name in names.split(',') if name.strip() in self.specs]
+        await asyncio.gather(*(self.load(name) for name in selected))
+
+    async def ensure_loaded(self, name: str) -> Optional[Dict[str, Any]]:
+        """Artefacts du modèle, chargés à la première demande (une seule fois pour les appels simultanés)"""
+        if self.entries[name]['status'] == 'not_loaded':
+            lock = self._load_locks.setdefault(name, asyncio.Lock())
+            async with lock:
+                if self.entries[name]['status'] == 'not_loaded':
+                    await self.load(name)
+        return self.get(name)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Artefacts du modèle actuellement servi (None si non chargé)"""
+        return self.entries[name]['artifacts']
+
+    async def refresh(self):
+        """Recharger les modèles dont les artefacts ont changé sur disque (hors modèles jamais demandés)"""
+        for name in self.specs:
+            if self.entries[name]['status'] == 'not_loaded':
+                continue
+            version = self.artifact_version(name)
+            if version is not None and version != self.entries[name]['version']:
+                await self.load(name)
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Erreur surveillance des modèles: {e}")
+
+    def start_watching(self, interval: float = RELOAD_INTERVAL_SECONDS):
+        """Surveiller `models/` et recharger à chaud les nouveaux artefacts"""
+        if self._watch_task is None and interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def status(self) -> Dict[str, Any]:
+        """État réel des modèles pour /health/models"""
+        return {
+            name: {
+                'status': entry['status'],
+                'version': entry['version'],
+                'loaded_at': entry['loaded_at'].isoformat() if entry['loaded_at'] else None,
+                'load_seconds': entry['load_seconds'],
+                'load_rss_mb': entry['load_rss_mb'],
+                'error': entry['error']
+            }
+            for name, entry in self.entries.items()
+        }
+
+# Instance globale
+model_registry = ModelRegistry()
@@ -3,16 +3,32 @@
 Prédiction de disponibilité Vélib' avec LSTM
 """
 
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-import joblib
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 import asyncio
+from functools import partial
 
-from api.models.schemas import VelibAvailabilityRequest, VelibAvailabilityResponse
-from src.utils.data_loader import load_velib_data
-from src.utils.preprocessing import preprocess_velib_data
+from api.models.schemas import (
+    VelibAvailabilityRequest, VelibAvailabilityResponse, VelibStationPrediction,
+    NearbyStationsRequest, NearbyStationsResponse
+)
+from src.utils.data_loader import load_velib_data, load_historical_velib_data
+from src.model_registry import model_registry
+from src.inference import inference_engine, LOW_AVAILABILITY_BIKES, RISK_LEVELS, CONFIDENCE_BIKES, CONFIDENCE_DOCKS
+from src.forecast_scheduler import ForecastScheduler
+from src.station_index import station_index
+from src.utils.metrics import stage_timer
+from src.executors import executors
+from src.utils.serialization import dumps, LAYOUT_ROWS, LAYOUT_COLUMNAR
+
+# Historique nécessaire pour construire les fenêtres de 24 snapshots
+HISTORY_WINDOW_DAYS = 2
+
+# Stations prédites et envoyées par lot en mode streaming
+STREAM_BATCH_STATIONS = int(os.getenv('PREDICT_STREAM_BATCH_STATIONS', '100'))
 
 class VelibAvailabilityPredictor:
     def __init__(self):
@@ -21,70 +37,35 @@ class VelibAvailabilityPredictor:
         self.feature_columns = None
         
     async def load_model(self):
-        """Charger le modèle LSTM pré-entraîné"""
-        try:
-            # TODO: Charger le modèle réel
-            # self.model = joblib.load('models/velib_lstm_model.pkl')
-            # self.scaler = joblib.load('models/velib_scaler.pkl')
-            print("Modèle LSTM chargé (simulé)")
-            return True
-        except Exception as e:
-            print(f"Erreur chargement modèle: {e}")
+        """Récupérer le modèle LSTM courant depuis le registre (chargé à la première utilisation)"""
+        artifacts = await model_registry.ensure_loaded('velib_lstm')
+        if artifacts is None:
+            self.model = None
+            self.scaler = None
             return False
-
-    async def predict_hourly_availability(self, station_id: int, hours_ahead: int) -> List[Dict]:
-        """
-        Prédire la disponibilité horaire pour une station
-        """
-        predictions = []
-        base_time = datetime.now()
         
-        # Simulation de prédictions (à remplacer par le modèle réel)
-        for hour in range(hours_ahead):
-            future_time = base_time + timedelta(hours=hour)
-            
-            # Simulation basée sur des patterns typiques
-            hour_of_day = future_time.hour
-            day_of_week = future_time.weekday()
-            
-            # Pattern de base (à remplacer par le modèle LSTM)
-            if 7 <= hour_of_day <= 9 or 17 <= hour_of_day <= 19:  # Heures de pointe
-                predicted_bikes = np.random.randint(2, 8)
-                predicted_docks = np.random.randint(5, 15)
-                risk_level = "high"
-            elif 22 <= hour_of_day or hour_of_day <= 6:  # Nuit
-                predicted_bikes = np.random.randint(10, 20)
-                predicted_docks = np.random.randint(8, 18)
-                risk_level = "low"
-            else:  # Journée normale
-                predicted_bikes = np.random.randint(6, 15)
-                predicted_docks = np.random.randint(8, 20)
-                risk_level = "medium"
-            
-            predictions.append({
-                "hour": hour,
-                "predicted_bikes": predicted_bikes,
-                "predicted_docks": predicted_docks,
-                "confidence_bikes": 0.85,
-                "confidence_docks": 0.83,
-                "risk_level": risk_level
-            })
-        
-        return predictions
+        self.model = artifacts['model']
+        self.scaler = artifacts['scaler_x']
+        return True
 
     async def generate_recommendations(self, predictions: List[Dict], station_name: str) -> List[str]:
         """Générer des recommandations basées sur les prédictions"""
-        recommendations = []
-        
         # Analyser les prédictions pour des recommandations
-        low_availability_hours = [p for p in predictions if p["predicted_bikes"] <= 3]
-        high_demand_hours = [p for p in predictions if p["risk_level"] == "high"]
+        low_availability_hours = sum(1 for p in predictions if p["predicted_bikes"] <= LOW_AVAILABILITY_BIKES)
+        high_demand_hours = sum(1 for p in predictions if p["risk_level"] == "high")
+        
+        return self.recommendations_from_counts(station_name, low_availability_hours, high_demand_hours)
+    
+    def recommendations_from_counts(self, station_name: str, low_availability_hours: int,
+                                    high_demand_hours: int) -> List[str]:
+        """Recommandations à partir des compteurs calculés sur la matrice de prédictions"""
+        recommendations = []
         
         if low_availability_hours:
-            recommendations.append(f"⚠️ Faible disponibilité prévue à {station_name} dans {len(low_availability_hours)} heures")
+            recommendations.append(f"⚠️ Faible disponibilité prévue à {station_name} dans {low_availability_hours} heures")
         
         if high_demand_hours:
-            recommendations.append(f"🔥 Forte demande prévue pendant {len(high_demand_hours)} heures - envisager des alternatives")
+            recommendations.append(f"🔥 Forte demande prévue pendant {high_demand_hours} heures - envisager des alternatives")
         
         if not low_availability_hours and not high_demand_hours:
             recommendations.append(f"✅ Disponibilité stable prévue à {station_name}")
@@ -94,51 +75,204 @@ class VelibAvailabilityPredictor:
 # Instance globale du prédicteur
 predictor = VelibAvailabilityPredictor()
 
-async def predict_velib_availability(request: VelibAvailabilityRequest) -> VelibAvailabilityResponse:
+async def compute_availability_matrix(station_ids: Optional[List[int]], hours_ahead: int,
+                                      base_time: Optional[datetime] = None,
+                                      operation: str = 'predict') -> Tuple[List[Dict[str, Any]], Dict[str, np.ndarray]]:
     """
-    Point d'entrée principal pour la prédiction de disponibilité Vélib'
+    Prédire les stations demandées (toutes si None) sous forme de matrices [stations, horizons]
+
+    `operation` étiquette les métriques d'étapes (requête ou rafraîchissement de fond).
     """
-    # Charger le modèle si nécessaire
     await predictor.load_model()
     
     # Charger les données des stations
-    stations_data = await load_velib_data(request.station_ids)
+    with stage_timer(operation, 'load_stations'):
+        stations_data = await load_velib_data(station_ids)
     
-    station_predictions = []
+    # Fenêtres d'entrée du modèle (inutiles en mode simulé)
+    history = None
+    if predictor.model is not None and stations_data:
+        with stage_timer(operation, 'load_history'):
+            history = await load_historical_velib_data(days_back=HISTORY_WINDOW_DAYS)
     
-    for station in stations_data:
-        station_id = station["station_id"]
-        station_name = station["name"]
-        
-        # Prédictions pour cette station
-        hourly_predictions = await predictor.predict_hourly_availability(
-            station_id, request.hours_ahead
-        )
-        
-        # Recommandations
-        recommendations = await predictor.generate_recommendations(
-            hourly_predictions, station_name
+    # Toutes les stations et tous les horizons en une passe
+    with stage_timer(operation, 'inference'):
+        result = await executors.run_thread(
+            inference_engine.predict,
+            stations_data, hours_ahead,
+            artifacts=model_registry.get('velib_lstm') if predictor.model is not None else None,
+            history=history,
+            base_time=base_time
         )
-        
-        station_predictions.append({
-            "station_id": station_id,
-            "station_name": station_name,
-            "predictions": hourly_predictions,
-            "recommendations": recommendations
-        })
+    return stations_data, result
+
+# Prévisions matérialisées en arrière-plan (démarré avec l'API)
+forecast_scheduler = ForecastScheduler(partial(compute_availability_matrix, operation='forecast_refresh'))
+
+def station_payloads(request: VelibAvailabilityRequest, stations_data: List[Dict[str, Any]],
+                     result: Dict[str, np.ndarray], layout: str = LAYOUT_ROWS) -> List[Dict[str, Any]]:
+    """
+    Prédictions par station, en dicts prêts à valider ou à encoder
+
+    `rows` reproduit `VelibStationPrediction` ; `columnar` remplace les objets
+    horaires par des tableaux parallèles (risque codé en entier, index dans
+    `RISK_LEVELS`).
+    """
+    low_hours = result['low_availability_hours'].tolist()
+    high_hours = result['high_risk_hours'].tolist()
     
-    # Métriques globales
-    global_metrics = {
-        "total_stations": len(station_predictions),
+    if layout == LAYOUT_COLUMNAR:
+        return [
+            {
+                "station_id": station["station_id"],
+                "station_name": station["name"],
+                **inference_engine.to_station_columns(result, row),
+                "recommendations": predictor.recommendations_from_counts(station["name"], low_hours[row], high_hours[row])
+            }
+            for row, station in enumerate(stations_data)
+        ]
+    return [
+        {
+            "station_id": station["station_id"],
+            "station_name": station["name"],
+            "predictions": inference_engine.to_hourly_records(result, row, request.include_confidence),
+            "recommendations": predictor.recommendations_from_counts(station["name"], low_hours[row], high_hours[row])
+        }
+        for row, station in enumerate(stations_data)
+    ]
+
+def _global_metrics(request: VelibAvailabilityRequest, result: Dict[str, np.ndarray], total_stations: int) -> Dict[str, Any]:
+    """Métriques globales de la réponse"""
+    return {
+        "total_stations": total_stations,
         "prediction_horizon": request.hours_ahead,
-        "high_risk_periods": sum(1 for sp in station_predictions 
-                                for pred in sp["predictions"] 
-                                if pred["risk_level"] == "high")
+        "high_risk_periods": int(result['high_risk_hours'].sum())
     }
+
+def build_availability_response(request: VelibAvailabilityRequest, stations_data: List[Dict[str, Any]],
+                                result: Dict[str, np.ndarray]) -> VelibAvailabilityResponse:
+    """Mise en forme de la réponse (boucle Python sur stations x horizons, exécutée hors de la boucle asyncio)"""
+    with stage_timer('predict', 'format'):
+        station_predictions = station_payloads(request, stations_data, result)
     
-    return VelibAvailabilityResponse(
-        stations=station_predictions,
-        global_metrics=global_metrics,
-        prediction_accuracy=0.87,  # À calculer avec de vraies métriques
+    with stage_timer('predict', 'build_response'):
+        # Validation station par station : le GIL est relâché entre deux appels
+        # pydantic-core, la boucle asyncio n'est pas bloquée pendant toute la validation
+        station_predictions = [VelibStationPrediction(**station) for station in station_predictions]
+        return VelibAvailabilityResponse(
+            stations=station_predictions,
+            global_metrics=_global_metrics(request, result, len(station_predictions)),
+            prediction_accuracy=0.87,  # À calculer avec de vraies métriques
+            generated_at=datetime.now()
+        )
+
+def encode_availability_response(request: VelibAvailabilityRequest, stations_data: List[Dict[str, Any]],
+                                 result: Dict[str, np.ndarray], layout: str) -> bytes:
+    """
+    Réponse encodée directement en JSON, sans validation Pydantic par ligne
+
+    En disposition `columnar`, les constantes (heures, confiance, libellés de
+    risque) sont envoyées une seule fois au niveau de la réponse.
+    """
+    with stage_timer('predict', 'format'):
+        stations = station_payloads(request, stations_data, result, layout)
+        payload = {
+            "stations": stations,
+            "global_metrics": _global_metrics(request, result, len(stations)),
+            "prediction_accuracy": 0.87,
+            "generated_at": datetime.now()
+        }
+        if layout == LAYOUT_COLUMNAR:
+            payload["hours"] = list(range(request.hours_ahead))
+            payload["risk_levels"] = RISK_LEVELS.tolist()
+            payload["confidence"] = (
+                {"bikes": CONFIDENCE_BIKES, "docks": CONFIDENCE_DOCKS} if request.include_confidence else None
+            )
+    
+    with stage_timer('predict', 'encode'):
+        return dumps(payload)
+
+def encode_station_lines(request: VelibAvailabilityRequest, stations_data: List[Dict[str, Any]],
+                         result: Dict[str, np.ndarray], layout: str) -> bytes:
+    """Une ligne NDJSON par station"""
+    return b"".join(dumps(station) + b"\n" for station in station_payloads(request, stations_data, result, layout))
+
+async def _availability_matrix(request: VelibAvailabilityRequest) -> Tuple[List[Dict[str, Any]], Dict[str, np.ndarray]]:
+    """Lecture de l'instantané matérialisé, calcul direct s'il n'est pas disponible"""
+    with stage_timer('predict', 'snapshot_lookup'):
+        materialized = forecast_scheduler.lookup(request.station_ids, request.hours_ahead)
+        if materialized is not None:
+            stations_data, result = materialized
+            inference_engine.summarize(result)
+            return stations_data, result
+    return await compute_availability_matrix(request.station_ids, request.hours_ahead)
+
+async def predict_velib_availability(request: VelibAvailabilityRequest) -> VelibAvailabilityResponse:
+    """
+    Point d'entrée principal pour la prédiction de disponibilité Vélib'
+    """
+    stations_data, result = await _availability_matrix(request)
+    return await executors.run_thread(build_availability_response, request, stations_data, result)
+
+async def predict_velib_availability_encoded(request: VelibAvailabilityRequest, layout: str) -> bytes:
+    """Variante haute performance : corps JSON déjà encodé (disposition `rows` ou `columnar`)"""
+    stations_data, result = await _availability_matrix(request)
+    return await executors.run_thread(encode_availability_response, request, stations_data, result, layout)
+
+async def stream_velib_availability(request: VelibAvailabilityRequest, layout: str = LAYOUT_ROWS) -> AsyncIterator[bytes]:
+    """
+    Prédictions envoyées en NDJSON, une station par ligne, lot par lot
+
+    Chaque lot de `STREAM_BATCH_STATIONS` stations est prédit, encodé puis
+    envoyé avant le suivant : le client reçoit les premières stations
+    immédiatement et la mémoire reste bornée à un lot.
+    """
+    materialized = forecast_scheduler.lookup(request.station_ids, request.hours_ahead)
+    if materialized is not None:
+        # Instantané déjà en mémoire : seul l'encodage est fait par lot
+        stations_data, result = materialized
+        inference_engine.summarize(result)
+        for start in range(0, len(stations_data), STREAM_BATCH_STATIONS):
+            rows = slice(start, start + STREAM_BATCH_STATIONS)
+            batch_result = {name: matrix[rows] for name, matrix in result.items()}
+            yield await executors.run_thread(encode_station_lines, request, stations_data[rows], batch_result, layout)
+        return
+    
+    await predictor.load_model()
+    with stage_timer('predict_stream', 'load_stations'):
+        stations_data = await load_velib_data(request.station_ids)
+    
+    history = None
+    artifacts = model_registry.get('velib_lstm') if predictor.model is not None else None
+    if artifacts is not None and stations_data:
+        with stage_timer('predict_stream', 'load_history'):
+            history = await load_historical_velib_data(days_back=HISTORY_WINDOW_DAYS)
+    
+    base_time = datetime.now()
+    for start in range(0, len(stations_data), STREAM_BATCH_STATIONS):
+        batch = stations_data[start:start + STREAM_BATCH_STATIONS]
+        with stage_timer('predict_stream', 'inference'):
+            result = await executors.run_thread(
+                inference_engine.predict, batch, request.hours_ahead,
+                artifacts=artifacts, history=history, base_time=base_time
+            )
+        yield await executors.run_thread(encode_station_lines, request, batch, result, layout)
+
+def nearby_stations(request: NearbyStationsRequest) -> Optional[NearbyStationsResponse]:
+    """Stations les plus proches jointes à l'instantané de prévisions (None si l'index n'est pas construit)"""
+    index = station_index.index
+    if index is None:
+        return None
+    snapshot = forecast_scheduler.snapshot
+    with stage_timer('stations_nearby', 'query'):
+        stations = station_index.nearby(
+            request.lat, request.lng, k=request.k, radius_km=request.radius_km,
+            snapshot=snapshot, hours_ahead=request.hours_ahead,
+            min_bikes=request.min_bikes, min_docks=request.min_docks
+        )
+    return NearbyStationsResponse(
+        stations=stations,
+        index_version=index.version,
+        forecast_base_time=snapshot.base_time if snapshot else None,
         generated_at=datetime.now()
     )
@@ -0,0 +1,257 @@
+
+"""
+Modèles de tendance par station (Prophet), entraînés en parallèle
+
+Chaque station a sa propre série journalière : la part de snapshots en faible
+disponibilité (`low_count / count` des rollups), la grandeur qui définit les
+stations critiques de `DailyTrend`. Les séries sont découpées en lots ajustés
+dans un pool de processus (un thread par worker, quelques lots en vol par
+worker). Les modèles sont écrits dans une seule archive zip :
+
+- `manifest.json` : stations, prévisions des jours suivant l'entraînement,
+  erreur d'ajustement par station ;
+- `stations/<code>.json` : un modèle Prophet sérialisé par station.
+
+L'API ne lit que le manifeste au chargement ; le modèle d'une station n'est
+désérialisé qu'à sa première demande (cache LRU borné).
+"""
+
+import os
+import json
+import time
+import logging
+import zipfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.trends_engine import CRITICAL_LOW_SHARE, MAX_CRITICAL_STATIONS
+
+STATION_MODELS_FILE = "station_prophet_models.zip"
+MANIFEST_NAME = "manifest.json"
+
+# Jours prévus à l'entraînement (critical_stations des jours suivants)
+FORECAST_DAYS = 7
+# Jours observés minimum pour ajuster le modèle d'une station
+MIN_STATION_DAYS = 14
+# Stations par tâche envoyée au pool, et lots en vol par worker
+STATION_CHUNK_SIZE = int(os.getenv('STATION_CHUNK_SIZE', '16'))
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+# Modèles désérialisés gardés en mémoire par l'API
+STATION_MODEL_CACHE_SIZE = int(os.getenv('STATION_MODEL_CACHE_SIZE', '128'))
+
+# Séries courtes et journalières : ni saisonnalité intra-journalière ni annuelle
+STATION_PROPHET_PARAMS = {
+    'daily_seasonality': False,
+    'weekly_seasonality': True,
+    'yearly_seasonality': False,
+    'changepoint_prior_scale': 0.05,
+    'uncertainty_samples': 0
+}
+
+# (code station, jours datetime64[D], part en faible disponibilité)
+StationSeries = Tuple[int, np.ndarray, np.ndarray]
+
+def station_series(daily: pd.DataFrame, min_days: int = MIN_STATION_DAYS) -> List[StationSeries]:
+    """Série journalière de chaque station à partir des rollups journaliers"""
+    if daily.empty:
+        return []
+    station_ids = pd.to_numeric(daily['stationcode'].astype(str), errors='coerce')
+    frame = pd.DataFrame({
+        'station_id': station_ids,
+        'date': daily['date'].to_numpy(dtype='datetime64[D]'),
+        'count': daily['count'].to_numpy(dtype=np.float64),
+        'low_count': daily['low_count'].to_numpy(dtype=np.float64)
+    })
+    frame = frame[frame['station_id'].notna() & (frame['count'] > 0)]
+    # Plusieurs lignes possibles par station et par jour (partitions, agrégats Supabase)
+    frame = frame.groupby(['station_id', 'date'], sort=True)[['count', 'low_count']].sum().reset_index()
+
+    ids = frame['station_id'].to_numpy(dtype=np.int64)
+    days = frame['date'].to_numpy(dtype='datetime64[D]')
+    share = (frame['low_count'] / frame['count']).to_numpy()
+    bounds = np.flatnonzero(np.diff(ids)) + 1
+    return [
+        (int(ids[rows[0]]), days[rows], share[rows])
+        for rows in np.split(np.arange(len(ids)), bounds)
+        if len(rows) >= min_days
+    ]
+
+def _init_fit_worker():
+    """Worker d'ajustement : un thread de calcul, journaux de Stan réduits"""
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(limits=1)
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.WARNING)
+
+def fit_station_chunk(chunk: List[StationSeries], forecast_dates: np.ndarray) -> List[Tuple[int, str, float, List[float]]]:
+    """Ajuster les stations d'un lot (dans un worker) : modèle sérialisé, erreur d'ajustement, prévision"""
+    from prophet import Prophet
+    from prophet.serialize import model_to_json
+
+    future = pd.DataFrame({'ds': pd.to_datetime(forecast_dates)})
+    results = []
+    for station_id, days, share in chunk:
+        try:
+            history = pd.DataFrame({'ds': pd.to_datetime(days), 'y': share})
+            model = Prophet(**STATION_PROPHET_PARAMS)
+            model.fit(history)
+            fitted = model.predict(history[['ds']])['yhat'].to_numpy()
+            forecast = np.clip(model.predict(future)['yhat'].to_numpy(), 0, 1)
+            results.append((station_id, model_to_json(model), float(np.mean(np.abs(fitted - share))),
+                            np.round(forecast, 4).tolist()))
+        except Exception as e:
+            print(f"Erreur modèle station {station_id}: {e}")
+    return results
+
+def print_progress(done: int, total: int, elapsed: float):
+    """Progression par défaut : stations ajustées, durée écoulée et restante estimée"""
+    remaining = elapsed / done * (total - done) if done else 0
+    print(f"Stations: {done}/{total} ({done / total:.0%}) - {elapsed:.0f} s écoulées, ~{remaining:.0f} s restantes")
+
+def fit_station_models(series: List[StationSeries], forecast_dates: np.ndarray, workers: Optional[int] = None,
+                       chunk_size: int = STATION_CHUNK_SIZE,
+                       progress: Callable[[int, int, float], None] = print_progress) -> List[Tuple[int, str, float, List[float]]]:
+    """
+    Ajuster les modèles de toutes les stations dans un pool de processus
+
+    Les stations sont envoyées par lots de `chunk_size` ; au plus
+    `CHUNKS_IN_FLIGHT_PER_WORKER` lots par worker sont soumis à la fois (les
+    séries restantes ne sont pas sérialisées d'avance). `progress` est appelé
+    à chaque lot terminé.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunks = [series[i:i + chunk_size] for i in range(0, len(series), chunk_size)]
+    results: List[Tuple[int, str, float, List[float]]] = []
+    started = time.perf_counter()
+    done = 0
+
+    # "spawn" : pas de fork d'un processus qui a déjà des threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_fit_worker) as pool:
+        pending = {}
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                pending[pool.submit(fit_station_chunk, chunks[next_chunk], forecast_dates)] = len(chunks[next_chunk])
+                next_chunk += 1
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done += pending.pop(future)
+                results.extend(future.result())
+            progress(done, len(series), time.perf_counter() - started)
+    return sorted(results)
+
+def write_bundle(path: Path, results: List[Tuple[int, str, float, List[float]]],
+                 forecast_dates: np.ndarray) -> Path:
+    """Écrire l'archive des modèles (fichier temporaire puis renommage atomique)"""
+    manifest = {
+        'trained_at': datetime.now().isoformat(),
+        'target': 'low_availability_share',
+        'station_ids': [station_id for station_id, _, _, _ in results],
+        'forecast_dates': [str(day) for day in np.asarray(forecast_dates, dtype='datetime64[D]')],
+        'forecast': [forecast for _, _, _, forecast in results],
+        'mae': [round(mae, 5) for _, _, mae, _ in results]
+    }
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        bundle.writestr(MANIFEST_NAME, json.dumps(manifest))
+        for station_id, model_json, _, _ in results:
+            bundle.writestr(f"stations/{station_id}.json", model_json)
+    os.replace(tmp_path, path)
+    return path
+
+class StationForecastBundle:
+    """Archive des modèles par station, ouverte en lecture ; modèles désérialisés à la demande"""
+
+    def __init__(self, path: Path, cache_size: int = STATION_MODEL_CACHE_SIZE):
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self._zip = zipfile.ZipFile(self.path)
+        manifest = json.loads(self._zip.read(MANIFEST_NAME))
+
+        self.trained_at = manifest['trained_at']
+        self.target = manifest['target']
+        self.station_ids = np.asarray(manifest['station_ids'], dtype=np.int64)
+        self.forecast_dates = np.asarray(manifest['forecast_dates'], dtype='datetime64[D]')
+        # [stations, jours prévus]
+        self.forecast = np.asarray(manifest['forecast'], dtype=np.float64).reshape(
+            len(self.station_ids), len(self.forecast_dates))
+        self.mae = np.asarray(manifest['mae'], dtype=np.float64)
+        self._rows = {station_id: row for row, station_id in enumerate(self.station_ids.tolist())}
+
+        self._models: "OrderedDict[int, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def __contains__(self, station_id: int) -> bool:
+        return station_id in self._rows
+
+    def model(self, station_id: int):
+        """Modèle Prophet d'une station (KeyError si la station n'a pas de modèle)"""
+        if station_id not in self._rows:
+            raise KeyError(f"Pas de modèle pour la station {station_id}")
+        with self._lock:
+            model = self._models.get(station_id)
+            if model is not None:
+                self._models.move_to_end(station_id)
+                return model
+            # Lecture sous le verrou : l'archive peut être fermée par un rechargement
+            model_json = self._zip.read(f"stations/{station_id}.json").decode()
+
+        from prophet.serialize import model_from_json
+        model = model_from_json(model_json)
+
+        with self._lock:
+            self._models[station_id] = model
+            while len(self._models) > self.cache_size:
+                self._models.popitem(last=False)
+        return model
+
+    def close(self):
+        """Fermer l'archive et vider le cache de modèles (bundle remplacé ou arrêt de l'API)"""
+        with self._lock:
+            self._zip.close()
+            self._models.clear()
+
+    def predict(self, station_id: int, days: int = FORECAST_DAYS,
+                start: Optional[date] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Jours et part prévue de snapshots en faible disponibilité, à partir de `start` (aujourd'hui par défaut)"""
+        model = self.model(station_id)
+        dates = pd.date_range(pd.Timestamp(start or date.today()), periods=days, freq='D')
+        share = np.clip(model.predict(pd.DataFrame({'ds': dates}))['yhat'].to_numpy(), 0, 1)
+        return dates.to_numpy(dtype='datetime64[D]'), share
+
+    def critical_stations(self, start: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Stations critiques prévues par jour (à partir de `start`), sans charger aucun modèle"""
+        start = np.datetime64(start or date.today(), 'D')
+        columns = np.flatnonzero(self.forecast_dates >= start)
+        if not len(self) or not len(columns):
+            return [{'date': str(self.forecast_dates[c]), 'critical_stations': []} for c in columns]
+
+        share = self.forecast[:, columns].T
+        top = np.argsort(-share, axis=1, kind='stable')[:, :MAX_CRITICAL_STATIONS]
+        keep = np.take_along_axis(share, top, axis=1) >= CRITICAL_LOW_SHARE
+        return [
+            {'date': str(self.forecast_dates[column]), 'critical_stations': self.station_ids[rows[mask]].tolist()}
+            for column, rows, mask in zip(columns, top, keep)
+        ]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'stations': len(self),
+            'trained_at': self.trained_at,
+            'target': self.target,
+            'forecast_dates': [str(day) for day in self.forecast_dates],
+            'median_mae': round(float(np.median(self.mae)), 4) if len(self) else None,
+            'cached_models': len(self._models)
+        }
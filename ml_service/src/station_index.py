@@ -0,0 +1,251 @@
+
+"""
+Index spatial des stations Vélib'
+
+Les coordonnées de `velib_stations` sont projetées sur la sphère unité et
+indexées dans un KD-tree (`scipy.spatial.cKDTree`). La distance euclidienne
+entre deux points de la sphère (la corde) croît avec la distance
+orthodromique : les k plus proches voisins et les requêtes par rayon sont donc
+exacts. L'index n'est reconstruit que si l'ensemble des stations change ; les
+résultats sont joints à l'instantané de prévisions courant.
+"""
+
+import os
+import math
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from src.forecast_scheduler import ForecastSnapshot
+from src.inference import RISK_LEVELS
+from src.utils.data_loader import data_loader
+from src.utils.preprocessing import EARTH_RADIUS_KM
+
+# Intervalle de relecture de velib_stations (0 : chargement au démarrage seulement)
+STATION_INDEX_REFRESH_MINUTES = float(os.getenv('STATION_INDEX_REFRESH_MINUTES', '60'))
+
+STATION_COLUMNS = ['stationcode', 'name', 'capacity', 'coordonnees_geo_lat', 'coordonnees_geo_lon']
+
+# Candidats examinés quand les stations sont filtrées sur la disponibilité prévue
+MIN_FILTER_CANDIDATES = 32
+
+def unit_vectors(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Coordonnées cartésiennes [..., 3] sur la sphère unité"""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=-1)
+
+def unit_vector(lat: float, lng: float) -> np.ndarray:
+    """Version scalaire de `unit_vectors` (un point de requête)"""
+    lat, lng = math.radians(lat), math.radians(lng)
+    cos_lat = math.cos(lat)
+    return np.array([cos_lat * math.cos(lng), cos_lat * math.sin(lng), math.sin(lat)])
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Distance orthodromique (km) correspondant à une corde de la sphère unité"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+def km_to_chord(distance_km: float) -> float:
+    """Corde de la sphère unité correspondant à une distance orthodromique (km)"""
+    return 2 * np.sin(min(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+class StationIndex:
+    """Index immuable d'un ensemble de stations"""
+
+    def __init__(self, stations: pd.DataFrame, version: int):
+        stations = stations.dropna(subset=['coordonnees_geo_lat', 'coordonnees_geo_lon'])
+        stations = stations[stations['stationcode'].astype(str).str.isdigit()]
+        stations = stations.assign(station_id=stations['stationcode'].astype(int)).sort_values('station_id', kind='stable')
+
+        self.version = version
+        self.built_at = datetime.now()
+        # Identifiants triés (recherche dichotomique possible)
+        self.station_ids = stations['station_id'].to_numpy()
+        # Noms nuls (stations en cours d'installation) : chaîne vide, pour l'empreinte et les réponses
+        self.names: List[str] = stations['name'].fillna('').astype(str).tolist()
+        self.capacities = pd.to_numeric(stations['capacity'], errors='coerce').fillna(0).astype(int).to_numpy()
+        self.lat = stations['coordonnees_geo_lat'].to_numpy(dtype=np.float64)
+        self.lng = stations['coordonnees_geo_lon'].to_numpy(dtype=np.float64)
+        self.fingerprint = hashlib.sha1(
+            b''.join([self.station_ids.tobytes(), self.lat.tobytes(), self.lng.tobytes(), '\0'.join(self.names).encode()])
+        ).hexdigest()[:12]
+        self.tree = cKDTree(unit_vectors(self.lat, self.lng))
+        self._forecast_rows: Tuple[Optional[ForecastSnapshot], Optional[np.ndarray]] = (None, None)
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def nearest(self, lat: float, lng: float, k: int = 5,
+                radius_km: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Lignes et distances (km) des k stations les plus proches, dans `radius_km` si précisé"""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([])
+        bound = km_to_chord(radius_km) if radius_km is not None else np.inf
+        chords, rows = self.tree.query(unit_vector(lat, lng), k=k, distance_upper_bound=bound)
+        chords, rows = np.atleast_1d(chords), np.atleast_1d(rows)
+        # Voisins manquants (hors rayon) : ligne = len(self)
+        found = rows < len(self)
+        return rows[found], chord_to_km(chords[found])
+
+    def within(self, lat: float, lng: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Lignes et distances (km) de toutes les stations à moins de `radius_km`, de la plus proche à la plus lointaine"""
+        point = unit_vector(lat, lng)
+        rows = np.asarray(self.tree.query_ball_point(point, km_to_chord(radius_km)), dtype=np.int64)
+        distances = chord_to_km(np.linalg.norm(self.tree.data[rows] - point, axis=1))
+        order = np.argsort(distances, kind='stable')
+        return rows[order], distances[order]
+
+    def forecast_rows(self, snapshot: ForecastSnapshot) -> np.ndarray:
+        """Ligne de chaque station dans l'instantané de prévisions (-1 si absente), calculée une fois par instantané"""
+        cached_snapshot, rows = self._forecast_rows
+        if cached_snapshot is not snapshot:
+            rows = pd.Index(snapshot.station_ids).get_indexer(self.station_ids)
+            self._forecast_rows = (snapshot, rows)
+        return rows
+
+    def availability(self, rows: np.ndarray, snapshot: Optional[ForecastSnapshot], hours_ahead: int = 0,
+                     now: Optional[datetime] = None) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Vélos, bornes et risque prévus pour les lignes données, `hours_ahead` heures après l'heure courante
+
+        Retourne None sans instantané couvrant cette heure ; -1 pour les stations absentes de l'instantané.
+        """
+        column = snapshot.column(hours_ahead, now) if snapshot is not None else None
+        if column is None:
+            return None
+
+        forecast_rows = self.forecast_rows(snapshot)[rows]
+        present = forecast_rows >= 0
+        safe_rows = np.where(present, forecast_rows, 0)
+        return {
+            name: np.where(present, matrix[safe_rows, column], -1)
+            for name, matrix in snapshot.matrices.items()
+        }
+
+    def describe(self, rows: np.ndarray, distances: np.ndarray,
+                 availability: Optional[Dict[str, np.ndarray]] = None) -> List[Dict[str, Any]]:
+        """Stations sous forme de dictionnaires (disponibilité prévue à None si inconnue)"""
+        stations = []
+        for i, row in enumerate(rows.tolist()):
+            station = {
+                'station_id': int(self.station_ids[row]),
+                'station_name': self.names[row],
+                'lat': float(self.lat[row]),
+                'lng': float(self.lng[row]),
+                'capacity': int(self.capacities[row]),
+                'distance_km': round(float(distances[i]), 3),
+                'predicted_bikes': None,
+                'predicted_docks': None,
+                'risk_level': None
+            }
+            if availability is not None and availability['bikes'][i] >= 0:
+                station['predicted_bikes'] = int(availability['bikes'][i])
+                station['predicted_docks'] = int(availability['docks'][i])
+                station['risk_level'] = str(RISK_LEVELS[availability['risk'][i]])
+            stations.append(station)
+        return stations
+
+class StationIndexStore:
+    def __init__(self, refresh_minutes: float = STATION_INDEX_REFRESH_MINUTES):
+        self.refresh_minutes = refresh_minutes
+        self.index: Optional[StationIndex] = None
+        self.checked_at: Optional[datetime] = None
+        self._listeners: List[Callable[[StationIndex], None]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[[StationIndex], None]):
+        """Être notifié à chaque reconstruction de l'index"""
+        self._listeners.append(callback)
+
+    async def refresh(self) -> bool:
+        """Relire velib_stations et reconstruire l'index si les stations ont changé"""
+        stations = await data_loader.load_velib_stations(columns=STATION_COLUMNS)
+        self.checked_at = datetime.now()
+        if stations.empty:
+            # Erreur déjà journalisée par le DataLoader : l'index courant reste servi
+            return False
+
+        version = self.index.version + 1 if self.index is not None else 1
+        index = StationIndex(stations, version)
+        if self.index is not None and index.fingerprint == self.index.fingerprint:
+            return False
+
+        self.index = index
+        print(f"Index des stations construit: {len(index)} stations (version {index.version})")
+        for callback in self._listeners:
+            callback(index)
+        return True
+
+    def nearby(self, lat: float, lng: float, k: int = 5, radius_km: Optional[float] = None,
+               snapshot: Optional[ForecastSnapshot] = None, hours_ahead: int = 0,
+               min_bikes: int = 0, min_docks: int = 0) -> List[Dict[str, Any]]:
+        """
+        Stations les plus proches, jointes à la disponibilité prévue
+
+        Avec `min_bikes` / `min_docks`, seules les stations dont la prévision
+        atteint ces seuils sont retenues (aucune sans instantané de prévisions).
+        """
+        index = self.index
+        if index is None:
+            return []
+
+        filtered = min_bikes > 0 or min_docks > 0
+        if radius_km is not None and filtered:
+            rows, distances = index.within(lat, lng, radius_km)
+        else:
+            candidates = max(4 * k, MIN_FILTER_CANDIDATES) if filtered else k
+            rows, distances = index.nearest(lat, lng, candidates, radius_km)
+
+        availability = index.availability(rows, snapshot, hours_ahead)
+        if filtered:
+            if availability is None:
+                return []
+            keep = np.flatnonzero((availability['bikes'] >= min_bikes) & (availability['docks'] >= min_docks))[:k]
+            rows, distances = rows[keep], distances[keep]
+            availability = {name: values[keep] for name, values in availability.items()}
+        return index.describe(rows[:k], distances[:k], availability)
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Erreur rafraîchissement de l'index des stations: {e}")
+
+    def start_watching(self, interval_minutes: Optional[float] = None):
+        """Relire les stations périodiquement (toutes les `refresh_minutes` minutes)"""
+        interval_minutes = self.refresh_minutes if interval_minutes is None else interval_minutes
+        if self._watch_task is None and interval_minutes > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval_minutes * 60))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def status(self) -> Dict[str, Any]:
+        """État de l'index pour /health/station-index"""
+        index = self.index
+        return {
+            'stations': len(index) if index else 0,
+            'version': index.version if index else None,
+            'fingerprint': index.fingerprint if index else None,
+            'built_at': index.built_at.isoformat() if index else None,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None,
+            'refresh_minutes': self.refresh_minutes
+        }
+
+# Instance globale
+station_index = StationIndexStore()
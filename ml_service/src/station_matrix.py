@@ -0,0 +1,191 @@
+
+"""
+Matrice des distances station à station, partagée par memory-mapping
+
+Les distances orthodromiques entre toutes les paires de stations sont
+calculées une fois en float32 et écrites au format `.npy` dans un répertoire
+propre à l'ensemble des stations (`<empreinte>/distance_km.npy` et
+`station_ids.npy`). Chaque process (workers uvicorn, pool de processus) ouvre
+les mêmes fichiers en lecture seule : les pages sont partagées par le cache du
+système. La matrice n'est recalculée que si les stations ou leurs coordonnées
+changent ; les durées par mode s'en déduisent par les coefficients de la
+table des modes.
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from src.emission_factors import ModeTable, emission_factors
+from src.executors import executors
+from src.station_index import StationIndex
+from src.utils.preprocessing import haversine_km
+
+DEFAULT_MATRIX_DIR = Path(__file__).resolve().parents[1] / "data" / "station_matrix"
+
+# Lignes calculées par bloc (mémoire de travail float64 bornée)
+BUILD_BLOCK_ROWS = 256
+
+# Au-delà, les lignes sont retrouvées par dichotomie plutôt que par table directe
+MAX_DIRECT_STATION_ID = 1 << 24
+
+# Matrices d'autres ensembles de stations conservées tant qu'un process les a ouvertes récemment
+STATION_MATRIX_RETENTION_HOURS = float(os.getenv('STATION_MATRIX_RETENTION_HOURS', '24'))
+
+def geometry_fingerprint(index: StationIndex) -> str:
+    """Empreinte des codes et coordonnées des stations (les noms n'influent pas sur la matrice)"""
+    digest = hashlib.sha1(b''.join([index.station_ids.tobytes(), index.lat.tobytes(), index.lng.tobytes()]))
+    return digest.hexdigest()[:16]
+
+class StationMatrix:
+    """Matrice [stations, stations] ouverte en lecture seule"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.fingerprint = directory.name
+        self.station_ids = np.load(directory / "station_ids.npy")
+        self.distance_km = np.load(directory / "distance_km.npy", mmap_mode='r')
+        self._flat = self.distance_km.reshape(-1)
+
+        # Table directe identifiant -> ligne (-1 : station inconnue)
+        self._row_of = None
+        if len(self) and 0 <= self.station_ids.min() and self.station_ids.max() < MAX_DIRECT_STATION_ID:
+            self._row_of = np.full(int(self.station_ids.max()) + 1, -1, dtype=np.int64)
+            self._row_of[self.station_ids] = np.arange(len(self))
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def rows(self, station_ids: Sequence[int]) -> np.ndarray:
+        """Ligne de chaque station, KeyError si inconnue"""
+        station_ids = np.asarray(station_ids, dtype=np.int64)
+        if self._row_of is not None:
+            in_range = (station_ids >= 0) & (station_ids < len(self._row_of))
+            rows = self._row_of[np.where(in_range, station_ids, 0)]
+            unknown = ~in_range | (rows < 0)
+        else:
+            # Codes triés à la construction
+            rows = np.minimum(np.searchsorted(self.station_ids, station_ids), len(self) - 1)
+            unknown = self.station_ids[rows] != station_ids
+        if unknown.any():
+            raise KeyError(f"Stations inconnues: {np.unique(station_ids[unknown])[:10].tolist()}")
+        return rows
+
+    def distances(self, origin_ids: Sequence[int], destination_ids: Sequence[int]) -> np.ndarray:
+        """Distances (km) des paires origine[i] -> destination[i], une lecture indexée par paire"""
+        flat_rows = self.rows(origin_ids) * len(self) + self.rows(destination_ids)
+        return self._flat.take(flat_rows).astype(np.float64)
+
+    def durations(self, origin_ids: Sequence[int], destination_ids: Sequence[int],
+                  table: Optional[ModeTable] = None) -> Dict[str, np.ndarray]:
+        """Durées estimées (minutes) de chaque mode pour les paires données"""
+        table = table or emission_factors.table
+        minutes = table.coefficients[1][:, None] * self.distances(origin_ids, destination_ids)
+        return dict(zip(table.modes, minutes))
+
+def build_matrix(index: StationIndex, directory: Path) -> Path:
+    """Écrire la matrice de l'index dans `directory` (répertoire temporaire puis renommage atomique)"""
+    tmp_dir = directory.with_name(f"{directory.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    n = len(index)
+    np.save(tmp_dir / "station_ids.npy", index.station_ids.astype(np.int64))
+    matrix = np.lib.format.open_memmap(tmp_dir / "distance_km.npy", mode='w+', dtype=np.float32, shape=(n, n))
+    for start in range(0, n, BUILD_BLOCK_ROWS):
+        block = slice(start, start + BUILD_BLOCK_ROWS)
+        matrix[block] = haversine_km(index.lat[block, None], index.lng[block, None], index.lat, index.lng)
+    matrix.flush()
+    del matrix
+
+    try:
+        os.replace(tmp_dir, directory)
+    except OSError:
+        # Matrice déjà publiée par un autre process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return directory
+
+class StationMatrixStore:
+    def __init__(self, root_dir: Optional[Path] = None, retention_hours: float = STATION_MATRIX_RETENTION_HOURS):
+        self.root_dir = Path(root_dir or os.getenv('STATION_MATRIX_DIR', DEFAULT_MATRIX_DIR))
+        self.retention_hours = retention_hours
+        self.matrix: Optional[StationMatrix] = None
+        self.last_error: Optional[str] = None
+        self._build_task: Optional[asyncio.Task] = None
+
+    def ensure(self, index: StationIndex) -> StationMatrix:
+        """Ouvrir la matrice de cet ensemble de stations, en la construisant si elle n'existe pas encore"""
+        directory = self.root_dir / geometry_fingerprint(index)
+        if self.matrix is not None and self.matrix.directory == directory:
+            return self.matrix
+        if not (directory / "distance_km.npy").exists():
+            build_matrix(index, directory)
+            print(f"Matrice des distances construite: {len(index)} x {len(index)} stations")
+
+        self.matrix = StationMatrix(directory)
+        # Date d'utilisation, lue par `prune` dans les autres process
+        os.utime(directory)
+        return self.matrix
+
+    def prune(self):
+        """
+        Supprimer les matrices (et constructions interrompues) qu'aucun process n'a ouvertes
+        depuis `retention_hours` heures
+
+        Un process qui lit encore une matrice supprimée garde son mapping ;
+        la matrice servie par ce process n'est jamais supprimée.
+        """
+        current = self.matrix.directory if self.matrix is not None else None
+        expired_before = time.time() - self.retention_hours * 3600
+        for path in self.root_dir.iterdir():
+            try:
+                if path != current and path.stat().st_mtime < expired_before:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                # Déjà supprimé par un autre process
+                continue
+
+    async def refresh(self, index: Optional[StationIndex]) -> bool:
+        """Construire (dans le pool de threads) la matrice de l'index donné"""
+        if index is None:
+            return False
+        try:
+            await executors.run_thread(self.ensure, index)
+            await executors.run_thread(self.prune)
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Erreur construction de la matrice des distances: {e}")
+            return False
+
+    def on_index_built(self, index: StationIndex):
+        """Listener de l'index des stations : reconstruction en arrière-plan"""
+        self._build_task = asyncio.get_running_loop().create_task(self.refresh(index))
+
+    def distances(self, origin_ids: Sequence[int], destination_ids: Sequence[int]) -> np.ndarray:
+        """Distances des paires de stations (RuntimeError si la matrice n'est pas encore construite)"""
+        matrix = self.matrix
+        if matrix is None:
+            raise RuntimeError("Matrice des distances non disponible")
+        return matrix.distances(origin_ids, destination_ids)
+
+    def status(self) -> Dict[str, Any]:
+        """État de la matrice pour /health/station-matrix"""
+        matrix = self.matrix
+        return {
+            'stations': len(matrix) if matrix else 0,
+            'fingerprint': matrix.fingerprint if matrix else None,
+            'path': str(matrix.directory) if matrix else None,
+            'size_mb': round(matrix.distance_km.nbytes / 1e6, 1) if matrix else 0,
+            'last_error': self.last_error
+        }
+
+# Instance globale
+station_matrix = StationMatrixStore()
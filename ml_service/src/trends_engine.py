@@ -0,0 +1,198 @@
+
+"""
+Agrégation vectorisée des tendances quotidiennes Vélib'
+
+Une seule passe NumPy sur l'historique (snapshots bruts ou rollups horaires et
+journaliers, toutes stations, tous jours) produit des tableaux indexés par
+jour : taux d'occupation, activité par heure, trajets estimés et part de
+snapshots en faible disponibilité par station. Les réponses quotidiennes et
+hebdomadaires sont lues directement dans ces tableaux.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.inference import LOW_AVAILABILITY_BIKES
+from src.utils.rollups import ROLLUP_TIMEZONE, wall_clock
+
+PEAK_HOURS_PER_DAY = 4
+# Station critique : au moins cette part de snapshots en faible disponibilité dans la journée
+CRITICAL_LOW_SHARE = 0.5
+MAX_CRITICAL_STATIONS = 10
+
+# Colonnes des rollups lues par l'analyse
+HOURLY_TREND_COLUMNS = ['hour', 'bike_changes']
+DAILY_TREND_COLUMNS = ['stationcode', 'date', 'count', 'bikes_sum', 'docks_sum', 'low_count']
+WEEKDAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+def _top_hours(activity: np.ndarray, count: int = PEAK_HOURS_PER_DAY) -> List[int]:
+    """Heures les plus actives (triées), aucune si l'activité est nulle"""
+    if not activity.any():
+        return []
+    top = np.argsort(-activity, kind='stable')[:count]
+    return sorted(top[activity[top] > 0].tolist())
+
+class DailyTrendEngine:
+    def __init__(self, timezone: str = ROLLUP_TIMEZONE):
+        self.timezone = timezone
+
+    def aggregate(self, history: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Agréger des snapshots bruts par jour (et par heure, par station)
+
+        Les trajets sont estimés à partir des variations de vélos entre deux
+        snapshots consécutifs d'une même station (un départ et une arrivée par
+        trajet).
+        """
+        if history.empty:
+            return self._empty()
+
+        day_number, hour = wall_clock(history['timestamp'], self.timezone)
+        codes, station_codes = pd.factorize(history['stationcode'], sort=True)
+        bikes = history['numbikesavailable'].to_numpy(dtype=np.float64, na_value=0)
+        docks = history['numdocksavailable'].to_numpy(dtype=np.float64, na_value=0)
+
+        # Variations de vélos entre snapshots consécutifs d'une même station
+        # (tri stable par station : l'ordre chronologique est conservé)
+        timestamps = pd.to_datetime(history['timestamp'], utc=True)
+        if timestamps.is_monotonic_increasing:
+            order = np.argsort(codes, kind='stable')
+        else:
+            order = np.lexsort((timestamps.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]'), codes))
+        sorted_codes = codes[order]
+        changes = np.zeros(len(order))
+        changes[1:] = np.abs(np.diff(bikes[order]))
+        changes[1:][sorted_codes[1:] != sorted_codes[:-1]] = 0
+
+        return self._assemble(
+            day_number, codes, station_codes, bikes, bikes + docks,
+            (bikes <= LOW_AVAILABILITY_BIKES).astype(np.float64), None,
+            day_number[order], hour[order], changes
+        )
+
+    def aggregate_rollups(self, hourly: pd.DataFrame, daily: pd.DataFrame) -> Dict[str, Any]:
+        """Mêmes agrégats, lus dans les rollups horaires et journaliers (une ligne par station et par jour / heure)"""
+        if daily.empty:
+            return self._empty()
+
+        day_number = daily['date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+        codes, station_codes = pd.factorize(daily['stationcode'], sort=True)
+        bikes = daily['bikes_sum'].to_numpy(dtype=np.float64)
+        slots = bikes + daily['docks_sum'].to_numpy(dtype=np.float64)
+        hour_day_number, hour = wall_clock(hourly['hour'], self.timezone)
+
+        return self._assemble(
+            day_number, codes, station_codes, bikes, slots,
+            daily['low_count'].to_numpy(dtype=np.float64), daily['count'].to_numpy(dtype=np.float64),
+            hour_day_number, hour, hourly['bike_changes'].to_numpy(dtype=np.float64)
+        )
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {
+            'days': np.array([], dtype='datetime64[D]'),
+            'occupation_rate': np.zeros(0), 'hourly_activity': np.zeros((0, 24)),
+            'trips': np.zeros(0, dtype=np.int64), 'low_share': np.zeros((0, 0)),
+            'station_ids': np.zeros(0, dtype=np.int64)
+        }
+
+    def _assemble(self, day_number: np.ndarray, codes: np.ndarray, station_codes: pd.Index,
+                  bikes: np.ndarray, slots: np.ndarray, low: np.ndarray, counts: Optional[np.ndarray],
+                  hour_day_number: np.ndarray, hour: np.ndarray, changes: np.ndarray) -> Dict[str, Any]:
+        """
+        Tableaux par jour à partir de lignes (jour, station) et (jour, heure)
+
+        Les lignes sont des snapshots (`counts` à None) ou des rollups (`counts`
+        snapshots par ligne). Retourne des tableaux de longueur D (jours
+        présents) ou de forme [D, 24] / [D, stations].
+        """
+        first_day = min(day_number.min(), hour_day_number.min()) if len(hour_day_number) else day_number.min()
+        day_index = (day_number - first_day).astype(np.int64)
+        hour_day_index = (hour_day_number - first_day).astype(np.int64)
+        n_days = int(max(day_index.max(), hour_day_index.max(initial=0))) + 1
+        n_stations = len(station_codes)
+
+        # Occupation du jour : vélos / (vélos + bornes libres), sur tous les snapshots
+        day_bikes = np.bincount(day_index, weights=bikes, minlength=n_days)
+        day_slots = np.bincount(day_index, weights=slots, minlength=n_days)
+        occupation_rate = np.divide(day_bikes, day_slots, out=np.zeros(n_days), where=day_slots > 0)
+
+        hourly_activity = np.bincount(hour_day_index * 24 + hour, weights=changes,
+                                      minlength=n_days * 24).reshape(n_days, 24)
+        trips = np.rint(hourly_activity.sum(axis=1) / 2).astype(np.int64)
+
+        # Part des snapshots à faible disponibilité par (jour, station)
+        day_station = day_index * n_stations + codes
+        snapshots = np.bincount(day_station, weights=counts, minlength=n_days * n_stations)
+        low_counts = np.bincount(day_station, weights=low, minlength=n_days * n_stations)
+        low_share = np.divide(low_counts, snapshots, out=np.zeros(n_days * n_stations),
+                              where=snapshots > 0).reshape(n_days, n_stations)
+
+        station_ids = pd.to_numeric(pd.Series(station_codes), errors='coerce').fillna(-1).astype(np.int64).to_numpy()
+        days = (np.arange(n_days) + first_day).astype('datetime64[D]')
+        present = day_slots > 0
+
+        return {
+            'days': days[present],
+            'occupation_rate': occupation_rate[present],
+            'hourly_activity': hourly_activity[present],
+            'trips': trips[present],
+            'low_share': low_share[present],
+            'station_ids': station_ids
+        }
+
+    def critical_stations(self, aggregates: Dict[str, Any]) -> List[List[int]]:
+        """Stations les plus souvent en faible disponibilité, par jour (les pires d'abord)"""
+        low_share = aggregates['low_share']
+        if low_share.size == 0:
+            return [[] for _ in range(len(aggregates['days']))]
+        top = np.argsort(-low_share, axis=1, kind='stable')[:, :MAX_CRITICAL_STATIONS]
+        top_share = np.take_along_axis(low_share, top, axis=1)
+        station_ids = aggregates['station_ids'][top]
+        keep = (top_share >= CRITICAL_LOW_SHARE) & (station_ids >= 0)
+        return [ids[mask].tolist() for ids, mask in zip(station_ids, keep)]
+
+    def daily_records(self, aggregates: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Une entrée `DailyTrend` par jour"""
+        critical = self.critical_stations(aggregates)
+        return [
+            {
+                "date": str(day),
+                "occupation_rate": round(rate, 3),
+                "peak_hours": _top_hours(activity),
+                "critical_stations": stations,
+                "total_trips": trips
+            }
+            for day, rate, activity, stations, trips in zip(
+                aggregates['days'], aggregates['occupation_rate'].tolist(), aggregates['hourly_activity'],
+                critical, aggregates['trips'].tolist()
+            )
+        ]
+
+    def weekly_patterns(self, aggregates: Dict[str, Any]) -> Dict[str, Any]:
+        """Moyennes par jour de la semaine et heures de pointe semaine / week-end"""
+        # 1970-01-01 était un jeudi (lundi = 0)
+        weekday = (aggregates['days'].astype(np.int64) + 3) % 7
+        rate = aggregates['occupation_rate']
+        counts = np.bincount(weekday, minlength=7)
+        means = np.divide(np.bincount(weekday, weights=rate, minlength=7), counts,
+                          out=np.full(7, np.nan), where=counts > 0)
+
+        observed = np.flatnonzero(counts)
+        weekdays = observed[observed < 5]
+        weekend = observed[observed >= 5]
+        activity = aggregates['hourly_activity']
+
+        return {
+            "weekday_average_occupation": {WEEKDAY_NAMES[d]: round(float(means[d]), 3) for d in weekdays},
+            "weekend_average_occupation": {WEEKDAY_NAMES[d]: round(float(means[d]), 3) for d in weekend},
+            "busiest_weekday": WEEKDAY_NAMES[weekdays[np.argmax(means[weekdays])]] if weekdays.size else "Monday",
+            "quietest_day": WEEKDAY_NAMES[observed[np.argmin(means[observed])]] if observed.size else "Sunday",
+            "peak_hours_weekday": _top_hours(activity[weekday < 5].sum(axis=0)),
+            "peak_hours_weekend": _top_hours(activity[weekday >= 5].sum(axis=0))
+        }
+
+# Instance globale
+trend_engine = DailyTrendEngine()
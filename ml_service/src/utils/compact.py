@@ -0,0 +1,95 @@
+
+"""
+Représentation mémoire compacte des DataFrames d'historique
+
+Les pages JSON PostgREST et les tables Arrow du store local sont décodées
+colonne par colonne selon un schéma de dtypes : codes station catégoriels,
+compteurs en petits entiers, booléens sur un octet (nuls à False), timestamps
+`datetime64`. L'identifiant UUID des lignes n'est conservé que sur demande.
+"""
+
+from typing import Any, Dict, Iterable, List, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas.api.types import union_categoricals
+
+# Schéma compact de velib_availability_history (compteurs nuls décodés à 0)
+HISTORY_DTYPES: Dict[str, str] = {
+    'stationcode': 'category',
+    'timestamp': 'datetime64[ns, UTC]',
+    'numbikesavailable': 'int16',
+    'numdocksavailable': 'int16',
+    'mechanical': 'int16',
+    'ebike': 'int16',
+    'is_renting': 'bool',
+    'is_returning': 'bool',
+    'is_installed': 'bool',
+}
+
+_ARROW_INTS = {'int8': pa.int8(), 'int16': pa.int16(), 'int32': pa.int32()}
+
+def _convert(values: Any, dtype: str) -> Any:
+    """Convertir une colonne (liste ou Series) vers `dtype`"""
+    if dtype == 'category':
+        if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+            return values.cat.reorder_categories(sorted(values.cat.categories))
+        # Catégories triées : même ordre de tri que les chaînes d'origine
+        return pd.Categorical(values)
+    if dtype.startswith('datetime64'):
+        return pd.to_datetime(values, utc=True)
+    if dtype == 'bool':
+        return pd.array(values, dtype='boolean').fillna(False).to_numpy(dtype=bool)
+    return pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy().astype(dtype)
+
+def decode_rows(rows: List[Dict[str, Any]], dtypes: Dict[str, str],
+                keep_columns: Sequence[str] = ()) -> pd.DataFrame:
+    """Construire un DataFrame compact à partir d'une page JSON (colonnes hors schéma ignorées)"""
+    present = rows[0].keys() if rows else ()
+    columns = {
+        name: _convert([row.get(name) for row in rows], dtype)
+        for name, dtype in dtypes.items() if name in present
+    }
+    for name in keep_columns:
+        if name in present:
+            columns[name] = [row.get(name) for row in rows]
+    return pd.DataFrame(columns)
+
+def compact_table(table: pa.Table, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Convertir une table Arrow vers le schéma compact (encodage fait côté Arrow)"""
+    arrays = {}
+    for name in table.column_names:
+        column, dtype = table[name], dtypes.get(name)
+        if dtype == 'category':
+            column = column.dictionary_encode()
+        elif dtype in _ARROW_INTS:
+            column = pc.fill_null(column, 0).cast(_ARROW_INTS[dtype])
+        elif dtype == 'bool':
+            column = pc.fill_null(column, False)
+        arrays[name] = column
+    df = pa.table(arrays).to_pandas()
+    for name in df.columns:
+        if dtypes.get(name) == 'category':
+            df[name] = _convert(df[name], 'category')
+    return df
+
+def concat_compact(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Concaténer des pages compactes en gardant les colonnes catégorielles"""
+    frames = list(frames)
+    df = pd.concat(frames, ignore_index=True)
+    for name in frames[0].columns:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype) and not isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = union_categoricals([frame[name] for frame in frames], sort_categories=True)
+    return df
+
+def memory_report(df: pd.DataFrame) -> Dict[str, Any]:
+    """Empreinte mémoire (Mo par million de lignes), au total et par colonne"""
+    usage = df.memory_usage(deep=True, index=False)
+    scale = 1e6 / max(len(df), 1) / 1e6
+    return {
+        'rows': len(df),
+        'mb': round(float(usage.sum()) / 1e6, 1),
+        'mb_per_million_rows': round(float(usage.sum()) * scale, 1),
+        'columns': {name: round(float(size) * scale, 2) for name, size in usage.items()}
+    }
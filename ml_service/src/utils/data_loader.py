@@ -4,16 +4,62 @@ Module de chargement des données depuis Supabase
 """
 
 import os
+import time
 import pandas as pd
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, AsyncIterator, Sequence, Tuple
 import httpx
 from dotenv import load_dotenv
 
+from src.utils.history_store import HistoryStore
+from src.utils.compact import HISTORY_DTYPES, decode_rows, concat_compact
+from src.utils.rollups import ROLLUP_METRICS, ROLLUP_TIMEZONE, wall_clock
+from src.executors import executors
+from src.utils.metrics import SUPABASE_FETCH_SECONDS, SUPABASE_FETCH_ROWS, SUPABASE_FETCH_ERRORS
+
 # Charger les variables d'environnement
 load_dotenv()
 
+# Taille des pages pour la pagination par clé (keyset) PostgREST
+DEFAULT_PAGE_SIZE = int(os.getenv('SUPABASE_PAGE_SIZE', '10000'))
+
+# Configuration du pool de connexions HTTP vers Supabase
+HTTP_MAX_CONNECTIONS = int(os.getenv('SUPABASE_HTTP_MAX_CONNECTIONS', '20'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('SUPABASE_HTTP_MAX_KEEPALIVE', '10'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_HTTP_KEEPALIVE_EXPIRY', '30'))
+HTTP_TIMEOUT = float(os.getenv('SUPABASE_HTTP_TIMEOUT', '30'))
+HTTP2_ENABLED = os.getenv('SUPABASE_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+# Fonction Postgres d'agrégation de l'historique (supabase/migrations) et
+# nombre de jours agrégés par appel
+ROLLUP_RPC = 'velib_availability_rollup'
+ROLLUP_RPC_WINDOW_DAYS = {'day': 7, 'hour': 1}
+
+def _quote_filter_value(value: Any) -> str:
+    """Entourer une valeur de guillemets pour un filtre PostgREST `or=(...)`"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _typed_frame(rows: List[Dict[str, Any]], datetime_columns: List[str]) -> pd.DataFrame:
+    """Construire un DataFrame typé à partir d'une page JSON"""
+    df = pd.DataFrame(rows)
+    for column in datetime_columns:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+def _rollup_frame(rows: List[Dict[str, Any]], bucket: str) -> pd.DataFrame:
+    """Page de la fonction d'agrégation vers le schéma des rollups locaux"""
+    df = pd.DataFrame(rows)
+    buckets = pd.to_datetime(df.pop('bucket'), utc=True)
+    frame = {'stationcode': pd.Categorical(df['stationcode'])}
+    if bucket == 'hour':
+        frame['hour'] = buckets
+    else:
+        frame['date'] = wall_clock(buckets)[0].astype('datetime64[D]')
+    for name in ROLLUP_METRICS:
+        frame[name] = df[name].astype('float64' if name == 'occupancy_sum' else 'int64')
+    return pd.DataFrame(frame)
+
 class DataLoader:
     def __init__(self):
         self.supabase_url = os.getenv('SUPABASE_URL')
@@ -27,91 +73,341 @@ class DataLoader:
             'Authorization': f'Bearer {self.supabase_key}',
             'Content-Type': 'application/json'
         }
+        
+        self.limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._requests_sent = 0
+    
+    async def open(self) -> httpx.AsyncClient:
+        """Créer le client HTTP partagé (pool de connexions keep-alive)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.supabase_url}/rest/v1",
+                headers=self.headers,
+                limits=self.limits,
+                timeout=HTTP_TIMEOUT,
+                http2=HTTP2_ENABLED
+            )
+        return self._client
+    
+    async def close(self):
+        """Fermer le client HTTP partagé et ses connexions"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
     
-    async def load_velib_stations(self) -> pd.DataFrame:
-        """Charger les stations Vélib' depuis Supabase"""
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """GET PostgREST via le client partagé"""
+        client = await self.open()
+        self._requests_sent += 1
+        response = await client.get(f"/{path}", params=params)
+        response.raise_for_status()
+        return response
+    
+    async def _post(self, path: str, payload: Dict[str, Any], params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """POST PostgREST (appel de fonction `rpc/...`) via le client partagé"""
+        client = await self.open()
+        self._requests_sent += 1
+        response = await client.post(f"/{path}", json=payload, params=params)
+        response.raise_for_status()
+        return response
+    
+    async def _fetch_rows(self, table: str, params: Optional[Dict[str, Any]] = None,
+                          payload: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Lignes JSON d'une requête PostgREST, avec durée et volume exportés en métriques
+
+        Avec `payload`, `table` est un chemin `rpc/<fonction>` appelé en POST.
+        """
+        start = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/velib_stations",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                data = response.json()
-                return pd.DataFrame(data)
+            if payload is not None:
+                rows = (await self._post(table, payload, params=params)).json()
+            else:
+                rows = (await self._get(table, params=params)).json()
+        except Exception:
+            SUPABASE_FETCH_ERRORS.labels(table).inc()
+            raise
+        SUPABASE_FETCH_SECONDS.labels(table).observe(time.perf_counter() - start)
+        SUPABASE_FETCH_ROWS.labels(table).observe(len(rows))
+        return rows
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Statistiques d'utilisation du pool de connexions"""
+        stats = {
+            'open': self._client is not None and not self._client.is_closed,
+            'http2': HTTP2_ENABLED,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'keepalive_expiry': self.limits.keepalive_expiry,
+            'requests_sent': self._requests_sent,
+            'connections': 0,
+            'active_connections': 0,
+            'idle_connections': 0,
+            'queued_requests': 0
+        }
+        
+        # Le pool httpcore n'a pas d'API publique de métriques : lecture défensive
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        if stats['open'] and pool is not None:
+            connections = list(getattr(pool, 'connections', []))
+            idle = sum(1 for conn in connections if conn.is_idle())
+            stats['connections'] = len(connections)
+            stats['idle_connections'] = idle
+            stats['active_connections'] = len(connections) - idle
+            stats['queued_requests'] = sum(
+                1 for request in getattr(pool, '_requests', [])
+                if getattr(request, 'connection', None) is None
+            )
+        
+        return stats
+    
+    async def load_velib_stations(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Charger les stations Vélib' depuis Supabase (colonnes `columns` seulement si précisées)"""
+        try:
+            params = {'select': ','.join(columns)} if columns else None
+            return pd.DataFrame(await self._fetch_rows("velib_stations", params=params))
         except Exception as e:
             print(f"Erreur lors du chargement des stations: {e}")
             return pd.DataFrame()
     
-    async def load_velib_availability_history(self, days_back: int = 30) -> pd.DataFrame:
-        """Charger l'historique de disponibilité Vélib'"""
-        try:
-            cutoff_date = (datetime.now() - timedelta(days=days_back)).isoformat()
+    async def iter_table_pages(self, table: str, sort_column: str,
+                               filters: Optional[Dict[str, str]] = None,
+                               descending: bool = False,
+                               page_size: int = DEFAULT_PAGE_SIZE,
+                               max_rows: Optional[int] = None,
+                               datetime_columns: Optional[List[str]] = None,
+                               start_after: Optional[Tuple[Any, Any]] = None,
+                               dtypes: Optional[Dict[str, str]] = None,
+                               keep_columns: Sequence[str] = (),
+                               columns: Optional[Sequence[str]] = None) -> AsyncIterator[pd.DataFrame]:
+        """
+        Parcourir une table PostgREST page par page (pagination par clé sur
+        `sort_column`/`id`) et produire des DataFrames typés.
+
+        Chaque page reprend après le dernier couple (sort_column, id) reçu :
+        aucune page n'est relue, l'ordre reste stable même si des lignes sont
+        insérées pendant le parcours, et la mémoire reste bornée à une page.
+        La fin est détectée sur une page vide, ce qui reste correct si le
+        serveur plafonne `limit` en dessous de `page_size`. `start_after`
+        permet de reprendre un parcours à partir d'un curseur connu.
+
+        Avec `dtypes`, les pages sont décodées selon ce schéma compact (seules
+        ces colonnes et `keep_columns` sont conservées). `columns` limite les
+        colonnes transférées (`select=`) ; la clé de pagination est toujours
+        demandée.
+        """
+        direction = 'desc' if descending else 'asc'
+        comparator = 'lt' if descending else 'gt'
+        datetime_columns = datetime_columns or []
+        cursor = start_after
+        fetched = 0
+        
+        while max_rows is None or fetched < max_rows:
+            limit = page_size if max_rows is None else min(page_size, max_rows - fetched)
+            params = dict(filters or {})
+            params['order'] = f'{sort_column}.{direction},id.{direction}'
+            params['limit'] = limit
+            if columns:
+                params['select'] = ','.join(dict.fromkeys([*columns, sort_column, 'id']))
+            if cursor is not None:
+                last_sort, last_id = cursor
+                params['or'] = (
+                    f'({sort_column}.{comparator}.{_quote_filter_value(last_sort)},'
+                    f'and({sort_column}.eq.{_quote_filter_value(last_sort)},'
+                    f'id.{comparator}.{_quote_filter_value(last_id)}))'
+                )
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/velib_availability_history",
-                    params={
-                        'timestamp': f'gte.{cutoff_date}',
-                        'order': 'timestamp.asc'
-                    },
-                    headers=self.headers
+            rows = await self._fetch_rows(table, params=params)
+            
+            if not rows:
+                break
+            
+            # Le curseur reprend la valeur brute renvoyée par PostgREST
+            cursor = (rows[-1][sort_column], rows[-1]['id'])
+            fetched += len(rows)
+            
+            if dtypes is not None:
+                yield decode_rows(rows, dtypes, keep_columns)
+            else:
+                yield _typed_frame(rows, datetime_columns)
+    
+    async def iter_velib_availability_history(self, days_back: int = 30,
+                                              page_size: int = DEFAULT_PAGE_SIZE,
+                                              until: Optional[str] = None,
+                                              start_after: Optional[Tuple[Any, Any]] = None,
+                                              include_id: bool = False,
+                                              columns: Optional[Sequence[str]] = None,
+                                              station_codes: Optional[Sequence[str]] = None) -> AsyncIterator[pd.DataFrame]:
+        """
+        Parcourir l'historique de disponibilité Vélib' par pages
+
+        `until` borne la fenêtre (exclus) et `start_after` reprend après un
+        curseur (timestamp, id), par exemple le watermark du store local. Les
+        pages sont compactes (`HISTORY_DTYPES`) ; l'UUID `id` n'est gardé
+        qu'avec `include_id`. `columns` et `station_codes` sont appliqués côté
+        serveur (projection et filtre).
+        """
+        cutoff_date = (pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days_back)).isoformat()
+        conditions = [f'timestamp.gte.{_quote_filter_value(cutoff_date)}']
+        if until is not None:
+            conditions.append(f'timestamp.lt.{_quote_filter_value(until)}')
+        if station_codes is not None:
+            conditions.append(f"stationcode.in.({','.join(_quote_filter_value(code) for code in station_codes)})")
+        filters = {'and': f"({','.join(conditions)})"}
+        
+        async for chunk in self.iter_table_pages(
+            'velib_availability_history',
+            sort_column='timestamp',
+            filters=filters,
+            page_size=page_size,
+            start_after=start_after,
+            dtypes=HISTORY_DTYPES,
+            keep_columns=('id',) if include_id else (),
+            columns=columns
+        ):
+            yield chunk
+    
+    async def load_velib_availability_history(self, days_back: int = 30, include_id: bool = False,
+                                              columns: Optional[Sequence[str]] = None,
+                                              station_codes: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Charger l'historique de disponibilité Vélib' (DataFrame compact)"""
+        try:
+            chunks = [
+                chunk async for chunk in self.iter_velib_availability_history(
+                    days_back, include_id=include_id, columns=columns, station_codes=station_codes
                 )
-                response.raise_for_status()
-                data = response.json()
-                
-                df = pd.DataFrame(data)
-                if not df.empty:
-                    df['timestamp'] = pd.to_datetime(df['timestamp'])
-                
-                return df
+            ]
+            if not chunks:
+                return pd.DataFrame()
+            return concat_compact(chunks)
         except Exception as e:
             print(f"Erreur lors du chargement de l'historique: {e}")
             return pd.DataFrame()
     
-    async def load_transport_modes(self) -> pd.DataFrame:
-        """Charger les modes de transport"""
+    async def iter_velib_availability_rollups(self, days_back: int = 30, bucket: str = 'day',
+                                              station_codes: Optional[Sequence[str]] = None,
+                                              page_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[pd.DataFrame]:
+        """
+        Agrégats par station et par heure (`bucket='hour'`) ou par jour local,
+        calculés par la fonction Postgres `ROLLUP_RPC`
+
+        Seules les lignes agrégées sont transférées (même schéma que les
+        rollups locaux : `hour` ou `date`, puis les métriques de
+        `ROLLUP_METRICS`). La période est découpée en fenêtres de quelques
+        jours alignées sur minuit local (un jour n'est jamais coupé en deux),
+        chacune paginée par `limit`/`offset` jusqu'à une page vide. La
+        variation de vélos entre deux fenêtres n'est pas comptée.
+        """
+        end = pd.Timestamp.now(tz='UTC')
+        window = pd.DateOffset(days=ROLLUP_RPC_WINDOW_DAYS[bucket])
+        window_start = end - pd.Timedelta(days=days_back)
+        
+        while window_start < end:
+            local_midnight = window_start.tz_convert(ROLLUP_TIMEZONE).normalize()
+            window_end = min((local_midnight + window).tz_convert('UTC'), end)
+            payload = {
+                'p_start': window_start.isoformat(),
+                'p_end': window_end.isoformat(),
+                'p_bucket': bucket,
+                'p_stationcodes': list(station_codes) if station_codes is not None else None,
+                'p_timezone': ROLLUP_TIMEZONE
+            }
+            offset = 0
+            while True:
+                rows = await self._fetch_rows(f"rpc/{ROLLUP_RPC}", params={'limit': page_size, 'offset': offset},
+                                              payload=payload)
+                if not rows:
+                    break
+                offset += len(rows)
+                yield _rollup_frame(rows, bucket)
+            window_start = window_end
+    
+    async def load_velib_availability_rollups(self, days_back: int = 30, bucket: str = 'day',
+                                              station_codes: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Charger les agrégats calculés côté serveur (DataFrame vide si la fonction est indisponible)"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/transport_modes",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                data = response.json()
-                return pd.DataFrame(data)
+            chunks = [chunk async for chunk in self.iter_velib_availability_rollups(days_back, bucket, station_codes)]
+            if not chunks:
+                return pd.DataFrame()
+            return concat_compact(chunks)
+        except Exception as e:
+            print(f"Erreur lors du chargement des agrégats: {e}")
+            return pd.DataFrame()
+    
+    async def load_transport_modes(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Charger les modes de transport (colonnes `columns` seulement si précisées)"""
+        try:
+            params = {'select': ','.join(columns)} if columns else None
+            return pd.DataFrame(await self._fetch_rows("transport_modes", params=params))
         except Exception as e:
             print(f"Erreur lors du chargement des modes de transport: {e}")
             return pd.DataFrame()
     
+    async def iter_user_trips(self, limit: Optional[int] = None,
+                              page_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[pd.DataFrame]:
+        """Parcourir les trajets utilisateurs par pages, du plus récent au plus ancien"""
+        async for chunk in self.iter_table_pages(
+            'user_trips',
+            sort_column='created_at',
+            descending=True,
+            page_size=page_size,
+            max_rows=limit,
+            datetime_columns=['created_at', 'trip_date']
+        ):
+            yield chunk
+    
     async def load_user_trips(self, limit: int = 1000) -> pd.DataFrame:
         """Charger les trajets utilisateurs"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/user_trips",
-                    params={
-                        'limit': limit,
-                        'order': 'created_at.desc'
-                    },
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                df = pd.DataFrame(data)
-                if not df.empty:
-                    df['created_at'] = pd.to_datetime(df['created_at'])
-                    df['trip_date'] = pd.to_datetime(df['trip_date'])
-                
-                return df
+            chunks = [chunk async for chunk in self.iter_user_trips(limit)]
+            if not chunks:
+                return pd.DataFrame()
+            return pd.concat(chunks, ignore_index=True)
         except Exception as e:
             print(f"Erreur lors du chargement des trajets: {e}")
             return pd.DataFrame()
 
-# Instance globale
+# Instances globales
 data_loader = DataLoader()
+history_store = HistoryStore(data_loader)
+
+async def sync_historical_velib_data(days_back: int = 60):
+    """Ajouter au store local les lignes arrivées dans Supabase depuis le dernier watermark"""
+    try:
+        await history_store.sync(days_back)
+    except Exception as e:
+        print(f"Erreur lors de la synchronisation de l'historique: {e}")
+
+async def load_historical_velib_data(days_back: int = 60, sync: bool = True) -> pd.DataFrame:
+    """
+    Fonction utilitaire pour charger les données historiques Vélib'
+
+    Les données sont lues depuis le store local (lecture Arrow et conversion
+    pandas dans le pool de threads) ; `sync` y ajoute d'abord les lignes
+    arrivées dans Supabase depuis le dernier watermark.
+    """
+    if sync:
+        await sync_historical_velib_data(days_back)
+    return await executors.run_thread(history_store.load, days_back)
+
+async def load_velib_data(station_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Fonction utilitaire pour charger les stations Vélib' à prédire"""
+    stations = await data_loader.load_velib_stations(columns=['stationcode', 'name', 'capacity'])
+    if stations.empty:
+        return []
+    
+    stations = stations[stations['stationcode'].str.isdigit()]
+    stations = stations.assign(station_id=stations['stationcode'].astype(int))
+    if station_ids is not None:
+        stations = stations[stations['station_id'].isin(station_ids)]
+    
+    return stations[['station_id', 'name', 'capacity']].to_dict('records')
 
-async def load_historical_velib_data(days_back: int = 60) -> pd.DataFrame:
-    """Fonction utilitaire pour charger les données historiques Vélib'"""
-    return await data_loader.load_velib_availability_history(days_back)
+async def load_carbon_calculation_data() -> Dict[str, pd.DataFrame]:
+    """Fonction utilitaire pour charger les données de calcul carbone"""
+    return {'transport_modes': await data_loader.load_transport_modes()}
@@ -0,0 +1,267 @@
+
+"""
+Store local colonnaire de l'historique de disponibilité Vélib'
+
+Les snapshots sont stockés au format Arrow IPC, partitionnés par jour
+(`date=YYYY-MM-DD/part-*.arrow`), et relus par memory-mapping. Un manifeste
+JSON référence les fichiers valides et le watermark (timestamp, id) de la
+dernière ligne synchronisée : chaque synchronisation ne télécharge que les
+lignes plus récentes que ce watermark. Les nouvelles lignes sont aussi
+repliées dans les rollups horaires et journaliers (`rollups/`).
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+from datetime import date
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from src.executors import executors
+from src.utils.rollups import RollupStore
+from src.utils.compact import HISTORY_DTYPES, compact_table
+
+DEFAULT_STORE_DIR = Path(__file__).resolve().parents[2] / "data" / "history"
+MANIFEST_NAME = "_manifest.json"
+ROLLUPS_DIR = "rollups"
+
+# Intervalle minimal (secondes) entre deux synchronisations déclenchées par les requêtes
+SYNC_MIN_INTERVAL = float(os.getenv('HISTORY_SYNC_MIN_INTERVAL', '30'))
+
+# Colonnes téléchargées à la synchronisation (`id` sert de watermark) : les
+# drapeaux is_renting / is_returning / is_installed, inutilisés par les
+# modèles, ne sont pas transférés et restent nuls dans le store
+SYNC_COLUMNS = ['id', 'stationcode', 'timestamp', 'numbikesavailable', 'numdocksavailable', 'mechanical', 'ebike']
+
+# Schéma fixe de velib_availability_history : tous les fragments sont
+# compatibles et peuvent être concaténés sans conversion
+HISTORY_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('stationcode', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('numbikesavailable', pa.int32()),
+    ('numdocksavailable', pa.int32()),
+    ('mechanical', pa.int32()),
+    ('ebike', pa.int32()),
+    ('is_renting', pa.bool_()),
+    ('is_returning', pa.bool_()),
+    ('is_installed', pa.bool_()),
+])
+
+def utc_cutoff(days_back: float) -> pd.Timestamp:
+    """Début (UTC) d'une fenêtre des `days_back` derniers jours"""
+    return pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days_back)
+
+def parse_utc(value: str) -> pd.Timestamp:
+    """Instant ISO du manifeste en UTC (les instants naïfs des anciens manifestes sont lus comme UTC)"""
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+class HistoryStore:
+    def __init__(self, loader, root_dir: Optional[Path] = None, min_interval: float = SYNC_MIN_INTERVAL):
+        self.loader = loader
+        self.root_dir = Path(root_dir or os.getenv('HISTORY_STORE_DIR', DEFAULT_STORE_DIR))
+        self.manifest_path = self.root_dir / MANIFEST_NAME
+        self.rollups = RollupStore(self.root_dir / ROLLUPS_DIR)
+        self.min_interval = min_interval
+        self._listeners: List[Callable[[int], None]] = []
+        # Créé dans la boucle asyncio du premier sync
+        self._sync_lock: Optional[asyncio.Lock] = None
+        # (instant monotone, début de couverture) du dernier sync terminé
+        self._last_sync: Optional[Tuple[float, Optional[str]]] = None
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """Être notifié du nombre de lignes ajoutées à chaque synchronisation"""
+        self._listeners.append(callback)
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """Lire le manifeste (fichiers valides, watermark, début de couverture)"""
+        if not self.manifest_path.exists():
+            return {'watermark': None, 'coverage_start': None, 'partitions': {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        """Écrire le manifeste de façon atomique"""
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _to_table(self, chunk: pd.DataFrame) -> pa.Table:
+        """Convertir une page PostgREST vers le schéma du store"""
+        columns = {}
+        for field in HISTORY_SCHEMA:
+            if field.name in chunk.columns:
+                values = chunk[field.name]
+                if field.name == 'timestamp':
+                    values = pd.to_datetime(values, utc=True)
+                columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+            else:
+                columns[field.name] = pa.nulls(len(chunk), type=field.type)
+        return pa.table(columns, schema=HISTORY_SCHEMA)
+
+    def _write_partitions(self, chunk: pd.DataFrame, manifest: Dict[str, Any]):
+        """Écrire une page dans les partitions journalières"""
+        table = self._to_table(chunk)
+        days = pd.to_datetime(chunk['timestamp'], utc=True).dt.date
+
+        for day, index in chunk.groupby(days.values).indices.items():
+            partition = f"date={day.isoformat()}"
+            part_name = f"part-{uuid.uuid4().hex}.arrow"
+            part_dir = self.root_dir / partition
+            part_dir.mkdir(parents=True, exist_ok=True)
+
+            with ipc.new_file(part_dir / part_name, HISTORY_SCHEMA) as writer:
+                writer.write_table(table.take(pa.array(index)))
+
+            manifest['partitions'].setdefault(partition, []).append(part_name)
+
+    def _recently_synced(self, days_back: int) -> bool:
+        """Dernier sync de moins de `min_interval` secondes, couvrant déjà la fenêtre demandée"""
+        if self._last_sync is None:
+            return False
+        synced_at, coverage_start = self._last_sync
+        return (time.monotonic() - synced_at < self.min_interval
+                and coverage_start is not None and utc_cutoff(days_back) >= parse_utc(coverage_start))
+
+    async def sync(self, days_back: int = 90, force: bool = False) -> int:
+        """
+        Synchroniser le store avec Supabase et retourner le nombre de lignes ajoutées
+
+        Seules les lignes postérieures au watermark sont téléchargées. Si la
+        fenêtre demandée commence avant la couverture actuelle, la période
+        manquante est complétée une seule fois.
+
+        Les synchronisations sont exécutées l'une après l'autre : un appel
+        concurrent attend la fin de celle en cours. Sauf `force`, aucun appel à
+        Supabase n'est fait (0 ligne) si la fenêtre a été synchronisée il y a
+        moins de `min_interval` secondes.
+        """
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+        async with self._sync_lock:
+            if not force and self._recently_synced(days_back):
+                return 0
+            added, coverage_start = await self._sync(days_back)
+            self._last_sync = (time.monotonic(), coverage_start)
+
+        for callback in self._listeners:
+            callback(added)
+        return added
+
+    async def _sync(self, days_back: int) -> Tuple[int, Optional[str]]:
+        """Synchronisation proprement dite (verrou tenu) : lignes ajoutées et début de couverture"""
+        manifest = self.read_manifest()
+        cutoff = utc_cutoff(days_back)
+        added = 0
+
+        # Rollups absents ou en retard sur l'historique local (commit interrompu)
+        if not self.rollups.is_current(manifest['watermark']):
+            await executors.run_thread(self.rollups.rebuild, self.iter_partitions(self._covered_days(manifest)),
+                                       manifest['watermark'])
+        rollup_batch = self.rollups.begin()
+
+        # Complément vers le passé (premier sync ou fenêtre élargie)
+        coverage_start = manifest['coverage_start']
+        if coverage_start is not None and cutoff < parse_utc(coverage_start):
+            async for chunk in self.loader.iter_velib_availability_history(days_back, until=coverage_start,
+                                                                          include_id=True, columns=SYNC_COLUMNS):
+                self._write_partitions(chunk, manifest)
+                self.rollups.fold(rollup_batch, chunk)
+                added += len(chunk)
+
+        # Lignes nouvelles depuis le watermark
+        watermark = manifest['watermark']
+        start_after = (watermark['timestamp'], watermark['id']) if watermark else None
+        async for chunk in self.loader.iter_velib_availability_history(days_back, start_after=start_after,
+                                                                          include_id=True, columns=SYNC_COLUMNS):
+            self._write_partitions(chunk, manifest)
+            self.rollups.fold(rollup_batch, chunk)
+            added += len(chunk)
+            last = chunk.iloc[-1]
+            manifest['watermark'] = {
+                'timestamp': last['timestamp'].isoformat(),
+                'id': last['id']
+            }
+
+        if coverage_start is None or cutoff < parse_utc(coverage_start):
+            manifest['coverage_start'] = cutoff.isoformat()
+        manifest['synced_at'] = pd.Timestamp.now(tz='UTC').isoformat()
+
+        # Le manifeste n'est publié qu'après l'écriture des fichiers : un sync
+        # interrompu laisse des fichiers orphelins ignorés à la lecture
+        self._write_manifest(manifest)
+        self.rollups.commit(rollup_batch, manifest['watermark'])
+
+        print(f"Store historique synchronisé: {added} nouvelles lignes")
+        return added, manifest['coverage_start']
+
+    @staticmethod
+    def _covered_days(manifest: Dict[str, Any]) -> int:
+        """Nombre de jours couverts par le store"""
+        if manifest['coverage_start'] is None:
+            return 0
+        return (pd.Timestamp.now(tz='UTC') - parse_utc(manifest['coverage_start'])).days + 1
+
+    def _partitions_since(self, days_back: int, manifest: Dict[str, Any]) -> Dict[str, List[Path]]:
+        """Fichiers de chaque partition (jour UTC) couvrant les `days_back` derniers jours, dans l'ordre"""
+        first_day = utc_cutoff(days_back).date()
+        return {
+            partition: [self.root_dir / partition / name for name in manifest['partitions'][partition]]
+            for partition in sorted(manifest['partitions'])
+            if date.fromisoformat(partition.split('=', 1)[1]) >= first_day
+        }
+
+    def iter_tables(self, days_back: int = 30, columns: Optional[List[str]] = None) -> Iterator[pa.Table]:
+        """Lire l'historique local partition par partition (une table Arrow par jour UTC, triée par timestamp)"""
+        manifest = self.read_manifest()
+        # Borne en UTC, comme les partitions et les filtres PostgREST
+        cutoff = utc_cutoff(days_back)
+        for paths in self._partitions_since(days_back, manifest).values():
+            # Les buffers Arrow référencent directement la projection mémoire
+            tables = [ipc.open_file(pa.memory_map(str(path), 'r')).read_all() for path in paths]
+            if not tables:
+                continue
+            table = pa.concat_tables([t.select(columns) if columns else t for t in tables])
+            if 'timestamp' in table.column_names:
+                table = table.filter(pc.greater_equal(table['timestamp'], pa.scalar(cutoff, type=table['timestamp'].type)))
+                if len(tables) > 1:
+                    table = table.sort_by('timestamp')
+            yield table
+
+    def load_table(self, days_back: int = 30, columns: Optional[List[str]] = None) -> pa.Table:
+        """Lire l'historique local sous forme de table Arrow (memory-mapped, sans copie)"""
+        # Partitions triées par jour et triées chacune : la concaténation reste chronologique
+        tables = list(self.iter_tables(days_back, columns))
+        if not tables:
+            schema = pa.schema([HISTORY_SCHEMA.field(c) for c in columns]) if columns else HISTORY_SCHEMA
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    def iter_partitions(self, days_back: int = 30, columns: Optional[List[str]] = None,
+                        include_id: bool = False) -> Iterator[pd.DataFrame]:
+        """Comme `load`, un DataFrame compact par partition (jour UTC) non vide"""
+        if columns is None:
+            columns = [name for name in HISTORY_SCHEMA.names if include_id or name != 'id']
+        for table in self.iter_tables(days_back, columns):
+            if table.num_rows:
+                yield compact_table(table, HISTORY_DTYPES)
+
+    def load(self, days_back: int = 30, columns: Optional[List[str]] = None,
+             include_id: bool = False) -> pd.DataFrame:
+        """Lire l'historique local sous forme de DataFrame compact (`HISTORY_DTYPES`, sans `id` par défaut)"""
+        if columns is None:
+            columns = [name for name in HISTORY_SCHEMA.names if include_id or name != 'id']
+        table = self.load_table(days_back, columns)
+        if table.num_rows == 0:
+            return pd.DataFrame()
+        return compact_table(table, HISTORY_DTYPES)
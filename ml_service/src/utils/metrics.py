@@ -0,0 +1,91 @@
+
+"""
+Métriques Prometheus du service ML
+
+Instrumentation en processus à faible coût (histogrammes et compteurs
+prometheus_client) : latence par route, durée des étapes de chaque
+prédiction, requêtes Supabase, chargement des modèles et files des
+exécuteurs. L'API les expose sur `/metrics`.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 5000, 10000, 50000, 100000)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ecotrajet_http_request_duration_seconds',
+    "Latence des requêtes HTTP par route",
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+
+STAGE_SECONDS = Histogram(
+    'ecotrajet_stage_duration_seconds',
+    "Durée des étapes de traitement (chargement, préprocessing, inférence, sérialisation)",
+    ['operation', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+
+SUPABASE_FETCH_SECONDS = Histogram(
+    'ecotrajet_supabase_fetch_duration_seconds',
+    "Durée des requêtes PostgREST (réponse et décodage JSON)",
+    ['table'],
+    buckets=LATENCY_BUCKETS
+)
+
+SUPABASE_FETCH_ROWS = Histogram(
+    'ecotrajet_supabase_fetch_rows',
+    "Nombre de lignes renvoyées par requête PostgREST",
+    ['table'],
+    buckets=ROW_BUCKETS
+)
+
+SUPABASE_FETCH_ERRORS = Counter(
+    'ecotrajet_supabase_fetch_errors',
+    "Requêtes PostgREST en erreur",
+    ['table']
+)
+
+MODEL_LOAD_SECONDS = Histogram(
+    'ecotrajet_model_load_duration_seconds',
+    "Durée de chargement des modèles",
+    ['model'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+EXECUTOR_WAIT_SECONDS = Histogram(
+    'ecotrajet_executor_wait_seconds',
+    "Attente d'une tâche dans la file de l'exécuteur avant son démarrage",
+    ['pool'],
+    buckets=LATENCY_BUCKETS
+)
+
+EXECUTOR_RUN_SECONDS = Histogram(
+    'ecotrajet_executor_run_seconds',
+    "Durée d'exécution des tâches déportées hors de la boucle asyncio",
+    ['pool'],
+    buckets=LATENCY_BUCKETS
+)
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'ecotrajet_executor_queue_depth',
+    "Tâches en attente d'un worker libre",
+    ['pool']
+)
+
+EXECUTOR_INFLIGHT = Gauge(
+    'ecotrajet_executor_inflight',
+    "Tâches soumises et non terminées (en file ou en cours)",
+    ['pool']
+)
+
+@contextmanager
+def stage_timer(operation: str, stage: str) -> Iterator[None]:
+    """Chronométrer une étape : `with stage_timer('predict', 'inference'): ...`"""
+    with STAGE_SECONDS.labels(operation, stage).time():
+        yield
@@ -5,15 +5,16 @@ Module de préprocessing des données pour les modèles ML
 
 import pandas as pd
 import numpy as np
-from typing import Tuple, Optional
-from sklearn.preprocessing import StandardScaler
+from typing import Tuple, Optional, Iterator
 import math
 
+EARTH_RADIUS_KM = 6371  # Rayon de la Terre en km
+
 def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calculer la distance entre deux points GPS en utilisant la formule de Haversine
     """
-    R = 6371  # Rayon de la Terre en km
+    R = EARTH_RADIUS_KM
     
     lat1_rad = math.radians(lat1)
     lat2_rad = math.radians(lat2)
@@ -26,6 +27,39 @@ def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: fl
     
     return R * c
 
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Version vectorisée de `calculate_distance_haversine` (tableaux NumPy, broadcasting)
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    delta_lat = lat2 - lat1
+    delta_lon = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(delta_lon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    
+    return EARTH_RADIUS_KM * c
+
+# Features d'entrée du modèle LSTM Vélib', dans l'ordre attendu par le modèle
+VELIB_FEATURE_COLUMNS = [
+    'hour_sin', 'hour_cos', 'dow_sin', 'dow_cos',
+    'mechanical', 'ebike', 'numdocksavailable'
+]
+
+def cyclical_time_features(hours: np.ndarray, days_of_week: np.ndarray) -> np.ndarray:
+    """
+    Encodage cyclique (sin/cos) de l'heure et du jour de la semaine
+
+    Retourne un tableau [..., 4] : hour_sin, hour_cos, dow_sin, dow_cos
+    """
+    hour_angle = 2 * np.pi * np.asarray(hours) / 24
+    dow_angle = 2 * np.pi * np.asarray(days_of_week) / 7
+    return np.stack([
+        np.sin(hour_angle), np.cos(hour_angle),
+        np.sin(dow_angle), np.cos(dow_angle)
+    ], axis=-1)
+
 def preprocess_velib_data(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
     """
     Préprocesser les données Vélib' pour l'entraînement LSTM
@@ -40,19 +74,14 @@ def preprocess_velib_data(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
     df['month'] = df['timestamp'].dt.month
     
     # Features cycliques pour capturer la périodicité
-    df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-    df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
-    df['dow_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
-    df['dow_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
-    
-    # Sélectionner les features
-    feature_columns = [
-        'hour_sin', 'hour_cos', 'dow_sin', 'dow_cos',
-        'mechanical', 'ebike', 'numdocksavailable'
-    ]
+    time_features = cyclical_time_features(df['hour'].values, df['day_of_week'].values)
+    df['hour_sin'] = time_features[:, 0]
+    df['hour_cos'] = time_features[:, 1]
+    df['dow_sin'] = time_features[:, 2]
+    df['dow_cos'] = time_features[:, 3]
     
     # Vérifier que toutes les colonnes existent
-    available_columns = [col for col in feature_columns if col in df.columns]
+    available_columns = [col for col in VELIB_FEATURE_COLUMNS if col in df.columns]
     if not available_columns:
         return np.array([]), np.array([])
     
@@ -61,43 +90,141 @@ def preprocess_velib_data(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
     
     return X, y
 
-def create_lstm_sequences(X: np.ndarray, y: np.ndarray, sequence_length: int = 24) -> Tuple[np.ndarray, np.ndarray]:
+def preprocess_velib_station_data(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Préprocesser les données Vélib' station par station
+
+    Les lignes sont triées par station puis par date, de sorte que les
+    séquences LSTM puissent être découpées sans traverser deux stations.
+    Retourne X, y et le code station de chaque ligne.
+    """
+    if df.empty or 'stationcode' not in df.columns:
+        return np.array([]), np.array([]), np.array([])
+    
+    df = df.sort_values(['stationcode', 'timestamp'], kind='stable')
+    X, y = preprocess_velib_data(df)
+    return X, y, df['stationcode'].to_numpy()
+
+def lstm_window_starts(station_codes: np.ndarray, sequence_length: int = 24) -> np.ndarray:
+    """
+    Indices de début des séquences valides (entièrement dans une station)
+
+    Une séquence commençant en i couvre les lignes i..i+sequence_length-1 et
+    prédit la ligne i+sequence_length, qui doit appartenir à la même station.
+    """
+    n = len(station_codes)
+    if n <= sequence_length:
+        return np.array([], dtype=np.int64)
+    
+    # Bornes [début, fin) de chaque station dans les lignes triées
+    change = np.flatnonzero(station_codes[1:] != station_codes[:-1]) + 1
+    bounds = np.concatenate([[0], change, [n]])
+    lengths = np.diff(bounds) - sequence_length
+    
+    valid = lengths > 0
+    starts = bounds[:-1][valid]
+    lengths = lengths[valid]
+    if not len(lengths):
+        return np.array([], dtype=np.int64)
+    
+    # Concaténation vectorisée des plages start..start+length-1
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+def lstm_window_view(X: np.ndarray, sequence_length: int = 24) -> np.ndarray:
+    """
+    Vue en lecture seule [n_fenêtres, sequence_length, features] sur X, sans copie
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(X, sequence_length, axis=0)
+    return windows.transpose(0, 2, 1)
+
+def iter_lstm_batches(X: np.ndarray, y: np.ndarray, starts: np.ndarray, sequence_length: int = 24,
+                      batch_size: int = 32, shuffle: bool = False,
+                      seed: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Générer des lots (X_seq, y_seq) à la demande
+
+    Seul le lot courant est matérialisé : la mémoire reste proportionnelle
+    aux données brutes et non à sequence_length fois leur taille.
+    """
+    windows = lstm_window_view(X, sequence_length)
+    order = np.random.default_rng(seed).permutation(starts) if shuffle else starts
+    
+    for i in range(0, len(order), batch_size):
+        batch = order[i:i + batch_size]
+        yield windows[batch], y[batch + sequence_length]
+
+def lstm_dataset(X: np.ndarray, y: np.ndarray, starts: np.ndarray, sequence_length: int = 24,
+                 batch_size: int = 32, shuffle: bool = False, seed: Optional[int] = None):
+    """
+    Source `tf.data` paresseuse construite sur `iter_lstm_batches`
+    """
+    import tensorflow as tf
+    
+    n_features = X.shape[1]
+    return tf.data.Dataset.from_generator(
+        lambda: iter_lstm_batches(X, y, starts, sequence_length, batch_size, shuffle, seed),
+        output_signature=(
+            tf.TensorSpec(shape=(None, sequence_length, n_features), dtype=tf.as_dtype(X.dtype)),
+            tf.TensorSpec(shape=(None,), dtype=tf.as_dtype(y.dtype))
+        )
+    ).prefetch(tf.data.AUTOTUNE)
+
+def create_lstm_sequences(X: np.ndarray, y: np.ndarray, sequence_length: int = 24,
+                          station_codes: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
     Créer des séquences pour l'entraînement LSTM
+
+    Sans `station_codes`, retourne une vue en lecture seule sur X (aucune
+    copie). Avec `station_codes`, seules les séquences internes à une
+    station sont gardées ; le résultat est alors matérialisé. Pour de gros
+    volumes, préférer `iter_lstm_batches` / `lstm_dataset`.
     """
-    if len(X) < sequence_length:
+    if len(X) <= sequence_length:
         return np.array([]), np.array([])
     
-    X_seq, y_seq = [], []
-    
-    for i in range(len(X) - sequence_length):
-        X_seq.append(X[i:(i + sequence_length)])
-        y_seq.append(y[i + sequence_length])
+    if station_codes is None:
+        n_windows = len(X) - sequence_length
+        return lstm_window_view(X, sequence_length)[:n_windows], y[sequence_length:]
     
-    return np.array(X_seq), np.array(y_seq)
+    starts = lstm_window_starts(station_codes, sequence_length)
+    if not len(starts):
+        return np.array([]), np.array([])
+    return lstm_window_view(X, sequence_length)[starts], y[starts + sequence_length]
 
 def preprocess_trends_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Préprocesser les données pour Prophet (analyse des tendances)
+    
+    Accepte les rollups journaliers par station (`bikes_sum`, `docks_sum`,
+    une ligne par station et par jour) ou des snapshots bruts.
     """
     if df.empty:
         return pd.DataFrame()
     
-    # Agrégation quotidienne
-    daily_data = df.groupby(df['timestamp'].dt.date).agg({
-        'numbikesavailable': 'mean',
-        'numdocksavailable': 'mean'
-    }).reset_index()
+    if 'bikes_sum' in df.columns:
+        # Rollups journaliers : sommes par jour, sans relire les snapshots
+        daily_data = df.groupby('date').agg({
+            'bikes_sum': 'sum',
+            'docks_sum': 'sum'
+        }).reset_index()
+        bikes, docks = daily_data['bikes_sum'], daily_data['docks_sum']
+        dates = daily_data['date']
+    else:
+        # Agrégation quotidienne
+        daily_data = df.groupby(df['timestamp'].dt.date).agg({
+            'numbikesavailable': 'mean',
+            'numdocksavailable': 'mean'
+        }).reset_index()
+        bikes, docks = daily_data['numbikesavailable'], daily_data['numdocksavailable']
+        dates = daily_data['timestamp']
     
     # Calculer le taux d'occupation
-    daily_data['occupation_rate'] = (
-        daily_data['numbikesavailable'] / 
-        (daily_data['numbikesavailable'] + daily_data['numdocksavailable'])
-    )
+    daily_data['occupation_rate'] = bikes / (bikes + docks)
     
     # Format Prophet (ds = date, y = valeur à prédire)
     prophet_data = pd.DataFrame({
-        'ds': pd.to_datetime(daily_data['timestamp']),
+        'ds': pd.to_datetime(dates),
         'y': daily_data['occupation_rate'].fillna(0.5)
     })
     
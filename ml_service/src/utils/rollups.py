@@ -0,0 +1,260 @@
+
+"""
+Agrégats horaires et journaliers de l'historique Vélib', maintenus incrémentalement
+
+Chaque synchronisation du store historique replie uniquement les nouvelles
+lignes dans des agrégats par station : nombre de snapshots, somme / min / max
+des vélos et des bornes libres, somme des taux d'occupation, snapshots en
+faible disponibilité et variations du nombre de vélos (trajets estimés). Les
+agrégats sont stockés en Arrow IPC, une partition par jour local
+(`date=YYYY-MM-DD/hourly.arrow` et `daily.arrow`), avec un manifeste qui
+référence le watermark de l'historique déjà replié. L'analyse des tendances
+lit ainsi quelques milliers de lignes par jour, quel que soit le nombre de
+snapshots.
+"""
+
+import os
+import json
+import shutil
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from src.inference import LOW_AVAILABILITY_BIKES
+
+# Fuseau utilisé pour découper les journées (partitions, tendances quotidiennes)
+ROLLUP_TIMEZONE = os.getenv('TRENDS_TIMEZONE', 'Europe/Paris')
+MANIFEST_NAME = "_manifest.json"
+
+# Agrégation de chaque métrique lors de la fusion de deux rollups
+ROLLUP_METRICS = {
+    'count': 'sum',
+    'bikes_sum': 'sum', 'bikes_min': 'min', 'bikes_max': 'max',
+    'docks_sum': 'sum', 'docks_min': 'min', 'docks_max': 'max',
+    'occupancy_sum': 'sum',
+    'low_count': 'sum',
+    'bike_changes': 'sum',
+}
+_METRIC_FIELDS = [pa.field(name, pa.float64() if name == 'occupancy_sum' else pa.int64()) for name in ROLLUP_METRICS]
+HOURLY_SCHEMA = pa.schema([('stationcode', pa.string()), ('hour', pa.timestamp('us', tz='UTC')), *_METRIC_FIELDS])
+DAILY_SCHEMA = pa.schema([('stationcode', pa.string()), ('date', pa.date32()), *_METRIC_FIELDS])
+
+_NS_PER_HOUR = 3_600 * 10**9
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+def wall_clock(timestamps: pd.Series, timezone: str = ROLLUP_TIMEZONE) -> Tuple[np.ndarray, np.ndarray]:
+    """Numéro du jour local (jours depuis 1970) et heure locale de chaque timestamp"""
+    local = pd.to_datetime(timestamps, utc=True).dt.tz_convert(timezone).dt.tz_localize(None)
+    wall_ns = local.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return wall_ns // _NS_PER_DAY, (wall_ns // _NS_PER_HOUR) % 24
+
+def combine_rollups(rollups: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Fusionner des rollups partiels portant sur les mêmes clés"""
+    return rollups.groupby(keys, sort=False).agg(ROLLUP_METRICS).reset_index()
+
+def hourly_rollups(history: pd.DataFrame, last: Optional[Dict[str, List[int]]] = None) -> pd.DataFrame:
+    """
+    Agréger des snapshots par (station, heure)
+
+    `last` associe à chaque station son dernier snapshot déjà replié
+    ([timestamp en ns, vélos]) : la variation avec le premier snapshot plus
+    récent du lot est comptée, et `last` est mis à jour avec le lot.
+    """
+    if history.empty:
+        return HOURLY_SCHEMA.empty_table().to_pandas()
+
+    timestamps = pd.to_datetime(history['timestamp'], utc=True).dt.tz_localize(None)
+    ts_ns = timestamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    codes, station_codes = pd.factorize(history['stationcode'])
+    order = np.lexsort((ts_ns, codes))
+
+    codes, ts_ns = codes[order], ts_ns[order]
+    bikes = history['numbikesavailable'].to_numpy(dtype=np.float64, na_value=0)[order].astype(np.int64)
+    docks = history['numdocksavailable'].to_numpy(dtype=np.float64, na_value=0)[order].astype(np.int64)
+
+    # Variations entre snapshots consécutifs d'une même station
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    changes = np.zeros(len(codes), dtype=np.int64)
+    changes[1:] = np.abs(np.diff(bikes))
+    changes[first] = 0
+
+    if last is not None:
+        first_rows = np.flatnonzero(first)
+        last_rows = np.append(first_rows[1:] - 1, len(codes) - 1)
+        for first_row, last_row in zip(first_rows.tolist(), last_rows.tolist()):
+            station = station_codes[codes[first_row]]
+            known = last.get(station)
+            if known is not None and known[0] < ts_ns[first_row]:
+                changes[first_row] = abs(int(bikes[first_row]) - known[1])
+            if known is None or known[0] < ts_ns[last_row]:
+                last[station] = [int(ts_ns[last_row]), int(bikes[last_row])]
+
+    slots = bikes + docks
+    rollups = combine_rollups(pd.DataFrame({
+        'code': codes,
+        'hour': ts_ns - ts_ns % _NS_PER_HOUR,
+        'count': np.ones(len(codes), dtype=np.int64),
+        'bikes_sum': bikes, 'bikes_min': bikes, 'bikes_max': bikes,
+        'docks_sum': docks, 'docks_min': docks, 'docks_max': docks,
+        'occupancy_sum': np.divide(bikes, slots, out=np.zeros(len(codes)), where=slots > 0),
+        'low_count': (bikes <= LOW_AVAILABILITY_BIKES).astype(np.int64),
+        'bike_changes': changes,
+    }), ['code', 'hour'])
+
+    rollups.insert(0, 'stationcode', np.asarray(station_codes, dtype=object)[rollups.pop('code').to_numpy()])
+    rollups['hour'] = pd.to_datetime(rollups['hour'], utc=True)
+    return rollups
+
+def daily_rollups(hourly: pd.DataFrame) -> pd.DataFrame:
+    """Agréger des rollups horaires par (station, jour local)"""
+    if hourly.empty:
+        return DAILY_SCHEMA.empty_table().to_pandas(date_as_object=False)
+    day_number, _ = wall_clock(hourly['hour'])
+    daily = hourly.drop(columns='hour').assign(date=day_number.astype('datetime64[D]'))
+    return combine_rollups(daily, ['stationcode', 'date'])
+
+class RollupBatch:
+    """Pages repliées par une synchronisation, en attente de `RollupStore.commit`"""
+
+    def __init__(self, last: Dict[str, List[int]]):
+        # Dernier snapshot connu par station (variations de vélos entre pages)
+        self.last = last
+        self.pending: List[pd.DataFrame] = []
+
+class RollupStore:
+    """
+    Rollups horaires et journaliers sur disque
+
+    L'état d'un repli (pages en attente, dernier snapshot par station) est
+    porté par un `RollupBatch` propre à chaque synchronisation ; l'appelant
+    (`HistoryStore.sync`) sérialise la séquence begin / fold / commit.
+    """
+
+    def __init__(self, root_dir: Path):
+        self.root_dir = Path(root_dir)
+        self.manifest_path = self.root_dir / MANIFEST_NAME
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """Lire le manifeste (watermark replié, jours présents, dernier snapshot par station)"""
+        if not self.manifest_path.exists():
+            return {'watermark': None, 'dates': [], 'last': {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        """Écrire le manifeste de façon atomique"""
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_current(self, watermark: Optional[Dict[str, Any]]) -> bool:
+        """Les rollups couvrent-ils l'historique jusqu'à ce watermark ?"""
+        return self.read_manifest()['watermark'] == watermark
+
+    def begin(self) -> RollupBatch:
+        """Nouveau repli, à partir du dernier snapshot par station publié"""
+        return RollupBatch(self.read_manifest()['last'])
+
+    def fold(self, batch: RollupBatch, chunk: pd.DataFrame):
+        """Replier une page de snapshots dans `batch` (publiée par `commit`)"""
+        if not chunk.empty:
+            batch.pending.append(hourly_rollups(chunk, batch.last))
+
+    def _path(self, day: str, kind: str) -> Path:
+        return self.root_dir / f"date={day}" / f"{kind}.arrow"
+
+    def _read(self, day: str, kind: str, columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+        path = self._path(day, kind)
+        if not path.exists():
+            return None
+        table = ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+        return table.select(columns) if columns else table
+
+    def _write(self, day: str, kind: str, rollups: pd.DataFrame, schema: pa.Schema):
+        """Remplacer une partition de façon atomique"""
+        path = self._path(day, kind)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with ipc.new_file(tmp_path, schema) as writer:
+            writer.write_table(pa.Table.from_pandas(rollups, schema=schema, preserve_index=False))
+        os.replace(tmp_path, path)
+
+    def commit(self, batch: RollupBatch, watermark: Optional[Dict[str, Any]]):
+        """
+        Fusionner les pages repliées dans les partitions des jours concernés
+
+        Le manifeste n'est publié qu'après la réécriture des partitions : si le
+        commit est interrompu, le watermark ne correspond plus à celui de
+        l'historique et les rollups sont reconstruits au sync suivant.
+        """
+        manifest = self.read_manifest()
+        dates = set(manifest['dates'])
+
+        if batch.pending:
+            hourly = combine_rollups(pd.concat(batch.pending, ignore_index=True), ['stationcode', 'hour'])
+            day_number, _ = wall_clock(hourly['hour'])
+            for day, index in pd.Series(day_number).groupby(day_number).indices.items():
+                day = str(np.datetime64(int(day), 'D'))
+                existing = self._read(day, 'hourly')
+                merged = hourly.iloc[index]
+                if existing is not None:
+                    merged = combine_rollups(pd.concat([existing.to_pandas(), merged], ignore_index=True),
+                                             ['stationcode', 'hour'])
+                merged = merged.sort_values(['stationcode', 'hour'], ignore_index=True)
+                self._write(day, 'hourly', merged, HOURLY_SCHEMA)
+                self._write(day, 'daily', daily_rollups(merged), DAILY_SCHEMA)
+                dates.add(day)
+
+        manifest.update({
+            'watermark': watermark,
+            'dates': sorted(dates),
+            'last': batch.last
+        })
+        self._write_manifest(manifest)
+
+    def rebuild(self, chunks: Iterable[pd.DataFrame], watermark: Optional[Dict[str, Any]]):
+        """
+        Reconstruire tous les rollups depuis l'historique local
+
+        `chunks` est parcouru dans l'ordre chronologique (une partition à la
+        fois) : seuls les rollups horaires repliés restent en mémoire jusqu'au
+        commit unique.
+        """
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+        batch = RollupBatch({})
+        rows = 0
+        for chunk in chunks:
+            self.fold(batch, chunk)
+            rows += len(chunk)
+        self.commit(batch, watermark)
+        print(f"Rollups reconstruits depuis l'historique: {rows} lignes")
+
+    def load(self, kind: str, days_back: int = 30, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Lire les rollups `hourly` ou `daily` des `days_back` derniers jours locaux"""
+        schema = HOURLY_SCHEMA if kind == 'hourly' else DAILY_SCHEMA
+        first_day = (pd.Timestamp.now(tz=ROLLUP_TIMEZONE) - pd.Timedelta(days=days_back)).date()
+        tables = [
+            table for table in (
+                self._read(day, kind, columns)
+                for day in self.read_manifest()['dates'] if date.fromisoformat(day) >= first_day
+            )
+            if table is not None
+        ]
+        if not tables:
+            empty = pa.schema([schema.field(c) for c in columns]) if columns else schema
+            return empty.empty_table().to_pandas(date_as_object=False)
+        return pa.concat_tables(tables).to_pandas(date_as_object=False)
+
+    def load_hourly(self, days_back: int = 30, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self.load('hourly', days_back, columns)
+
+    def load_daily(self, days_back: int = 30, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self.load('daily', days_back, columns)
@@ -0,0 +1,42 @@
+
+"""
+Encodage JSON rapide des grosses réponses
+
+orjson sérialise directement les tableaux NumPy et les datetimes, sans passer
+par des objets Python intermédiaires. Sans orjson, repli sur le module json
+standard (même sortie, plus lent).
+"""
+
+import json
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    orjson = None
+
+# Dispositions de réponse proposées par les endpoints de prédiction
+LAYOUT_DEFAULT = 'default'    # modèles Pydantic validés, encodeur FastAPI
+LAYOUT_ROWS = 'rows'          # même structure, construite et encodée sans validation
+LAYOUT_COLUMNAR = 'columnar'  # tableaux parallèles par station
+LAYOUTS = (LAYOUT_DEFAULT, LAYOUT_ROWS, LAYOUT_COLUMNAR)
+
+def _default(value: Any) -> Any:
+    """Types non natifs pour le repli json standard"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type non sérialisable: {type(value).__name__}")
+
+def dumps(payload: Any) -> bytes:
+    """Encoder `payload` (dicts, listes, tableaux NumPy, datetimes) en JSON compact"""
+    if orjson is not None:
+        # Tableaux non contigus ou de type non supporté : repli sur `_default`
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
@@ -0,0 +1,118 @@
+
+"""
+Rapport de coût des imports et de la mémoire résidente
+
+`import_profiler` remplace `builtins.__import__` pendant le démarrage pour
+mesurer chaque premier import : durée et croissance de la mémoire résidente
+(RSS), attribuées au module du service (`src.*`, `api.*`) ou au paquet tiers
+racine (`pandas`, `tensorflow`...). Les coûts sont exclusifs : un paquet
+importé par un autre est compté à part. La mesure est retirée une fois le
+rapport affiché ; le coût d'un modèle chargé plus tard (pile importée
+comprise) est mesuré par le registre de modèles (`/health/models`).
+"""
+
+import os
+import sys
+import time
+import builtins
+import threading
+from typing import Any, Dict, List, Optional
+
+FIRST_PARTY_PACKAGES = ('src', 'api', 'benchmarks', 'scripts')
+
+def current_rss_mb() -> float:
+    """Mémoire résidente actuelle du processus (Mo)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, IndexError):
+        # Hors Linux : pic de mémoire résidente (Ko sous Linux, octets sous macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+class ImportProfiler:
+    def __init__(self):
+        self.modules: Dict[str, Dict[str, float]] = {}
+        self.installed_at: Optional[float] = None
+        self.rss_at_install: Optional[float] = None
+        self._original_import = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Activer la mesure (à appeler avant les imports à mesurer)"""
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        self.installed_at = time.perf_counter()
+        self.rss_at_install = current_rss_mb()
+
+    def uninstall(self):
+        """Rétablir `builtins.__import__` (les mesures déjà faites restent dans le rapport)"""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    @staticmethod
+    def _key(name: str) -> str:
+        """Module du service en entier, paquet tiers par sa racine"""
+        root = name.partition('.')[0]
+        return name if root in FIRST_PARTY_PACKAGES else root
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Modules déjà chargés et imports relatifs : coût négligeable, pas de mesure
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        key = self._key(name)
+        stack = self._local.__dict__.setdefault('stack', [])
+        if stack and stack[-1]['key'] == key:
+            # Sous-module du paquet en cours de mesure
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        frame = {'key': key, 'child_seconds': 0.0, 'child_rss_mb': 0.0}
+        stack.append(frame)
+        start, rss = time.perf_counter(), current_rss_mb()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            stack.pop()
+            elapsed, grown = time.perf_counter() - start, current_rss_mb() - rss
+            with self._lock:
+                entry = self.modules.setdefault(key, {'seconds': 0.0, 'rss_mb': 0.0})
+                entry['seconds'] += elapsed - frame['child_seconds']
+                entry['rss_mb'] += grown - frame['child_rss_mb']
+            if stack:
+                stack[-1]['child_seconds'] += elapsed
+                stack[-1]['child_rss_mb'] += grown
+
+    def report(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """Coût des imports par module, du plus cher au moins cher"""
+        with self._lock:
+            modules: List[Dict[str, Any]] = sorted(
+                ({'module': key, 'seconds': round(entry['seconds'], 4), 'rss_mb': round(entry['rss_mb'], 1)}
+                 for key, entry in self.modules.items()),
+                key=lambda item: item['seconds'], reverse=True
+            )
+            total = sum(entry['seconds'] for entry in self.modules.values())
+        return {
+            'import_seconds': round(total, 3),
+            'rss_mb': round(current_rss_mb(), 1),
+            'rss_at_install_mb': round(self.rss_at_install, 1) if self.rss_at_install is not None else None,
+            'modules': modules[:top] if top else modules
+        }
+
+    def print_report(self, top: int = 15, elapsed: Optional[float] = None):
+        """Afficher le rapport au démarrage"""
+        report = self.report(top)
+        header = f"Imports: {report['import_seconds']:.2f}s, mémoire résidente: {report['rss_mb']:.0f} Mo"
+        if elapsed is not None:
+            header += f", démarrage: {elapsed:.2f}s"
+        print(header)
+        for item in report['modules']:
+            print(f"  {item['module']:40s} {item['seconds']:8.3f}s {item['rss_mb']:8.1f} Mo")
+
+# Instance globale
+import_profiler = ImportProfiler()
@@ -0,0 +1,99 @@
+"""
+Tests du cache des réponses (calcul unique des requêtes simultanées, annulation, invalidation)
+"""
+
+import asyncio
+from typing import List
+
+from pydantic import BaseModel
+
+from api.cache import LRUCacheBackend, ResponseCache
+
+class Request(BaseModel):
+    station_ids: List[int]
+
+def make_cache() -> ResponseCache:
+    return ResponseCache(LRUCacheBackend(max_entries=8, max_bytes=1024), ttls={'predict': 60})
+
+def test_concurrent_identical_requests_compute_once():
+    cache = make_cache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"body"
+
+    async def scenario():
+        # Mêmes IDs dans un autre ordre : même clé normalisée
+        return await asyncio.gather(
+            cache.get_or_compute('predict', Request(station_ids=[1, 2]), compute),
+            cache.get_or_compute('predict', Request(station_ids=[2, 1]), compute),
+            cache.get_or_compute('predict', Request(station_ids=[1, 2, 2]), compute),
+        )
+
+    assert asyncio.run(scenario()) == [b"body"] * 3
+    assert calls == 1
+    assert cache.stats['predict']['misses'] == 1
+    assert len(cache.backend) == 1
+
+def test_waiters_recompute_when_first_caller_is_cancelled():
+    cache = make_cache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(3600)
+        return b"body"
+
+    async def scenario():
+        request = Request(station_ids=[1])
+        first = asyncio.create_task(cache.get_or_compute('predict', request, compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute('predict', request, compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await asyncio.wait_for(waiter, timeout=1)
+        return first.cancelled(), result
+
+    assert asyncio.run(scenario()) == (True, b"body")
+    assert calls == 2
+    assert not cache._inflight
+
+def test_result_computed_across_invalidation_is_not_stored():
+    cache = make_cache()
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def compute():
+            started.set()
+            await release.wait()
+            return b"stale"
+
+        task = asyncio.create_task(cache.get_or_compute('predict', Request(station_ids=[1]), compute))
+        await started.wait()
+        cache.invalidate('predict')
+        release.set()
+        return await task
+
+    # L'appelant reçoit son résultat, mais il n'est pas publié dans le cache
+    assert asyncio.run(scenario()) == b"stale"
+    assert len(cache.backend) == 0
+
+def test_backend_evicts_least_recently_used_over_byte_budget():
+    backend = LRUCacheBackend(max_entries=8, max_bytes=100)
+    backend.set(('predict', 'a'), b"x" * 40, ttl=60)
+    backend.set(('predict', 'b'), b"x" * 40, ttl=60)
+    assert backend.get(('predict', 'a')) is not None
+    backend.set(('predict', 'c'), b"x" * 40, ttl=60)
+
+    assert backend.get(('predict', 'b')) is None
+    assert backend.bytes == 80
+    # Plus gros que tout le budget : non conservé
+    backend.set(('predict', 'd'), b"x" * 200, ttl=60)
+    assert backend.get(('predict', 'd')) is None
+    assert backend.bytes == 80
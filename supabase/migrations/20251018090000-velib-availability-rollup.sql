@@ -0,0 +1,62 @@
+
+-- Agrégats horaires ou journaliers de l'historique Vélib', calculés côté serveur
+-- (appelé par le service ML via POST /rest/v1/rpc/velib_availability_rollup)
+CREATE OR REPLACE FUNCTION public.velib_availability_rollup(
+  p_start TIMESTAMP WITH TIME ZONE,
+  p_end TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  p_bucket TEXT DEFAULT 'day',
+  p_stationcodes TEXT[] DEFAULT NULL,
+  p_timezone TEXT DEFAULT 'Europe/Paris'
+)
+RETURNS TABLE (
+  stationcode TEXT,
+  bucket TIMESTAMP WITH TIME ZONE,
+  count BIGINT,
+  bikes_sum BIGINT,
+  bikes_min INTEGER,
+  bikes_max INTEGER,
+  docks_sum BIGINT,
+  docks_min INTEGER,
+  docks_max INTEGER,
+  occupancy_sum DOUBLE PRECISION,
+  low_count BIGINT,
+  bike_changes BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+  WITH snapshots AS (
+    SELECT
+      h.stationcode,
+      -- Heures en UTC, journées dans le fuseau local
+      CASE WHEN p_bucket = 'hour'
+        THEN date_trunc('hour', h.timestamp)
+        ELSE date_trunc('day', h.timestamp AT TIME ZONE p_timezone) AT TIME ZONE p_timezone
+      END AS bucket,
+      h.numbikesavailable AS bikes,
+      h.numdocksavailable AS docks,
+      abs(h.numbikesavailable - lag(h.numbikesavailable) OVER (PARTITION BY h.stationcode ORDER BY h.timestamp)) AS change
+    FROM public.velib_availability_history h
+    WHERE h.timestamp >= p_start
+      AND h.timestamp < p_end
+      AND (p_stationcodes IS NULL OR h.stationcode = ANY(p_stationcodes))
+  )
+  SELECT
+    s.stationcode,
+    s.bucket,
+    count(*),
+    sum(s.bikes),
+    min(s.bikes),
+    max(s.bikes),
+    sum(s.docks),
+    min(s.docks),
+    max(s.docks),
+    sum(CASE WHEN s.bikes + s.docks > 0 THEN s.bikes::DOUBLE PRECISION / (s.bikes + s.docks) ELSE 0 END),
+    count(*) FILTER (WHERE s.bikes <= 3),
+    coalesce(sum(s.change), 0)::BIGINT
+  FROM snapshots s
+  GROUP BY s.stationcode, s.bucket
+  ORDER BY s.bucket, s.stationcode;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.velib_availability_rollup(TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, TEXT, TEXT[], TEXT) TO anon, authenticated;